@@ -17,7 +17,8 @@ fuzz_all_api.py — 自动登录 + 可选文件上传（拿到 document_id 后
   <out>/htmlcov/index.html   # HTML 报告（红色高亮 5xx / 异常）
 """
 
-import argparse, json, random, sys, time, uuid, os
+import argparse, json, random, sys, threading, time, uuid, os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Any, Dict, Optional, Tuple
 import requests, html as html_escape
@@ -189,6 +190,51 @@ def upload_document(base: str, requester, headers: Dict[str, str], timeout: floa
         pass
     return None
 
+# ---------------------- 并发安全的结果记录 ----------------------
+class Recorder:
+    """多线程共享：JSONL 追加写与 summary 统计都在同一把锁内完成。"""
+
+    def __init__(self, report: Path, summary: Dict[str, Dict[str, Any]], doc_id: Optional[int]):
+        self._fh = open(report, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.summary = summary
+        self.doc_id = doc_id
+        self.any_bad = False
+
+    def _write(self, obj: Dict[str, Any]) -> None:
+        # 调用方已持锁；整行一次写入，避免多线程交错
+        self._fh.write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+    def response(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._write(entry)
+            s = self.summary[entry["endpoint"]][entry["method"]]
+            s["attempts"] += 1
+            s["by_status"][str(entry["status"])] = s["by_status"].get(str(entry["status"]), 0) + 1
+            if not s["sample_req"]:
+                s["sample_req"] = entry["req"]; s["sample_resp"] = entry["resp_sample"]
+            if 500 <= entry["status"] < 600:
+                self.any_bad = True
+
+    def failure(self, entry: Dict[str, Any], sample_req: Dict[str, Any]) -> None:
+        with self._lock:
+            self._write(entry)
+            s = self.summary[entry["endpoint"]][entry["method"]]; s["attempts"] += 1
+            s["by_status"]["-1"] = s["by_status"].get("-1",0) + 1
+            if not s["sample_req"]:
+                s["sample_req"] = sample_req
+                s["sample_resp"] = entry["exception"]
+            self.any_bad = True
+
+    def set_doc_id(self, doc_id: Optional[int]) -> None:
+        with self._lock:
+            if self.doc_id is None:
+                self.doc_id = doc_id
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
 # ---------------------- HTML 报告 ----------------------
 def generate_html_report(summary: Dict[str, Dict[str, Any]], outdir: Path) -> Path:
     parts = []
@@ -227,6 +273,7 @@ def main() -> int:
     ap.add_argument("--file", type=str, default=None, help="要上传的 PDF 文件路径，如 ./test.pdf")
     ap.add_argument("--upload-first", action="store_true", default=False, help="若提供 --file，则先上传并解析 document_id")
     ap.add_argument("--iter", type=int, default=1)
+    ap.add_argument("--concurrency", type=int, default=1, help="并发线程数；1 为原顺序执行")
     ap.add_argument("--timeout", type=float, default=10.0)
     ap.add_argument("--out", default="fuzz-results")
     args = ap.parse_args()
@@ -285,134 +332,151 @@ def main() -> int:
         modes.append("noauth")
 
     summary: Dict[str, Dict[str, Any]] = {}
-    any_bad = False
-
     for method, path, _ in ENDPOINTS:
+        summary.setdefault(path, {}).setdefault(method, {"attempts":0, "by_status":{}, "sample_req":None, "sample_resp":None})
+    rec = Recorder(report, summary, doc_id)
+
+    # 并发模式下每个线程一个 Session，复用连接；cookie 鉴权时复制登录 cookie
+    local = threading.local()
+
+    def worker_requester(mode: str):
+        if args.concurrency <= 1:
+            return make_requester(mode)
+        s = getattr(local, mode, None)
+        if s is None:
+            s = requests.Session()
+            if mode == "auth" and have_cookie_auth:
+                s.cookies.update(session.cookies)
+            setattr(local, mode, s)
+        return s, make_requester(mode)[1]
+
+    def run_case(method: str, path: str, mode: str) -> None:
         ep = path
-        summary.setdefault(ep, {}).setdefault(method, {"attempts":0, "by_status":{}, "sample_req":None, "sample_resp":None})
+        requester, header_builder = worker_requester(mode)
+        headers = header_builder()
+        doc_id = rec.doc_id
 
         # 基于 doc_id 构造 URL
         url = build_url(args.base_url, path, doc_id)
 
-        for mode in modes:
-            requester, header_builder = make_requester(mode)
-            for _ in range(max(1, args.iter)):
-                headers = header_builder()
+        # —— normal 构造 ——
+        params = {}
+        body = gen_example_body(path, method, doc_id)
 
-                # —— normal 构造 ——
-                params = {}
-                body = gen_example_body(path, method, doc_id)
+        # 特定接口补齐 query 参数
+        if path == "/api/get-document" and doc_id is not None:
+            params["id"] = int(doc_id)
+        if path == "/api/list-versions" and doc_id is not None:
+            params["documentid"] = int(doc_id)
 
-                # 特定接口补齐 query 参数
-                if path == "/api/get-document" and doc_id is not None:
-                    params["id"] = int(doc_id)
-                if path == "/api/list-versions" and doc_id is not None:
-                    params["documentid"] = int(doc_id)
+        # 1) normal
+        try:
+            req_kwargs: Dict[str, Any] = {"timeout": args.timeout, "headers": headers}
+            if params: req_kwargs["params"] = params
 
-                # 1) normal
+            # /api/upload-document 用 multipart/form-data
+            if path == "/api/upload-document" and args.file and Path(args.file).exists():
+                files = {"file": (Path(args.file).name, open(args.file, "rb"), "application/pdf")}
+                data = {"name": Path(args.file).stem}
                 try:
-                    req_kwargs: Dict[str, Any] = {"timeout": args.timeout, "headers": headers}
-                    if params: req_kwargs["params"] = params
-
-                    # /api/upload-document 用 multipart/form-data
-                    if path == "/api/upload-document" and args.file and Path(args.file).exists():
-                        files = {"file": (Path(args.file).name, open(args.file, "rb"), "application/pdf")}
-                        data = {"name": Path(args.file).stem}
-                        try:
-                            r = requester.request(method, url, files=files, data=data, **req_kwargs)
-                        finally:
-                            try: files["file"][1].close()
-                            except Exception: pass
-                    else:
-                        if body is not None:
-                            req_kwargs["json"] = body
-                        r = requester.request(method, url, **req_kwargs)
-
-                    entry = {
-                        "ts": now_ms(), "endpoint": ep, "method": method, "mode": mode,
-                        "status": r.status_code, "req": {"headers": headers, "params": params or None, "body": body},
-                        "resp_sample": r.text[:1000] if r.text else "",
-                    }
-                    write_jsonl(report, entry)
-                    s = summary[ep][method]
-                    s["attempts"] += 1
-                    s["by_status"][str(r.status_code)] = s["by_status"].get(str(r.status_code), 0) + 1
-                    if not s["sample_req"]:
-                        s["sample_req"] = entry["req"]; s["sample_resp"] = entry["resp_sample"]
-                    if 500 <= r.status_code < 600:
-                        any_bad = True
-
-                    # 若是上传且之前没拿到 doc_id，尝试从此处解析
-                    if path == "/api/upload-document" and doc_id is None:
-                        try:
-                            j = r.json()
-                            if isinstance(j, dict):
-                                for k in ("id","document_id","doc_id"):
-                                    if k in j:
-                                        doc_id = int(j[k]); break
-                                if doc_id is None and isinstance(j.get("data"), dict):
-                                    dj = j["data"]
-                                    for k in ("id","document_id"):
-                                        if k in dj:
-                                            doc_id = int(dj[k]); break
-                        except Exception:
-                            pass
-
-                except Exception as e:
-                    write_jsonl(report, {"ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "status": -1, "exception": repr(e)})
-                    s = summary[ep][method]; s["attempts"] += 1
-                    s["by_status"]["-1"] = s["by_status"].get("-1",0) + 1
-                    if not s["sample_req"]:
-                        s["sample_req"] = {"headers": headers, "params": params or None, "body": body}
-                        s["sample_resp"] = repr(e)
-                    any_bad = True
-
-                # 2) fuzz
+                    r = requester.request(method, url, files=files, data=data, **req_kwargs)
+                finally:
+                    try: files["file"][1].close()
+                    except Exception: pass
+            else:
+                if body is not None:
+                    req_kwargs["json"] = body
+                r = requester.request(method, url, **req_kwargs)
+
+            entry = {
+                "ts": now_ms(), "endpoint": ep, "method": method, "mode": mode,
+                "status": r.status_code, "req": {"headers": headers, "params": params or None, "body": body},
+                "resp_sample": r.text[:1000] if r.text else "",
+            }
+            rec.response(entry)
+
+            # 若是上传且之前没拿到 doc_id，尝试从此处解析
+            if path == "/api/upload-document" and rec.doc_id is None:
                 try:
-                    params_f = dict(params)
-                    if not params_f:
-                        params_f = {"_f": random.choice(["", "../../../../", "<script>", "🔥"])}
-                    body_f = gen_fuzz_body(body)
-
-                    req_kwargs: Dict[str, Any] = {"timeout": args.timeout, "headers": headers}
-                    if params_f: req_kwargs["params"] = params_f
-
-                    if path == "/api/upload-document" and args.file and Path(args.file).exists():
-                        # 对上传端点就不重复 fuzz 文件体，避免重复打开；只加奇怪的 query param
-                        files = {"file": (Path(args.file).name, open(args.file, "rb"), "application/pdf")}
-                        data = {"name": Path(args.file).stem + "_fuzz"}
-                        try:
-                            r = requester.request(method, url, files=files, data=data, **req_kwargs)
-                        finally:
-                            try: files["file"][1].close()
-                            except Exception: pass
-                    else:
-                        if body_f is not None:
-                            req_kwargs["json"] = body_f
-                        r = requester.request(method, url, **req_kwargs)
-
-                    entry = {
-                        "ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "fuzz": True,
-                        "status": r.status_code, "req": {"headers": headers, "params": params_f or None, "body": body_f},
-                        "resp_sample": r.text[:1000] if r.text else "",
-                    }
-                    write_jsonl(report, entry)
-                    s = summary[ep][method]
-                    s["attempts"] += 1
-                    s["by_status"][str(r.status_code)] = s["by_status"].get(str(r.status_code), 0) + 1
-                    if not s["sample_req"]:
-                        s["sample_req"] = entry["req"]; s["sample_resp"] = entry["resp_sample"]
-                    if 500 <= r.status_code < 600:
-                        any_bad = True
-
-                except Exception as e:
-                    write_jsonl(report, {"ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "status": -1, "exception": repr(e), "fuzz": True})
-                    s = summary[ep][method]; s["attempts"] += 1
-                    s["by_status"]["-1"] = s["by_status"].get("-1",0) + 1
-                    if not s["sample_req"]:
-                        s["sample_req"] = {"headers": headers, "params": params or None, "body": body}
-                        s["sample_resp"] = repr(e)
-                    any_bad = True
+                    j = r.json()
+                    if isinstance(j, dict):
+                        for k in ("id","document_id","doc_id"):
+                            if k in j:
+                                rec.set_doc_id(int(j[k])); break
+                        if rec.doc_id is None and isinstance(j.get("data"), dict):
+                            dj = j["data"]
+                            for k in ("id","document_id"):
+                                if k in dj:
+                                    rec.set_doc_id(int(dj[k])); break
+                except Exception:
+                    pass
+
+        except Exception as e:
+            rec.failure({"ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "status": -1, "exception": repr(e)},
+                        {"headers": headers, "params": params or None, "body": body})
+
+        # 2) fuzz
+        try:
+            params_f = dict(params)
+            if not params_f:
+                params_f = {"_f": random.choice(["", "../../../../", "<script>", "🔥"])}
+            body_f = gen_fuzz_body(body)
+
+            req_kwargs: Dict[str, Any] = {"timeout": args.timeout, "headers": headers}
+            if params_f: req_kwargs["params"] = params_f
+
+            if path == "/api/upload-document" and args.file and Path(args.file).exists():
+                # 对上传端点就不重复 fuzz 文件体，避免重复打开；只加奇怪的 query param
+                files = {"file": (Path(args.file).name, open(args.file, "rb"), "application/pdf")}
+                data = {"name": Path(args.file).stem + "_fuzz"}
+                try:
+                    r = requester.request(method, url, files=files, data=data, **req_kwargs)
+                finally:
+                    try: files["file"][1].close()
+                    except Exception: pass
+            else:
+                if body_f is not None:
+                    req_kwargs["json"] = body_f
+                r = requester.request(method, url, **req_kwargs)
+
+            entry = {
+                "ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "fuzz": True,
+                "status": r.status_code, "req": {"headers": headers, "params": params_f or None, "body": body_f},
+                "resp_sample": r.text[:1000] if r.text else "",
+            }
+            rec.response(entry)
+
+        except Exception as e:
+            rec.failure({"ts": now_ms(), "endpoint": ep, "method": method, "mode": mode, "status": -1, "exception": repr(e), "fuzz": True},
+                        {"headers": headers, "params": params or None, "body": body})
+
+    cases = ((method, path, mode)
+             for method, path, _ in ENDPOINTS
+             for mode in modes
+             for _ in range(max(1, args.iter)))
+
+    t0 = time.time()
+    if args.concurrency <= 1:
+        for case in cases:
+            run_case(*case)
+    else:
+        # 上传端点靠前，但并发下其余请求可能先发出；尽量先拿到 doc_id
+        if rec.doc_id is None and args.file and Path(args.file).is_file():
+            requester, header_builder = make_requester(modes[0])
+            rec.set_doc_id(upload_document(args.base_url, requester, header_builder(), args.timeout, Path(args.file)))
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="fuzz") as pool:
+            # 有界提交，避免大 --iter 时一次性堆积上百万个 future
+            pending = set()
+            for case in cases:
+                pending.add(pool.submit(run_case, *case))
+                if len(pending) >= args.concurrency * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done: f.result()
+            for f in pending: f.result()
+    rec.close()
+    doc_id, any_bad = rec.doc_id, rec.any_bad
+    print(f"{sum(s['attempts'] for m in summary.values() for s in m.values())} requests in {time.time() - t0:.1f}s "
+          f"(concurrency={args.concurrency})")
 
     write_jsonl(report, {"ts": now_ms(), "_type":"SUMMARY", "any_bad": any_bad, "note": "doc_id used" if 'doc_id' in locals() and doc_id else "no doc_id"})
     idx = generate_html_report(summary, outdir)
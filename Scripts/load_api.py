@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+load_api.py — 基于 fuzz_all_api.py 端点表（ENDPOINTS）的并发压测工具
+每个虚拟用户（VU）独立注册、登录、上传文档并生成一个水印版本，
+随后按加权端点组合持续发送请求，用于评估 gunicorn worker 数与数据库连接池。
+
+两种负载模型：
+  closed  每个 VU 收到响应（加 --think 毫秒）后才发下一个请求
+  open    全体 VU 共享固定到达速率 --rate（请求/秒）；延迟从“计划发送时刻”
+          起算，服务端变慢时排队时间也会计入（避免 coordinated omission）
+
+示例：
+  # 20 个 VU，闭环 60 秒
+  python load_api.py --base-url http://127.0.0.1:5000 --file ./test.pdf \
+      --users 20 --duration 60
+
+  # 固定 50 req/s，自定义权重
+  python load_api.py --base-url http://127.0.0.1:5000 --file ./test.pdf \
+      --users 32 --mode open --rate 50 --duration 120 \
+      --mix "GET /api/list-documents=5" --mix "POST /api/create-watermark/{document_id}=1"
+
+输出：
+  终端打印每个路由的吞吐、错误率与延迟分位数；--out 写出完整 JSON
+  （含延迟直方图桶计数）。
+"""
+
+import argparse, bisect, json, random, sys, threading, time, uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from fuzz_all_api import (
+    ENDPOINTS, build_url, gen_example_body, try_auto_signup_and_login, upload_document,
+)
+
+# 默认权重：读多写少；create-user/login/delete/rmap 默认不压
+DEFAULT_MIX = {
+    ("GET",  "/healthz"):                            1,
+    ("GET",  "/api/list-documents"):                 6,
+    ("GET",  "/api/get-document/{document_id}"):     4,
+    ("GET",  "/api/list-versions/{document_id}"):    4,
+    ("GET",  "/api/list-all-versions"):              3,
+    ("GET",  "/api/get-version/{link}"):             3,
+    ("GET",  "/api/get-watermarking-methods"):       1,
+    ("POST", "/api/read-watermark/{document_id}"):   2,
+    ("POST", "/api/create-watermark/{document_id}"): 1,
+    ("POST", "/api/upload-document"):                1,
+}
+
+# 延迟直方图上界（毫秒），最后一个桶为 +Inf
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+WM_METHOD = "trailer-hmac"
+WM_KEY = "load-key"
+
+
+# ---------------------- 参数解析 ----------------------
+def parse_mix(items: List[str]) -> Dict[Tuple[str, str], float]:
+    """解析 'METHOD PATH=WEIGHT'；PATH 必须出现在 ENDPOINTS 中。"""
+    if not items:
+        return dict(DEFAULT_MIX)
+    known = {(m, p) for m, p, _ in ENDPOINTS}
+    mix: Dict[Tuple[str, str], float] = {}
+    for item in items:
+        spec, _, weight = item.rpartition("=")
+        method, _, path = spec.strip().partition(" ")
+        route = (method.upper(), path.strip())
+        if route not in known:
+            raise SystemExit(f"unknown route in --mix: {item!r}")
+        mix[route] = float(weight)
+    return {r: w for r, w in mix.items() if w > 0}
+
+
+# ---------------------- 统计 ----------------------
+class RouteStats:
+    """单个 VU 内某路由的统计；各 VU 各自持有，结束时合并，无需加锁。"""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.by_status: Dict[str, int] = {}
+        self.errors = 0
+
+    def record(self, status: int, ms: float) -> None:
+        self.latencies.append(ms)
+        self.by_status[str(status)] = self.by_status.get(str(status), 0) + 1
+        # 异常（-1）与 5xx 计为错误；4xx 单独按状态码统计
+        if status < 0 or status >= 500:
+            self.errors += 1
+
+    def merge(self, other: "RouteStats") -> None:
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        for s, c in other.by_status.items():
+            self.by_status[s] = self.by_status.get(s, 0) + c
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        n = len(lat)
+
+        def pct(q: float) -> Optional[float]:
+            return round(lat[max(0, int(-(-n * q // 100)) - 1)], 2) if n else None
+
+        hist = [0] * (len(BUCKETS_MS) + 1)
+        for v in lat:
+            hist[bisect.bisect_left(BUCKETS_MS, v)] += 1
+        return {
+            "requests": n,
+            "rps": round(n / elapsed, 2) if elapsed > 0 else None,
+            "error_rate": round(self.errors / n, 4) if n else 0.0,
+            "by_status": dict(sorted(self.by_status.items())),
+            "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "max_ms": round(lat[-1], 2) if n else None,
+            "histogram_ms": {
+                **{f"le_{b}": c for b, c in zip(BUCKETS_MS, hist)},
+                "le_inf": hist[-1],
+            },
+        }
+
+
+# ---------------------- 开环调度 ----------------------
+class RateSchedule:
+    """全局固定速率：第 i 个请求计划在 start + i/rate 发出。"""
+
+    def __init__(self, rate: float, start: float) -> None:
+        self.interval = 1.0 / rate
+        self.start = start
+        self._i = 0
+        self._lock = threading.Lock()
+
+    def next_slot(self) -> float:
+        with self._lock:
+            t = self.start + self._i * self.interval
+            self._i += 1
+        return t
+
+
+# ---------------------- 虚拟用户 ----------------------
+class VirtualUser(threading.Thread):
+    def __init__(self, idx: int, args: argparse.Namespace, routes, weights,
+                 go: threading.Event, pdf: Tuple[str, bytes]) -> None:
+        super().__init__(name=f"vu-{idx}", daemon=True)
+        self.args = args
+        self.routes, self.weights = routes, weights
+        self.go = go
+        self.deadline = 0.0                       # 放行前由主线程设置
+        self.schedule: Optional[RateSchedule] = None
+        self.pdf_name, self.pdf_bytes = pdf
+        self.rng = random.Random(args.seed + idx)
+        self.session = requests.Session()  # 每个 VU 独立连接池，复用 keep-alive
+        self.headers: Dict[str, str] = {}
+        self.doc_id: Optional[int] = None
+        self.link = "sample-link"
+        self.stats: Dict[str, RouteStats] = {}
+        self.setup_error: Optional[str] = None
+        self.ready = threading.Event()
+
+    def setup(self) -> None:
+        a = self.args
+        email = f"load-{uuid.uuid4().hex[:12]}@example.local"
+        token, _ = try_auto_signup_and_login(a.base_url, self.session, email, a.password, True, a.timeout)
+        if token:
+            self.headers = {"Authorization": f"Bearer {token}"}
+        self.doc_id = upload_document(a.base_url, self.session, self.headers, a.timeout, Path(a.file))
+        if self.doc_id is None:
+            raise RuntimeError("upload failed (no document id)")
+        r = self.session.post(
+            f"{a.base_url.rstrip('/')}/api/create-watermark/{self.doc_id}",
+            headers=self.headers, timeout=a.timeout,
+            json={"method": WM_METHOD, "key": WM_KEY, "secret": "load", "intended_for": "load"},
+        )
+        if r.ok:
+            self.link = r.json().get("link") or self.link
+
+    def body_for(self, method: str, path: str) -> Optional[Dict[str, Any]]:
+        # 压测要命中成功路径，覆盖 fuzz 示例体中的占位方法名
+        if path.startswith("/api/create-watermark"):
+            return {"method": WM_METHOD, "key": WM_KEY, "secret": uuid.uuid4().hex[:8],
+                    "intended_for": f"load-{self.name}", "id": self.doc_id}
+        if path.startswith("/api/read-watermark"):
+            return {"method": WM_METHOD, "key": WM_KEY, "id": self.doc_id}
+        return gen_example_body(path, method, self.doc_id)
+
+    def request(self, method: str, path: str) -> int:
+        a = self.args
+        url = build_url(a.base_url, path, self.doc_id).replace("sample-link", self.link)
+        kw: Dict[str, Any] = {"headers": self.headers, "timeout": a.timeout}
+        if path == "/api/upload-document":
+            kw["files"] = {"file": (self.pdf_name, self.pdf_bytes, "application/pdf")}
+        else:
+            body = self.body_for(method, path)
+            if body is not None:
+                kw["json"] = body
+        r = self.session.request(method, url, **kw)
+        r.content  # 读完响应体，计入下载时间
+        return r.status_code
+
+    def run(self) -> None:
+        try:
+            self.setup()
+        except Exception as e:
+            self.setup_error = repr(e)
+            return
+        finally:
+            self.ready.set()
+        self.go.wait()  # 所有 VU 准备完毕后统一开始
+        think = self.args.think / 1000.0
+        while True:
+            if self.schedule is not None:
+                planned = self.schedule.next_slot()
+                if planned >= self.deadline:
+                    break
+                delay = planned - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                planned = time.perf_counter()
+                if planned >= self.deadline:
+                    break
+            method, path = self.rng.choices(self.routes, weights=self.weights)[0]
+            try:
+                status = self.request(method, path)
+            except Exception:
+                status = -1
+            ms = (time.perf_counter() - planned) * 1000
+            self.stats.setdefault(f"{method} {path}", RouteStats()).record(status, ms)
+            if think and self.schedule is None:
+                time.sleep(think)
+
+
+# ---------------------- 主流程 ----------------------
+def main() -> int:
+    ap = argparse.ArgumentParser("load_api (concurrent load over ENDPOINTS)")
+    ap.add_argument("--base-url", required=True)
+    ap.add_argument("--file", required=True, help="上传用 PDF")
+    ap.add_argument("--users", type=int, default=10, help="虚拟用户数（线程）")
+    ap.add_argument("--duration", type=float, default=30.0, help="压测时长（秒，不含准备阶段）")
+    ap.add_argument("--mode", choices=["closed", "open"], default="closed")
+    ap.add_argument("--rate", type=float, default=None, help="open 模式的总请求速率（req/s）")
+    ap.add_argument("--think", type=float, default=0.0, help="closed 模式每次请求后的等待（毫秒）")
+    ap.add_argument("--mix", action="append", default=[], help="'METHOD PATH=WEIGHT'，可多次传入")
+    ap.add_argument("--password", default="P@ssw0rd!")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1337)
+    ap.add_argument("--out", default=None, help="JSON 结果文件")
+    args = ap.parse_args()
+
+    if args.mode == "open" and not args.rate:
+        ap.error("--mode open requires --rate")
+    mix = parse_mix(args.mix)
+    routes, weights = list(mix), list(mix.values())
+    pdf = (Path(args.file).name, Path(args.file).read_bytes())
+
+    # 先完成所有 VU 的准备，再统一开始计时
+    go = threading.Event()
+    vus = [VirtualUser(i, args, routes, weights, go, pdf) for i in range(max(1, args.users))]
+    for vu in vus:
+        vu.start()
+    for vu in vus:
+        vu.ready.wait()
+    failed = [vu for vu in vus if vu.setup_error]
+    for vu in failed:
+        print(f"[setup] {vu.name}: {vu.setup_error}", file=sys.stderr)
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    schedule = RateSchedule(args.rate, start) if args.mode == "open" else None
+    for vu in vus:
+        vu.deadline, vu.schedule = deadline, schedule
+    go.set()
+    for vu in vus:
+        vu.join()
+    elapsed = time.perf_counter() - start
+
+    merged: Dict[str, RouteStats] = {}
+    for vu in vus:
+        for route, st in vu.stats.items():
+            merged.setdefault(route, RouteStats()).merge(st)
+    total = RouteStats()
+    for st in merged.values():
+        total.merge(st)
+
+    result = {
+        "params": {k: v for k, v in vars(args).items() if k != "password"},
+        "elapsed_s": round(elapsed, 3),
+        "users_ok": len(vus) - len(failed),
+        "buckets_ms": BUCKETS_MS,
+        "total": total.summary(elapsed),
+        "routes": {r: merged[r].summary(elapsed) for r in sorted(merged)},
+    }
+
+    print(f"{'route':<48} {'req':>7} {'rps':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, s in list(result["routes"].items()) + [("TOTAL", result["total"])]:
+        print(f"{name:<48} {s['requests']:>7} {s['rps'] or 0:>8} {s['error_rate'] * 100:>6.2f} "
+              f"{s['p50_ms'] or 0:>8} {s['p95_ms'] or 0:>8} {s['p99_ms'] or 0:>8}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+        print("report:", args.out)
+    return 1 if failed or result["total"]["error_rate"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -49,8 +49,23 @@ CREATE TABLE IF NOT EXISTS `Versions` (
   PRIMARY KEY (`id`),
   UNIQUE KEY `uq_Versions_link` (`link`),
   KEY `ix_Versions_documentid` (`documentid`),
+  KEY `ix_Versions_secret` (`secret`),         -- leak attribution: secret -> version
   CONSTRAINT `fk_Versions_document`
     FOREIGN KEY (`documentid`) REFERENCES `Documents`(`id`)
     ON UPDATE CASCADE ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Existing databases created before ix_Versions_secret existed.
+-- This file only runs when the database is first created; the server also
+-- adds missing indexes at startup (server.py, _ensure_indexes).
+-- CREATE INDEX IF NOT EXISTS is MariaDB-only, so check information_schema
+-- instead to stay valid on MySQL as well.
+SET @ix_missing := (
+  SELECT COUNT(*) = 0 FROM information_schema.STATISTICS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Versions' AND INDEX_NAME = 'ix_Versions_secret'
+);
+SET @ddl := IF(@ix_missing, 'CREATE INDEX `ix_Versions_secret` ON `Versions` (`secret`)', 'DO 0');
+PREPARE ix_stmt FROM @ddl;
+EXECUTE ix_stmt;
+DEALLOCATE PREPARE ix_stmt;
+
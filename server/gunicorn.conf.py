@@ -0,0 +1,26 @@
+"""Gunicorn settings for the Tatou server.
+
+Only the Prometheus multiprocess hooks live here; bind address and app
+are given on the command line (see Dockerfile / entrypoint.sh).
+"""
+import os
+import shutil
+
+_PROM_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    # Samples from a previous run would be summed into the new one.
+    if _PROM_DIR:
+        shutil.rmtree(_PROM_DIR, ignore_errors=True)
+        os.makedirs(_PROM_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a dead worker (counters/histograms are kept).
+    if _PROM_DIR:
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
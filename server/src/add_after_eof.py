@@ -13,14 +13,48 @@ Where json_payload = {"v":1,"mac":HMAC,"secret":base64(secret)}
 from __future__ import annotations
 import json, base64, hmac, hashlib
 from typing import Optional
-from .watermarking_method import load_pdf_bytes, is_pdf_bytes
+from .watermarking_method import open_pdf_buffer
 
 CONTEXT = b"wm:trailer:v1:"
 
+MARKER_START = b"%%CUSTOM-WM-START\n"
+MARKER_END = b"\n%%CUSTOM-WM-END\n"
+
+# 读取时先只看文件末尾这么多字节；只有看到结束标记却没看到起始标记
+# （trailer 比窗口大，如很长的 secret）时才按倍数扩大窗口，最多到上限
+TAIL_WINDOW = 8 * 1024
+TAIL_WINDOW_MAX = 1024 * 1024
+
+
+def _find_trailer_payload(buf: memoryview) -> bytes:
+    """只在尾部窗口中查找最后一个 trailer；代价与文件大小无关。
+
+    ``buf`` 通常是文件的 mmap 视图，只有被切片到的尾部页会真正从磁盘读入。
+    没有水印的文件只看 ``TAIL_WINDOW`` 字节；任何情况下最多读
+    ``TAIL_WINDOW_MAX`` 字节。
+    """
+    size = len(buf)
+    window = TAIL_WINDOW
+    while True:
+        tail = buf[max(0, size - window):].tobytes()
+        start = tail.rfind(MARKER_START)
+        if start >= 0:
+            end = tail.find(MARKER_END, start)
+            if end < 0:
+                # 最后一个起始标记没有结束标记：更大的窗口也只会找到同一个
+                raise ValueError("watermark not found")
+            return tail[start + len(MARKER_START):end]
+        if MARKER_END not in tail or window >= size or window >= TAIL_WINDOW_MAX:
+            raise ValueError("watermark not found")
+        window = min(window * 4, TAIL_WINDOW_MAX)
+
 class AddAfterEOF:
     # 与后端注册的名字保持一致
     name = "trailer-hmac"
     description = "Append authenticated JSON trailer after EOF (position='eof' only)."
+    # add_watermark/read_secret 直接接受路径、文件对象或 memoryview/mmap，
+    # 内部用 open_pdf_buffer 零拷贝访问
+    accepts_buffer = True
 
     def get_usage(self) -> str:
             """
@@ -86,22 +120,17 @@ class AddAfterEOF:
         # 校验
         if secret is None or key is None:
             raise ValueError("secret and key are required")
-        data = load_pdf_bytes(pdf)
-        if not is_pdf_bytes(data):
-            raise ValueError("not a PDF")
-
         # 仅接受 EOF 位置
         if position is not None and str(position).lower() != "eof":
             raise ValueError("position must be 'eof' for trailer-hmac")
 
-        # 确保末尾换行，便于追加
-        if not data.endswith((b"\n", b"\r")):
-            data += b"\n"
-
         payload_b64 = self._build_payload(secret, key).encode("ascii")
-        marker_start = b"%%CUSTOM-WM-START\n"
-        marker_end = b"\n%%CUSTOM-WM-END\n"
-        return data + marker_start + payload_b64 + marker_end
+
+        # 零拷贝读取源 PDF，输出时只拷贝一次（join）
+        with open_pdf_buffer(pdf) as data:
+            # 确保末尾换行，便于追加
+            sep = b"" if data[-1:].tobytes() in (b"\n", b"\r") else b"\n"
+            return b"".join((data, sep, MARKER_START, payload_b64, MARKER_END))
 
 
     # 同理：read_secret 也接受关键字 pdf，并吞掉多余关键字
@@ -144,19 +173,7 @@ class AddAfterEOF:
         if key is None:
             raise ValueError("key is required")
 
-        data = load_pdf_bytes(pdf)
-        if not is_pdf_bytes(data):
-            raise ValueError("not a PDF")
-
-        # 解析 trailer（与 _build_payload 对应）
-        try:
-            start = data.rindex(b"%%CUSTOM-WM-START\n")
-            end = data.index(b"\n%%CUSTOM-WM-END\n", start)
-        except ValueError:
-            raise ValueError("watermark not found")
-
-        payload_b64 = data[start + len(b"%%CUSTOM-WM-START\n"):end]
-        obj = json.loads(base64.b64decode(payload_b64))
+        obj = self._read_payload(pdf)
         mac_expected = hmac.new(key.encode("utf-8"),
                                 CONTEXT + base64.b64decode(obj["secret"]),
                                 hashlib.sha256).hexdigest()
@@ -164,14 +181,25 @@ class AddAfterEOF:
             raise ValueError("MAC verification failed")
         return base64.b64decode(obj["secret"]).decode("utf-8")
 
+    def _read_payload(self, pdf) -> dict:
+        # 只读文件头（校验）和文件尾（trailer），不加载整个 PDF
+        with open_pdf_buffer(pdf) as data:
+            # 解析 trailer（与 _build_payload 对应）
+            payload_b64 = _find_trailer_payload(data)
+        return json.loads(base64.b64decode(payload_b64))
+
+    def peek_secret(self, pdf) -> str:
+        """不校验 MAC，直接取出 trailer 中的 secret（泄露溯源时查找候选版本用）。"""
+        return base64.b64decode(self._read_payload(pdf)["secret"]).decode("utf-8")
+
     # 也改一下签名：接受 pdf 关键字（或位置参数），其余丢给 **kwargs
     def is_watermark_applicable(self, pdf, position: str | None = None, **kwargs) -> bool:
         try:
-            data = load_pdf_bytes(pdf)
+            # open_pdf_buffer 已校验 %PDF 头，只映射不读取整个文件
+            with open_pdf_buffer(pdf):
+                pass
         except Exception:
             return False
-        if not is_pdf_bytes(data):
-            return False
         if position is not None and position.lower() != "eof":
             return False
         return True
@@ -0,0 +1,100 @@
+"""
+blob_store.py
+
+Content-addressed storage for uploaded documents.
+
+Every distinct upload is kept exactly once under::
+
+    STORAGE_DIR/blobs/<sha[:2]>/<sha>.pdf
+
+``Documents.path`` stays unique per row (``uq_documents_path``), so each
+row gets its own hard link to the shared blob instead of a copy. The
+reference count is the number of ``Documents`` rows carrying the same
+``sha256`` (served by ``ix_documents_sha256``); the caller releases the
+blob once that count drops to zero.
+
+An upload is linked into place by :meth:`BlobStore.adopt`, which keeps
+the staged file until the row's path exists. If a concurrent delete
+releases the blob in between, the staged bytes are installed as the blob
+again and linking is retried. Once linked, a row's path is a hard link,
+so releasing the blob later does not touch its data.
+"""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+# Link attempts before giving up on sharing the blob (each failed attempt
+# means a concurrent delete released it right after we installed it).
+_LINK_ATTEMPTS = 3
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Hard-link ``src`` to ``dst``; copy where hard links are unsupported."""
+    try:
+        os.link(src, dst)
+    except (FileNotFoundError, FileExistsError):
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class BlobStore:
+    """Filesystem blob store keyed by lowercase hex SHA-256."""
+
+    def __init__(self, root: str | os.PathLike[str]):
+        self.root = Path(root)
+
+    def path_for(self, sha_hex: str) -> Path:
+        sha = sha_hex.lower()
+        if not _SHA256_RE.match(sha):
+            raise ValueError(f"invalid sha256 digest: {sha_hex!r}")
+        return self.root / sha[:2] / f"{sha}.pdf"
+
+    def exists(self, sha_hex: str) -> bool:
+        return self.path_for(sha_hex).exists()
+
+    def incoming_path(self) -> Path:
+        """Return a unique staging path on the same filesystem as the blobs."""
+        incoming = self.root / "incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        return incoming / f"{uuid.uuid4().hex}.part"
+
+    def adopt(self, staged: Path, sha_hex: str, dest: Path) -> Path:
+        """Materialize a fully written staging file at ``dest`` via the blob.
+
+        ``dest`` shares the blob's inode; ``staged`` becomes the blob if
+        there is none yet. ``staged`` is removed only once ``dest`` exists.
+        """
+        blob = self.path_for(sha_hex)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(_LINK_ATTEMPTS):
+            try:
+                _link_or_copy(blob, dest)
+                break
+            except FileNotFoundError:
+                # No blob yet, or a concurrent delete just released it.
+                try:
+                    _link_or_copy(staged, blob)
+                except FileExistsError:
+                    pass  # another upload of the same bytes installed it
+        else:
+            _link_or_copy(staged, dest)
+        staged.unlink(missing_ok=True)
+        return dest
+
+    def release(self, sha_hex: str) -> bool:
+        """Unlink the blob; call only once no ``Documents`` row references it."""
+        try:
+            self.path_for(sha_hex).unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+
+__all__ = ["BlobStore"]
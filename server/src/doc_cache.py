@@ -0,0 +1,148 @@
+"""
+doc_cache.py
+
+In-process LRU cache of stored documents, keyed by ``Documents.sha256``.
+
+Uploaded documents are content-addressed (see ``blob_store.py``): the
+bytes behind a given SHA-256 never change, so cached entries never need
+invalidation, only eviction. Each entry keeps the raw PDF bytes plus small
+derived, immutable results computed from them (``memo``), e.g. an
+applicability check. Repeated operations on a hot document then skip the
+file read and repeated checks.
+
+Parsed documents are not cached: fitz/pikepdf objects are not safe to
+share between request threads, so each watermarking call still parses
+the bytes it is given.
+
+Memory is bounded by ``max_bytes``: the size of an entry is its byte
+length plus the footprint of its memoized values, at least
+``MEMO_ENTRY_BYTES`` each. At most ``MAX_MEMO_PER_ENTRY`` values are kept
+per document; further ones are computed but not stored. Least recently
+used entries are evicted first. The cache is per process; each gunicorn
+worker has its own.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+# Minimum charge per memoized value (dict slot, key string, small result).
+MEMO_ENTRY_BYTES = 256
+MAX_MEMO_PER_ENTRY = 32
+
+
+@dataclass
+class _Entry:
+    data: bytes
+    size: int
+    memo: Dict[str, Any] = field(default_factory=dict)
+
+
+class DocumentCache:
+    """Thread-safe, byte-bounded LRU of document bytes and derived state."""
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        on_lookup: Optional[Callable[[bool], None]] = None,
+    ):
+        self.max_bytes = max(0, int(max_bytes))
+        self._on_lookup = on_lookup  # called with True on a hit, False on a miss
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._size -= old.size
+            self.evictions += 1
+
+    def _entry(self, sha_hex: str, path: str | os.PathLike[str]) -> _Entry:
+        sha = sha_hex.lower()
+        with self._lock:
+            entry = self._entries.get(sha)
+            if entry is not None:
+                self._entries.move_to_end(sha)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self._on_lookup is not None:
+            self._on_lookup(entry is not None)
+        if entry is not None:
+            return entry
+        # Read outside the lock; two concurrent misses just read twice.
+        data = Path(path).read_bytes()
+        entry = _Entry(data=data, size=len(data))
+        if entry.size > self.max_bytes:
+            return entry  # too big to keep; serve it uncached
+        with self._lock:
+            existing = self._entries.get(sha)
+            if existing is not None:
+                return existing
+            self._entries[sha] = entry
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def get_bytes(self, sha_hex: str, path: str | os.PathLike[str]) -> bytes:
+        """Return the document bytes, reading ``path`` on a miss."""
+        return self._entry(sha_hex, path).data
+
+    def memo(
+        self,
+        sha_hex: str,
+        path: str | os.PathLike[str],
+        name: str,
+        compute: Callable[[bytes], Any],
+        size: int = 0,
+    ) -> Any:
+        """Return ``compute(data)`` for this document, computed once per entry.
+
+        ``compute`` must be a pure function of the bytes; ``size`` is an
+        estimate of the result's memory footprint for the byte budget.
+        Exceptions are not cached.
+        """
+        entry = self._entry(sha_hex, path)
+        if name in entry.memo:
+            return entry.memo[name]
+        value = compute(entry.data)
+        with self._lock:
+            if name in entry.memo:
+                return entry.memo[name]
+            if len(entry.memo) >= MAX_MEMO_PER_ENTRY:
+                return value
+            entry.memo[name] = value
+            if self._entries.get(sha_hex.lower()) is entry:
+                cost = max(int(size), MEMO_ENTRY_BYTES + len(name))
+                entry.size += cost
+                self._size += cost
+                self._evict()
+        return value
+
+    def discard(self, sha_hex: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(sha_hex.lower(), None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+__all__ = ["DocumentCache", "MEMO_ENTRY_BYTES", "MAX_MEMO_PER_ENTRY"]
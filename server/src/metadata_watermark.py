@@ -5,6 +5,13 @@ Embed an authenticated payload into PDF XMP metadata (redundant invisible waterm
 Uses pikepdf when available (preferred XMP handling), falls back to PyMuPDF metadata.
 
 Payload format: JSON (compact) base64(secret) + HMAC-SHA256 over context.
+
+With pikepdf the output is an incremental update: the original bytes are
+kept as-is and only the new Metadata stream (plus the catalog when it
+needs a /Metadata entry) and a new xref section are appended, so the
+cost scales with the metadata, not the document. Encrypted files and
+files whose last xref section is a cross-reference stream fall back to a
+full rewrite.
 """
 
 from __future__ import annotations
@@ -14,7 +21,7 @@ import hashlib
 import hmac
 from typing import Optional
 
-from .watermarking_method import load_pdf_bytes, is_pdf_bytes
+from .watermarking_method import load_pdf_bytes, open_pdf_buffer
 
 
 # try pikepdf first (better XMP support)
@@ -25,14 +32,23 @@ except Exception:
     _HAS_PIKEPDF = False
 
 try:
-    import fitz  # PyMuPDF
+    import pymupdf as fitz  # PyMuPDF (>=1.24.3)
     _HAS_FITZ = True
 except Exception:
-    _HAS_FITZ = False
+    try:
+        import fitz  # 旧版 PyMuPDF
+        _HAS_FITZ = True
+    except Exception:
+        _HAS_FITZ = False
 
 import io
+import re
 
 CONTEXT = b"wm:metadata:v1:"
+# XMP 属性名（xmp 命名空间下的自定义属性）
+PAYLOAD_PROP = "xmp:WatermarkPayload"
+
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)\s+%%EOF")
 
 def _build_payload(secret: str, key: str) -> str:
     if not secret:
@@ -44,9 +60,89 @@ def _build_payload(secret: str, key: str) -> str:
     obj = {"v": 1, "alg": "HMAC-SHA256", "mac": mac, "secret": base64.b64encode(secret_b).decode("ascii")}
     return json.dumps(obj, separators=(",", ":"), ensure_ascii=True)
 
+def _last_startxref(data: bytes) -> Optional[int]:
+    """返回最后一个 startxref 的偏移；只看文件尾部。"""
+    tail_start = max(0, len(data) - 4096)
+    matches = list(_STARTXREF_RE.finditer(data, tail_start))
+    if not matches:
+        return None
+    return int(matches[-1].group(1))
+
+
+def _xref_section(entries: dict[int, tuple[int, int]]) -> bytes:
+    """按连续对象号分组生成 xref 子段；entries: objnum -> (offset, gen)。"""
+    out = [b"xref\n"]
+    nums = sorted(entries)
+    i = 0
+    while i < len(nums):
+        j = i
+        while j + 1 < len(nums) and nums[j + 1] == nums[j] + 1:
+            j += 1
+        out.append(b"%d %d\n" % (nums[i], j - i + 1))
+        for n in nums[i:j + 1]:
+            offset, gen = entries[n]
+            out.append(b"%010d %05d n \n" % (offset, gen))
+        i = j + 1
+    return b"".join(out)
+
+
+def _incremental_update(data: bytes, pdf: "pikepdf.Pdf") -> Optional[bytes]:
+    """把已更新的 Metadata 流作为增量更新追加到原始字节之后。
+
+    ``pdf`` 是从 ``data`` 打开并已写好 XMP 的文档（未保存）。无法安全
+    增量写入时返回 None，由调用方走完整重写。
+    """
+    prev = _last_startxref(data)
+    # 只处理传统 xref 表；xref 流、加密文件、损坏的偏移都走完整重写
+    if prev is None or pdf.is_encrypted or data[prev:prev + 4] != b"xref":
+        return None
+
+    meta = pdf.Root.Metadata
+    meta_num, meta_gen = meta.objgen
+    root_num, root_gen = pdf.Root.objgen
+    if not meta_num or not root_num:
+        return None
+    size = int(pdf.trailer.get("/Size", 0))
+    xmp = meta.read_bytes()
+
+    parts = [data if data.endswith((b"\n", b"\r")) else data + b"\n"]
+    pos = len(parts[0])
+    entries: dict[int, tuple[int, int]] = {}
+
+    def emit(num: int, gen: int, body: bytes) -> None:
+        nonlocal pos
+        entries[num] = (pos, gen)
+        chunk = b"%d %d obj\n" % (num, gen) + body + b"\nendobj\n"
+        parts.append(chunk)
+        pos += len(chunk)
+
+    emit(
+        meta_num, meta_gen,
+        b"<< /Type /Metadata /Subtype /XML /Length %d >>\nstream\n" % len(xmp)
+        + xmp + b"\nendstream",
+    )
+    if meta_num >= size:
+        # 新建的 Metadata 对象：目录需要新的 /Metadata 引用
+        emit(root_num, root_gen, pdf.Root.unparse(resolved=True))
+
+    trailer = [b"/Size %d" % max(size, meta_num + 1),
+               b"/Root %d %d R" % (root_num, root_gen),
+               b"/Prev %d" % prev]
+    for k in ("/Info", "/ID"):
+        if k in pdf.trailer:
+            trailer.append(k.encode("ascii") + b" " + pdf.trailer[k].unparse())
+    parts.append(_xref_section(entries))
+    parts.append(b"trailer\n<< " + b" ".join(trailer) + b" >>\n")
+    parts.append(b"startxref\n%d\n%%%%EOF\n" % pos)
+    return b"".join(parts)
+
+
 class MetadataWatermark:
     name = "metadata-xmp"
 
+    # False 时总是完整重写（pikepdf save）
+    incremental = True
+
     def add_watermark(self, pdf_bytes: bytes | str, secret: str, key: str, position: Optional[str]=None) -> bytes:  # noqa: ARG002
         """Embed payload into XMP metadata. Returns new PDF bytes."""
         payload = _build_payload(secret, key)
@@ -60,17 +156,21 @@ class MetadataWatermark:
                 with pikepdf.Pdf.open(io.BytesIO(data)) as pdf:
                     # Use Metadata object via pikepdf
                     try:
-                        xmp = pdf.open_metadata()
-                        # Put our compact payload into a dedicated property in xmp meta
-                        # Use a custom property name
-                        xmp["/xmp:WatermarkPayload"] = payload
-                        # pdf.save(io.BytesIO())  # ensure metadata is set
+                        # 必须在 with 块中编辑，退出时才写回 Metadata 流；
+                        # 不写入编辑器/日期字段，保证输出确定
+                        with pdf.open_metadata(set_pikepdf_as_editor=False, update_docinfo=False) as xmp:
+                            # Put our compact payload into a dedicated property in xmp meta
+                            xmp[PAYLOAD_PROP] = payload
                     except Exception:
                         # fallback: set a raw Metadata stream
                         try:
                             pdf.Root.Metadata = pdf.make_stream(payload.encode("utf-8"))
                         except Exception:
                             pass
+                    if self.incremental:
+                        out_bytes = _incremental_update(data, pdf)
+                        if out_bytes is not None:
+                            return out_bytes
                     out = io.BytesIO()
                     pdf.save(out)
                     return out.getvalue()
@@ -93,6 +193,22 @@ class MetadataWatermark:
 
     def read_secret(self, pdf_bytes: bytes | str, key: str) -> str:
         """Try to read and verify payload from XMP/metadata."""
+        obj = self._read_payload(pdf_bytes)
+        # verify mac
+        secret_b = base64.b64decode(obj["secret"].encode("ascii"))
+        mac_expected = obj["mac"]
+        mac_calc = hmac.new(key.encode("utf-8"), CONTEXT + secret_b, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(mac_calc, mac_expected):
+            raise ValueError("MAC mismatch")
+        return secret_b.decode("utf-8")
+
+    def peek_secret(self, pdf_bytes: bytes | str) -> str:
+        """Return the embedded secret without verifying the MAC (leak attribution)."""
+        obj = self._read_payload(pdf_bytes)
+        return base64.b64decode(obj["secret"].encode("ascii")).decode("utf-8")
+
+    def _read_payload(self, pdf_bytes: bytes | str) -> dict:
+        """Locate and decode the JSON payload from XMP/metadata."""
 
         data = load_pdf_bytes(pdf_bytes)  # ✅ 统一成字节
 
@@ -101,28 +217,29 @@ class MetadataWatermark:
         try:
             if _HAS_PIKEPDF:
                 with pikepdf.Pdf.open(io.BytesIO(data)) as pdf:
+                    payload = None
                     try:
                         md = pdf.open_metadata()
-                        payload = None
                         # try several property names
-                        for prop in ("watermark_payload", "/xmp:WatermarkPayload", "/xmp:watermark_payload"):
+                        for prop in (PAYLOAD_PROP, "watermark_payload", "/xmp:WatermarkPayload", "/xmp:watermark_payload"):
                             try:
                                 payload = md.get(prop)
                                 if payload:
                                     break
                             except Exception:
                                 pass
-                        if not payload:
-                            # try raw Metadata stream
-                            try:
-                                raw = pdf.Root.Metadata.read_bytes()
-                                payload = raw.decode("utf-8", errors="ignore")
-                            except Exception:
-                                payload = None
-                        if not payload:
-                            raise ValueError("No metadata payload found")
                     except Exception:
-                        raise
+                        # Metadata 不是合法 XMP（例如旧版直接写入的 JSON 流）
+                        payload = None
+                    if not payload:
+                        # try raw Metadata stream
+                        try:
+                            raw = pdf.Root.Metadata.read_bytes()
+                            payload = raw.decode("utf-8", errors="ignore")
+                        except Exception:
+                            payload = None
+                    if not payload:
+                        raise ValueError("No metadata payload found")
                 obj = json.loads(payload)
             elif _HAS_FITZ:
                 doc = fitz.open(stream=data, filetype="pdf")
@@ -134,13 +251,7 @@ class MetadataWatermark:
                 obj = json.loads(payload)
             else:
                 raise RuntimeError("No PDF library available to read metadata")
-            # verify mac
-            secret_b = base64.b64decode(obj["secret"].encode("ascii"))
-            mac_expected = obj["mac"]
-            mac_calc = hmac.new(key.encode("utf-8"), CONTEXT + secret_b, hashlib.sha256).hexdigest()
-            if not hmac.compare_digest(mac_calc, mac_expected):
-                raise ValueError("MAC mismatch")
-            return secret_b.decode("utf-8")
+            return obj
         except Exception as e:
             raise
 
@@ -151,11 +262,11 @@ class MetadataWatermark:
         - 环境里至少有 pikepdf 或 pymupdf 其一
         """
         try:
-            data = load_pdf_bytes(pdf)
+            # 只映射文件并校验 %PDF 头，不读取整个 PDF
+            with open_pdf_buffer(pdf):
+                pass
         except Exception:
             return False
-        if not is_pdf_bytes(data):
-            return False
         # 只有在至少一种库可用时才返回 True（两者都无就别让后续 500）
         return _HAS_PIKEPDF or _HAS_FITZ
 
@@ -0,0 +1,211 @@
+"""
+metrics.py
+
+Prometheus metrics for the Flask app, exposed at ``GET /metrics``.
+
+Exported series (all prefixed ``tatou_``):
+
+- ``http_request_duration_seconds{method,route,status}``: histogram per
+  URL rule (``request.url_rule.rule``), so path parameters do not blow
+  up label cardinality.
+- ``http_requests_in_progress``: requests currently being served.
+- ``db_query_duration_seconds{operation}``: every SQLAlchemy cursor
+  execution, labelled by SQL verb.
+- ``watermark_duration_seconds{operation,method}`` with ``operation`` in
+  ``embed``/``read``, and ``watermark_bytes_total{operation,method,direction}``
+  for bytes in and out. ``method`` is a name from
+  ``watermarking_utils.METHODS`` (aliases resolved) or ``other``.
+- ``cache_lookups_total{cache,result}``: ``document`` (in-process) and
+  ``result`` (on-disk) cache hits and misses; the hit rate is
+  ``rate(...{result="hit"}) / rate(...)``.
+
+Under gunicorn each worker is a separate process. When
+``PROMETHEUS_MULTIPROC_DIR`` is set (it must exist and be emptied before
+the workers start, see ``server/gunicorn.conf.py``), prometheus_client
+writes samples to per-process files there and ``/metrics`` aggregates
+all of them, so any worker can answer a scrape.
+
+``prometheus_client`` is optional: without it every hook is a no-op and
+``/metrics`` answers ``501``. Setting ``METRICS_TOKEN`` requires scrapes
+to send ``Authorization: Bearer <token>``.
+"""
+from __future__ import annotations
+
+import hmac
+import os
+import time
+from typing import Optional
+
+from flask import Flask, Response, g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import prometheus_client as prom
+    from prometheus_client import multiprocess
+except ImportError:  # optional dependency
+    prom = None
+
+from . import watermarking_utils as WMUtils
+
+_SQL_VERBS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK"})
+
+_LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+_DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5)
+
+
+class _Metrics:
+    def __init__(self) -> None:
+        # Private registry: repeated create_app() calls (tests) reuse the
+        # same per-process metrics instead of re-registering them.
+        self.registry = prom.CollectorRegistry(auto_describe=True)
+        r = self.registry
+        self.http_latency = prom.Histogram(
+            "tatou_http_request_duration_seconds", "HTTP request latency",
+            ["method", "route", "status"], buckets=_LATENCY_BUCKETS, registry=r,
+        )
+        self.in_progress = prom.Gauge(
+            "tatou_http_requests_in_progress", "HTTP requests being served",
+            registry=r, multiprocess_mode="livesum",
+        )
+        self.db_latency = prom.Histogram(
+            "tatou_db_query_duration_seconds", "SQL statement execution time",
+            ["operation"], buckets=_DB_BUCKETS, registry=r,
+        )
+        self.wm_latency = prom.Histogram(
+            "tatou_watermark_duration_seconds", "Watermark embed/read time",
+            ["operation", "method"], buckets=_LATENCY_BUCKETS, registry=r,
+        )
+        self.wm_bytes = prom.Counter(
+            "tatou_watermark_bytes_total", "PDF bytes into and out of watermark operations",
+            ["operation", "method", "direction"], registry=r,
+        )
+        self.cache = prom.Counter(
+            "tatou_cache_lookups_total", "Cache lookups by outcome",
+            ["cache", "result"], registry=r,
+        )
+
+
+_METRICS: Optional[_Metrics] = None
+
+
+def _metrics() -> Optional[_Metrics]:
+    global _METRICS
+    if prom is None:
+        return None
+    if _METRICS is None:
+        if _multiproc_dir():
+            # Normally created (and emptied) by gunicorn's on_starting hook.
+            os.makedirs(_multiproc_dir(), exist_ok=True)
+        _METRICS = _Metrics()
+        _instrument_sqlalchemy()
+    return _METRICS
+
+
+def _multiproc_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+def method_label(method) -> str:
+    """Canonical method name for labels; unknown names collapse to ``other``."""
+    name = getattr(method, "name", method)
+    if not isinstance(name, str):
+        return "other"
+    name = name.strip().lower()
+    name = WMUtils.ALIASES.get(name, name)
+    return name if name in WMUtils.METHODS else "other"
+
+
+def observe_watermark(operation: str, method, seconds: float,
+                      bytes_in: Optional[int] = None, bytes_out: Optional[int] = None) -> None:
+    m = _metrics()
+    if m is None:
+        return
+    label = method_label(method)
+    m.wm_latency.labels(operation, label).observe(seconds)
+    if bytes_in:
+        m.wm_bytes.labels(operation, label, "in").inc(bytes_in)
+    if bytes_out:
+        m.wm_bytes.labels(operation, label, "out").inc(bytes_out)
+
+
+def observe_cache(cache: str, hit: bool) -> None:
+    m = _metrics()
+    if m is not None:
+        m.cache.labels(cache, "hit" if hit else "miss").inc()
+
+
+def _instrument_sqlalchemy() -> None:
+    """Time every cursor execution on every engine (including test engines)."""
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("tatou_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("tatou_query_start")
+        if not starts or _METRICS is None:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        _METRICS.db_latency.labels(verb if verb in _SQL_VERBS else "OTHER").observe(elapsed)
+
+    @event.listens_for(Engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        starts = conn.info.get("tatou_query_start") if conn is not None else None
+        if starts:
+            starts.pop()
+
+
+def init_app(app: Flask) -> None:
+    """Register request hooks and the ``/metrics`` endpoint."""
+    app.config.setdefault("METRICS_TOKEN", os.environ.get("METRICS_TOKEN") or None)
+    m = _metrics()
+
+    if m is not None:
+        def _observe(status: str, t0: float) -> None:
+            rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            m.http_latency.labels(request.method, rule, status).observe(time.perf_counter() - t0)
+
+        @app.before_request
+        def _metrics_start():
+            g._metrics_t0 = time.perf_counter()
+            m.in_progress.inc()
+
+        @app.after_request
+        def _metrics_observe(response):
+            t0 = g.pop("_metrics_t0", None)
+            if t0 is not None:
+                _observe(str(response.status_code), t0)
+                g._metrics_inflight = True
+            return response
+
+        @app.teardown_request
+        def _metrics_finish(exc):
+            # after_request is skipped on unhandled exceptions; count those as 500.
+            t0 = g.pop("_metrics_t0", None)
+            if t0 is not None:
+                _observe("500", t0)
+            if t0 is not None or g.pop("_metrics_inflight", False):
+                m.in_progress.dec()
+
+    @app.get("/metrics")
+    def metrics():
+        token = app.config.get("METRICS_TOKEN")
+        if token:
+            auth = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(auth, f"Bearer {token}"):
+                return jsonify({"error": "metrics token required"}), 401
+        if m is None:
+            return jsonify({"error": "prometheus_client is not installed"}), 501
+        if _multiproc_dir():
+            registry = prom.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = m.registry
+        return Response(prom.generate_latest(registry), mimetype=prom.CONTENT_TYPE_LATEST)
+
+
+__all__ = ["init_app", "method_label", "observe_cache", "observe_watermark"]
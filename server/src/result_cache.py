@@ -0,0 +1,141 @@
+"""
+result_cache.py
+
+Disk-backed cache of watermarked outputs.
+
+``WatermarkingMethod.add_watermark`` must be deterministic, so the output
+is fully determined by (source sha256, method, implementation, secret,
+key, position). Retried or duplicated ``/api/create-watermark`` calls
+therefore reuse the stored bytes instead of embedding again. The
+implementation id (class path and ``cache_version``) keeps entries
+written by older code from being served after a deploy. Entries live
+under::
+
+    STORAGE_DIR/wm-cache/<k[:2]>/<k>.pdf
+
+where ``k`` is a SHA-256 over those fields. The watermarking key only
+enters through an HMAC under the server secret, so neither the key nor
+a cheap-to-test hash of it ends up on disk.
+
+Eviction is size-based and least-recently-used: a hit refreshes the
+entry's mtime, and once the running total exceeds ``max_bytes`` the
+oldest entries are removed until the cache is back under
+``LOW_WATERMARK`` of the budget. Several workers may share the
+directory; each keeps its own running estimate and rescans before
+evicting.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+LOW_WATERMARK = 0.9
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class WatermarkResultCache:
+    """Content-addressed store of watermarked PDFs with an LRU byte budget."""
+
+    def __init__(self, root: str | os.PathLike[str], max_bytes: int, secret: bytes):
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self._secret = secret
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None  # lazily initialized by a scan
+
+    def key_for(
+        self,
+        source_sha256: str,
+        method: str,
+        secret: str,
+        key: str,
+        position: str | None,
+        implementation: str = "",
+    ) -> str:
+        key_mac = hmac.new(self._secret, key.encode("utf-8"), hashlib.sha256).hexdigest()
+        material = json.dumps(
+            ["v2", source_sha256.lower(), method, implementation, secret, key_mac, position or ""],
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, cache_key: str) -> Path:
+        if not _KEY_RE.match(cache_key):
+            raise ValueError(f"invalid cache key: {cache_key!r}")
+        return self.root / cache_key[:2] / f"{cache_key}.pdf"
+
+    def get(self, cache_key: str) -> Optional[bytes]:
+        path = self._path(cache_key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return data
+
+    def put(self, cache_key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(cache_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        if not self.root.exists():
+            return
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith(".pdf") and not e.name.startswith(".tmp-"):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield e.path, st.st_size, st.st_mtime
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * LOW_WATERMARK)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+__all__ = ["WatermarkResultCache"]
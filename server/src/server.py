@@ -2,10 +2,14 @@
 import os
 import re
 import io
+import time
 import hashlib
+import itertools
+import tempfile
 import datetime as dt
 from pathlib import Path
 from functools import wraps
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import traceback
 
 from sqlalchemy.exc import IntegrityError 
@@ -15,7 +19,7 @@ from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.exc import IntegrityError
 
 import pickle as _std_pickle
@@ -28,7 +32,14 @@ except Exception:
 from .rmap_routes import bp as rmap_bp 
 
 from . import watermarking_utils as WMUtils
+from . import metrics as AppMetrics
+from .server_timing import init_app as _init_server_timing, phase
 from .watermarking_method import WatermarkingMethod
+from .blob_store import BlobStore
+from .doc_cache import DocumentCache
+from .result_cache import WatermarkResultCache
+from .upload_sessions import UploadOffsetError, UploadSessionNotFound, UploadSessionStore
+from .watermark_jobs import WatermarkJobQueue
 
 # ---------------------------------------------------------------------------
 # 1. 通用工具函数
@@ -42,6 +53,31 @@ def _sha256_file(path: Path) -> str:
             h.update(chunk)
     return h.hexdigest()
 
+def _save_stream_hashed(stream, dest: Path, chunk_size: int = 1024 * 1024) -> tuple[str, int]:
+    """把上传流一次性写入 dest，同时计算 SHA256 和大小。
+
+    先写到同目录下的临时文件，完成后用 os.replace 原子改名，
+    这样不会留下半截文件，也不需要再读一遍或 stat。
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=dest.parent)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                h.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_name, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return h.hexdigest(), size
+
 def _safe_resolve_under_storage(p: str | Path, storage_root: Path) -> Path:
     """安全地把用户传的路径限制在 STORAGE_DIR 下面。"""
     storage_root = storage_root.resolve()
@@ -75,11 +111,108 @@ def get_engine(app):
     if eng is None:
         eng = create_engine(db_url(app), pool_pre_ping=True, future=True)
         app.config["_ENGINE"] = eng
+    if not app.config.get("_SCHEMA_CHECKED"):
+        try:
+            _ensure_indexes(eng)
+            app.config["_SCHEMA_CHECKED"] = True
+        except Exception as e:
+            # 数据库暂时不可用：下次取 engine 时再试
+            app.logger.warning("schema check failed: %s", e)
     return eng
 
+# db/tatou.sql 只在首次建库时执行，已有的库靠启动时补齐索引。
+# 不用 CREATE INDEX IF NOT EXISTS（仅 MariaDB 支持），先查 information_schema
+_REQUIRED_INDEXES = (
+    ("Versions", "ix_Versions_secret", "CREATE INDEX `ix_Versions_secret` ON `Versions` (`secret`)"),
+)
+
+def _ensure_indexes(eng) -> None:
+    """补齐老库缺少的索引（MySQL / MariaDB；其他方言跳过）。"""
+    if eng.dialect.name not in ("mysql", "mariadb"):
+        return
+    with eng.begin() as conn:
+        for table, index, ddl in _REQUIRED_INDEXES:
+            found = conn.execute(
+                text(
+                    "SELECT 1 FROM information_schema.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t AND INDEX_NAME = :i LIMIT 1"
+                ),
+                {"t": table, "i": index},
+            ).first()
+            if found is None:
+                conn.execute(text(ddl))
+
 def _serializer(app):
     return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt="tatou-auth")
 
+def _blob_store(app) -> BlobStore:
+    return BlobStore(Path(app.config["STORAGE_DIR"]) / "blobs")
+
+def _upload_sessions(app) -> UploadSessionStore:
+    return UploadSessionStore(
+        Path(app.config["STORAGE_DIR"]) / "uploads",
+        ttl=app.config["UPLOAD_SESSION_TTL"],
+    )
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+def _watermark_jobs(app) -> WatermarkJobQueue:
+    jobs = app.config.get("_WM_JOBS")
+    if jobs is None:
+        jobs = WatermarkJobQueue(
+            Path(app.config["STORAGE_DIR"]) / "jobs",
+            max_workers=app.config["WM_JOB_WORKERS"],
+            timeout=app.config["WM_JOB_TIMEOUT"],
+            ttl=app.config["WM_JOB_TTL"],
+        )
+        app.config["_WM_JOBS"] = jobs
+    return jobs
+
+def _doc_cache(app) -> DocumentCache:
+    cache = app.config.get("_DOC_CACHE")
+    if cache is None:
+        cache = DocumentCache(
+            max_bytes=app.config["DOC_CACHE_MAX_BYTES"],
+            on_lookup=lambda hit: AppMetrics.observe_cache("document", hit),
+        )
+        app.config["_DOC_CACHE"] = cache
+    return cache
+
+def _result_cache(app) -> WatermarkResultCache | None:
+    if app.config["WM_RESULT_CACHE_MAX_BYTES"] <= 0:
+        return None
+    cache = app.config.get("_WM_RESULT_CACHE")
+    if cache is None:
+        cache = WatermarkResultCache(
+            Path(app.config["STORAGE_DIR"]) / "wm-cache",
+            max_bytes=app.config["WM_RESULT_CACHE_MAX_BYTES"],
+            secret=app.config["SECRET_KEY"].encode("utf-8"),
+        )
+        app.config["_WM_RESULT_CACHE"] = cache
+    return cache
+
+def _wants_async(payload: dict) -> bool:
+    flag = payload.get("async", request.args.get("async"))
+    if isinstance(flag, str):
+        return flag.strip().lower() in ("1", "true", "yes")
+    return bool(flag)
+
+def _source_size(source) -> int | None:
+    """源 PDF 的字节数（字节串或路径），用于指标统计。"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    try:
+        return os.path.getsize(source)
+    except (OSError, TypeError):
+        return None
+
+def _count_document_refs(conn, sha_hex: str) -> int:
+    """统计引用同一 blob 的 Documents 行数（走 ix_documents_sha256 索引）。"""
+    return int(conn.execute(
+        text("SELECT COUNT(*) FROM Documents WHERE sha256 = UNHEX(:sha256hex)"),
+        {"sha256hex": sha_hex},
+    ).scalar() or 0)
+
 
 def create_app():
     app = Flask(__name__)
@@ -87,12 +220,23 @@ def create_app():
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-change-me")
     app.config["STORAGE_DIR"] = Path(os.environ.get("STORAGE_DIR", "./storage")).resolve()
     app.config["TOKEN_TTL_SECONDS"] = int(os.environ.get("TOKEN_TTL_SECONDS", "86400"))
+    app.config["UPLOAD_SESSION_TTL"] = float(os.environ.get("UPLOAD_SESSION_TTL", "86400"))
+    app.config["WM_JOB_WORKERS"] = int(os.environ.get("WM_JOB_WORKERS", "2"))
+    app.config["WM_JOB_TIMEOUT"] = float(os.environ.get("WM_JOB_TIMEOUT", "900"))
+    app.config["WM_JOB_TTL"] = float(os.environ.get("WM_JOB_TTL", "86400"))
+    app.config["WM_BATCH_MAX"] = int(os.environ.get("WM_BATCH_MAX", "500"))
+    app.config["WM_BATCH_WORKERS"] = int(os.environ.get("WM_BATCH_WORKERS", str(os.cpu_count() or 2)))
+    app.config["DOC_CACHE_MAX_BYTES"] = int(os.environ.get("DOC_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    app.config["WM_RESULT_CACHE_MAX_BYTES"] = int(os.environ.get("WM_RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    app.config["WM_POOL_RETRY_AFTER"] = int(os.environ.get("WM_POOL_RETRY_AFTER", "1"))
     
     app.config["RMAP_KEYS_DIR"]    = os.getenv("RMAP_KEYS_DIR", "server/keys/clients")
     app.config["RMAP_SERVER_PUB"]  = os.getenv("RMAP_SERVER_PUB", "server/keys/server_pub.asc")
     app.config["RMAP_SERVER_PRIV"] = os.getenv("RMAP_SERVER_PRIV", "server/keys/server_priv.asc")
     
     app.register_blueprint(rmap_bp, url_prefix="/api")
+    AppMetrics.init_app(app)
+    _init_server_timing(app)
 
     app.config["DB_USER"] = os.environ.get("DB_USER", "tatou")
     app.config["DB_PASSWORD"] = os.environ.get("DB_PASSWORD", "tatou")
@@ -124,6 +268,279 @@ def create_app():
             return f(*args, **kwargs)
         return wrapper
 
+    def _register_document(final_name: str, fname: str, staged: Path, sha_hex: str, size: int):
+        """把暂存文件收进 blob store，链接到用户目录，并写入 Documents 行。"""
+        user_dir = app.config["STORAGE_DIR"] / "files" / g.user["login"]
+        user_dir.mkdir(parents=True, exist_ok=True)
+
+        ts = dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+        stored_name = f"{ts}__{fname}"
+        stored_path = user_dir / stored_name
+
+        # 内容寻址：相同字节只存一份 blob，文档路径是指向它的硬链接
+        blobs = _blob_store(app)
+        try:
+            blobs.adopt(staged, sha_hex, stored_path)
+        except Exception as e:
+            staged.unlink(missing_ok=True)
+            return jsonify({"error": f"failed to store file: {e}"}), 500
+
+        try:
+            with get_engine(app).begin() as conn:
+                # <--- 【修改 2：使用 res.lastrowid 兼容 SQLite】
+                res = conn.execute(
+                    text("""
+                        INSERT INTO Documents (name, path, ownerid, sha256, size)
+                        VALUES (:name, :path, :ownerid, UNHEX(:sha256hex), :size)
+                    """),
+                    {
+                        "name": final_name,
+                        "path": str(stored_path),
+                        "ownerid": int(g.user["id"]),
+                        "sha256hex": sha_hex,
+                        "size": int(size),
+                    },
+                )
+                did = int(res.lastrowid) # 兼容性写法
+                
+                row = conn.execute(
+                    text("""
+                        SELECT id, name, creation, HEX(sha256) AS sha256_hex, size
+                        FROM Documents
+                        WHERE id = :id
+                    """),
+                    {"id": did},
+                ).one()
+        except Exception as e:
+            stored_path.unlink(missing_ok=True)
+            return jsonify({"error": f"database error: {e}"}), 503
+
+        return jsonify({
+            "id": int(row.id),
+            "name": row.name,
+            "creation": row.creation.isoformat() if hasattr(row.creation, "isoformat") else str(row.creation),
+            "sha256": row.sha256_hex,
+            "size": int(row.size),
+        }), 201
+
+    def _apply_cached(sha_hex, source, method: str, secret: str, key: str, position) -> bytes:
+        """嵌入水印；输出由 (源 sha256, 方法及其实现版本, secret, key, position) 唯一确定，命中磁盘缓存时直接返回。
+
+        插件加载的方法（含覆盖内置名字的）不走缓存：同名不代表同一实现。
+        """
+        m = WMUtils.get_method(method)
+        cache = None
+        if isinstance(sha_hex, str) and sha_hex and WMUtils.is_builtin_method(m):
+            cache = _result_cache(app)
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.key_for(sha_hex, m.name, secret, key, position,
+                                      implementation=WMUtils.implementation_id(m))
+            hit = cache.get(cache_key)
+            AppMetrics.observe_cache("result", hit is not None)
+            if hit is not None:
+                return hit
+        t0 = time.perf_counter()
+        wm_bytes = WMUtils.apply_watermark(
+            pdf=source, secret=secret, key=key, method=method, position=position
+        )
+        AppMetrics.observe_watermark("embed", method, time.perf_counter() - t0,
+                                     _source_size(source), len(wm_bytes or b""))
+        if cache_key and isinstance(wm_bytes, (bytes, bytearray)) and len(wm_bytes) > 0:
+            try:
+                cache.put(cache_key, bytes(wm_bytes))
+            except OSError as e:
+                app.logger.warning("watermark result cache write failed: %s", e)
+        return wm_bytes
+
+    def _embed_and_record(doc_id: int, doc_name, file_path: Path, method: str,
+                          intended_for: str, secret: str, key: str, position, source=None,
+                          sha_hex=None):
+        """嵌入水印、写文件并插入 Versions 行；返回 (body, status)，可在后台任务中调用。
+
+        ``source`` 是已加载的源 PDF（例如缓存中的字节），缺省时读 ``file_path``；
+        给出 ``sha_hex`` 时使用结果缓存。
+        """
+        try:
+            with phase("embed", "apply_watermark"):
+                wm_bytes: bytes = _apply_cached(
+                    sha_hex, source if source is not None else str(file_path),
+                    method, secret, key, position,
+                )
+            if not isinstance(wm_bytes, (bytes, bytearray)) or len(wm_bytes) == 0:
+                return {"error": "watermarking produced no output"}, 500
+        except WMUtils.ExecutorBusyError as e:
+            return {"error": f"watermark executor busy: {e}",
+                    "retry_after": app.config["WM_POOL_RETRY_AFTER"]}, 503
+        except Exception as e:
+            return {"error": f"watermarking failed: {e}"}, 500
+
+        base_name = Path(doc_name or file_path.name).stem
+        intended_slug = secure_filename(intended_for)
+        dest_dir = file_path.parent / "watermarks"
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        candidate = f"{base_name}__{intended_slug}.pdf"
+        dest_path = dest_dir / candidate
+        try:
+            with phase("write", "File write"), dest_path.open("wb") as f:
+                f.write(wm_bytes)
+        except Exception as e:
+            return {"error": f"failed to write watermarked file: {e}"}, 500
+
+        import uuid
+        link_token = uuid.uuid4().hex
+        method_official = WMUtils.get_method(method).name
+
+        params = {
+            "documentid": doc_id,
+            "link": link_token,
+            "intended_for": intended_for,
+            "secret": secret,
+            "method": method_official,
+            "position": position or "",
+            "path": str(dest_path),
+        }
+
+        try:
+            with phase("insert", "Versions insert"), get_engine(app).begin() as conn:
+                # <--- 【修改 3：使用 res.lastrowid 兼容 SQLite】
+                res = conn.execute(
+                    text("""
+                        INSERT INTO Versions
+                            (documentid, link, intended_for, secret, method, position, path)
+                        VALUES (:documentid, :link, :intended_for, :secret, :method, :position, :path)
+                    """),
+                    params,
+                )
+                vid = int(res.lastrowid) # 兼容性写法
+
+        except IntegrityError as e:
+            msg = str(getattr(e, "orig", e))
+            if "Duplicate entry" in msg and "uq_Versions_link" in msg:
+                with get_engine(app).connect() as conn:
+                    vrow = conn.execute(
+                        text("""
+                            SELECT id
+                            FROM Versions
+                            WHERE documentid = :documentid AND link = :link
+                        """),
+                        {"documentid": doc_id, "link": link_token},
+                    ).first()
+
+                if vrow is not None:
+                    vid = int(vrow.id)
+                    return (
+                        {
+                            "id": vid,
+                            "documentid": doc_id,
+                            "link": link_token,
+                            "intended_for": intended_for,
+                            "method": method_official,
+                            "position": position,
+                            "filename": candidate,
+                            "size": len(wm_bytes),
+                        }
+                    ), 201
+
+            try:
+                dest_path.unlink(missing_ok=True)
+            except Exception:
+                pass
+            return (
+                {"error": f"database error during version insert: {e}"}
+            ), 503
+
+        except Exception as e:
+            try:
+                dest_path.unlink(missing_ok=True)
+            except Exception:
+                pass
+            return (
+                {"error": f"database error during version insert: {e}"}
+            ), 503
+
+        return {
+
+            "id": vid,
+            "documentid": doc_id,
+            "link": link_token,
+            "intended_for": intended_for,
+            "method": method_official,
+            "position": position,
+            "filename": candidate,
+            "size": len(wm_bytes),
+
+        }, 201
+
+    def _json_response(body: dict, status: int):
+        """JSON 响应；进程池忙（body 带 retry_after）时附加 Retry-After 头。"""
+        resp = jsonify(body)
+        resp.status_code = status
+        if status == 503 and "retry_after" in body:
+            resp.headers["Retry-After"] = str(body["retry_after"])
+        return resp
+
+    def _busy_response(e: Exception):
+        return _json_response({"error": f"watermark executor busy: {e}",
+                               "retry_after": app.config["WM_POOL_RETRY_AFTER"]}, 503)
+
+    def _document_source(row, file_path: Path, method=None, full: bool = False):
+        """按 sha256 从进程内缓存取源 PDF 字节；没有 sha256 时退回到路径。
+
+        只读需要部分的方法（accepts_buffer，如只读尾部的 trailer-hmac）直接拿
+        路径，既保留 mmap 部分读取，也不让整份文档占用缓存。
+        """
+        sha_hex = getattr(row, "sha256_hex", None)
+        if not sha_hex:
+            return file_path.read_bytes() if full else str(file_path)
+        if method is not None and WMUtils.accepts_buffer(WMUtils.get_method(method)):
+            return str(file_path)
+        return _doc_cache(app).get_bytes(sha_hex, file_path)
+
+    def _applicable(row, file_path: Path, method: str, position) -> bool:
+        """适用性检查结果只依赖文档内容，按 sha256 缓存（插件方法不缓存）。"""
+        sha_hex = getattr(row, "sha256_hex", None)
+        m = WMUtils.get_method(method)
+        if not sha_hex or not WMUtils.is_builtin_method(m):
+            return WMUtils.is_watermarking_applicable(method=method, pdf=str(file_path), position=position) is not False
+        # 内置方法对 position 不区分大小写、忽略各项首尾空白，按规范化后的值作键
+        norm = ",".join(t.strip() for t in str(position or "").strip().lower().split(","))
+        return _doc_cache(app).memo(
+            sha_hex, file_path, f"applicable:{m.name}:{norm}",
+            lambda data: WMUtils.is_watermarking_applicable(method=m.name, pdf=data, position=position) is not False,
+        )
+
+    def _owned_document_file(doc_id: int):
+        """查出当前用户的文档并校验路径；返回 (row, file_path, None) 或 (None, None, 错误响应)。"""
+        try:
+            with get_engine(app).connect() as conn:
+                row = conn.execute(
+                    text("""
+                        SELECT id, name, path, HEX(sha256) AS sha256_hex
+                        FROM Documents
+                        WHERE id = :id AND ownerid = :ownerid
+                        LIMIT 1
+                    """),
+                    {"id": doc_id, "ownerid": int(g.user["id"])},
+                ).first()
+        except Exception as e:
+            return None, None, (jsonify({"error": f"database error: {e}"}), 503)
+        if not row:
+            return None, None, (jsonify({"error": "document not found"}), 404)
+
+        storage_root = Path(app.config["STORAGE_DIR"]).resolve()
+        file_path = Path(row.path)
+        if not file_path.is_absolute():
+            file_path = storage_root / file_path
+        file_path = file_path.resolve()
+        try:
+            file_path.relative_to(storage_root)
+        except ValueError:
+            return None, None, (jsonify({"error": "document path invalid"}), 500)
+        if not file_path.exists():
+            return None, None, (jsonify({"error": "file missing on disk"}), 410)
+        return row, file_path, None
+
     # --- Routes ---
 
     @app.route("/<path:filename>")
@@ -226,62 +643,152 @@ def create_app():
         if not header.startswith(b"%PDF-"):
             return jsonify({"error": "file is not a valid PDF"}), 400
 
-        # 检查文件大小 (放宽限制以适应测试数据)
-        file.stream.seek(0, 2)
-        total_size = file.stream.tell()
-        file.stream.seek(0)
+        final_name = request.form.get("name") or fname
+
+        # 单次遍历：边写盘边算 SHA256，大小也在写入时统计
+        staged = _blob_store(app).incoming_path()
+        try:
+            sha_hex, size = _save_stream_hashed(file.stream, staged)
+        except Exception as e:
+            return jsonify({"error": f"failed to store file: {e}"}), 500
 
-        if total_size < 10: # <--- 【修改 1：放宽限制】
+        # 检查文件大小 (放宽限制以适应测试数据)
+        if size < 10: # <--- 【修改 1：放宽限制】
+            staged.unlink(missing_ok=True)
             return jsonify({"error": "file too small to be a valid PDF"}), 400
 
-        user_dir = app.config["STORAGE_DIR"] / "files" / g.user["login"]
-        user_dir.mkdir(parents=True, exist_ok=True)
+        return _register_document(final_name, fname, staged, sha_hex, size)
 
-        ts = dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
-        final_name = request.form.get("name") or fname
-        stored_name = f"{ts}__{fname}"
-        stored_path = user_dir / stored_name
-        file.save(stored_path)
+    # --- Resumable uploads: initiate -> PUT byte ranges -> finalize ---
 
-        sha_hex = _sha256_file(stored_path)
-        size = stored_path.stat().st_size
+    def _session_view(state: dict) -> dict:
+        return {
+            "upload_id": state["upload_id"],
+            "name": state["name"],
+            "offset": int(state["offset"]),
+            "size": state.get("size"),
+        }
+
+    def _owned_session(upload_id: str):
+        state = _upload_sessions(app).load(upload_id)
+        if state is None or int(state.get("ownerid", -1)) != int(g.user["id"]):
+            return None
+        return state
 
+    @app.post("/api/upload-sessions")
+    @require_auth
+    def create_upload_session():
+        payload = request.get_json(silent=True) or {}
+        fname = secure_filename(str(payload.get("filename") or ""))
+        if not fname:
+            return jsonify({"error": "filename is required"}), 400
+        if not fname.lower().endswith(".pdf"):
+            return jsonify({"error": "only PDF files are allowed"}), 400
+
+        size = payload.get("size")
+        if size is not None:
+            try:
+                size = int(size)
+            except (TypeError, ValueError):
+                return jsonify({"error": "size must be an integer"}), 400
+            if size < 10:
+                return jsonify({"error": "file too small to be a valid PDF"}), 400
+
+        final_name = str(payload.get("name") or fname)
         try:
-            with get_engine(app).begin() as conn:
-                # <--- 【修改 2：使用 res.lastrowid 兼容 SQLite】
-                res = conn.execute(
-                    text("""
-                        INSERT INTO Documents (name, path, ownerid, sha256, size)
-                        VALUES (:name, :path, :ownerid, UNHEX(:sha256hex), :size)
-                    """),
-                    {
-                        "name": final_name,
-                        "path": str(stored_path),
-                        "ownerid": int(g.user["id"]),
-                        "sha256hex": sha_hex,
-                        "size": int(size),
-                    },
-                )
-                did = int(res.lastrowid) # 兼容性写法
-                
-                row = conn.execute(
-                    text("""
-                        SELECT id, name, creation, HEX(sha256) AS sha256_hex, size
-                        FROM Documents
-                        WHERE id = :id
-                    """),
-                    {"id": did},
-                ).one()
+            state = _upload_sessions(app).create(g.user["id"], fname, final_name, size)
         except Exception as e:
-            return jsonify({"error": f"database error: {e}"}), 503
+            return jsonify({"error": f"failed to create upload session: {e}"}), 500
+        return jsonify(_session_view(state)), 201
 
-        return jsonify({
-            "id": int(row.id),
-            "name": row.name,
-            "creation": row.creation.isoformat() if hasattr(row.creation, "isoformat") else str(row.creation),
-            "sha256": row.sha256_hex,
-            "size": int(row.size),
-        }), 201
+    @app.get("/api/upload-sessions/<upload_id>")
+    @require_auth
+    def get_upload_session(upload_id: str):
+        state = _owned_session(upload_id)
+        if state is None:
+            return jsonify({"error": "upload session not found"}), 404
+        return jsonify(_session_view(state)), 200
+
+    @app.put("/api/upload-sessions/<upload_id>")
+    @require_auth
+    def put_upload_chunk(upload_id: str):
+        state = _owned_session(upload_id)
+        if state is None:
+            return jsonify({"error": "upload session not found"}), 404
+
+        m = _CONTENT_RANGE_RE.match(request.headers.get("Content-Range", "").strip())
+        if not m:
+            return jsonify({"error": "Content-Range: bytes <start>-<end>/<total|*> is required"}), 400
+        start, end = int(m.group(1)), int(m.group(2))
+        if end < start:
+            return jsonify({"error": "invalid Content-Range"}), 400
+        if m.group(3) != "*" and state.get("size") is not None and int(m.group(3)) != int(state["size"]):
+            return jsonify({"error": "total size does not match the upload session"}), 400
+
+        # 直接读原始请求流，按块写盘，内存占用与文件大小无关；
+        # 请求体长度与 Content-Range 不符时整块回滚
+        try:
+            state = _upload_sessions(app).append(state, request.stream, start, end)
+        except UploadSessionNotFound:
+            return jsonify({"error": "upload session not found"}), 404
+        except UploadOffsetError as e:
+            return jsonify({"error": str(e), "offset": e.expected}), 409
+        except Exception as e:
+            current = _upload_sessions(app).load(upload_id) or state
+            return jsonify({"error": f"failed to store chunk: {e}", "offset": int(current["offset"])}), 400
+
+        return jsonify(_session_view(state)), 200
+
+    @app.post("/api/upload-sessions/<upload_id>/finalize")
+    @require_auth
+    def finalize_upload_session(upload_id: str):
+        state = _owned_session(upload_id)
+        if state is None:
+            return jsonify({"error": "upload session not found"}), 404
+
+        sessions = _upload_sessions(app)
+        expected = str((request.get_json(silent=True) or {}).get("sha256") or "").lower()
+        # 持有与 PUT 相同的锁，校验和移交期间不会有块写入
+        try:
+            with sessions.locked(upload_id) as state:
+                size = int(state["offset"])
+                if state.get("size") is not None and size != int(state["size"]):
+                    return jsonify({"error": "upload incomplete", "offset": size, "size": state["size"]}), 409
+                if size < 10:
+                    return jsonify({"error": "file too small to be a valid PDF"}), 400
+
+                part = sessions.part_path(upload_id)
+                with part.open("rb") as fh:
+                    if not fh.read(5).startswith(b"%PDF-"):
+                        sessions.discard(upload_id)
+                        return jsonify({"error": "file is not a valid PDF"}), 400
+
+                sha_hex = sessions.digest(state)
+                if expected and expected != sha_hex:
+                    return jsonify({"error": "sha256 mismatch", "sha256": sha_hex.upper()}), 409
+
+                # 只在 finalize 时才写 Documents 行
+                staged = _blob_store(app).incoming_path()
+                os.replace(part, staged)
+                resp = _register_document(state["name"], state["filename"], staged, sha_hex, size)
+                sessions.discard(upload_id)
+                return resp
+        except UploadSessionNotFound:
+            return jsonify({"error": "upload session not found"}), 404
+
+    @app.delete("/api/upload-sessions/<upload_id>")
+    @require_auth
+    def abort_upload_session(upload_id: str):
+        state = _owned_session(upload_id)
+        if state is None:
+            return jsonify({"error": "upload session not found"}), 404
+        sessions = _upload_sessions(app)
+        try:
+            with sessions.locked(upload_id):
+                sessions.discard(upload_id)
+        except UploadSessionNotFound:
+            return jsonify({"error": "upload session not found"}), 404
+        return jsonify({"deleted": True, "upload_id": upload_id}), 200
 
     @app.get("/api/list-documents")
     @require_auth
@@ -480,7 +987,7 @@ def create_app():
         try:
             with get_engine(app).connect() as conn:
                 row = conn.execute(
-                    text("SELECT id, path FROM Documents WHERE id = :id AND ownerid = :uid"),
+                    text("SELECT id, path, HEX(sha256) AS sha256_hex FROM Documents WHERE id = :id AND ownerid = :uid"),
                     {"id": doc_id, "uid": int(g.user["id"])},
                 ).first()
         except Exception as e:
@@ -502,12 +1009,18 @@ def create_app():
         except Exception as e:
             app.logger.error("Path safety check failed for doc id=%s: %s", row.id, e)
 
+        sha_hex = row.sha256_hex.lower() if isinstance(row.sha256_hex, str) and row.sha256_hex else None
+        blob_released = False
         try:
             with get_engine(app).begin() as conn:
                 conn.execute(
                     text("DELETE FROM Documents WHERE id = :id AND ownerid = :uid"),
                     {"id": doc_id, "uid": int(g.user["id"])},
                 )
+                # 最后一个引用消失时才删除 blob
+                if sha_hex and _count_document_refs(conn, sha_hex) == 0:
+                    blob_released = _blob_store(app).release(sha_hex)
+                    _doc_cache(app).discard(sha_hex)
         except Exception as e:
             return jsonify({"error": f"database error during delete: {e}"}), 503
 
@@ -516,6 +1029,7 @@ def create_app():
             "id": doc_id,
             "file_deleted": file_deleted,
             "file_missing": file_missing,
+            "blob_released": blob_released,
         }), 200
     
     @app.post("/api/create-watermark")
@@ -543,10 +1057,10 @@ def create_app():
             return jsonify({"error": "method, intended_for, secret, and key are required"}), 400
 
         try:
-            with get_engine(app).connect() as conn:
+            with phase("db", "Documents lookup"), get_engine(app).connect() as conn:
                 row = conn.execute(
                     text("""
-                        SELECT id, name, path
+                        SELECT id, name, path, HEX(sha256) AS sha256_hex
                         FROM Documents
                         WHERE id = :id AND ownerid = :ownerid
                         LIMIT 1
@@ -558,66 +1072,169 @@ def create_app():
         if not row:
             return jsonify({"error": "document not found"}), 404
 
-        storage_root = Path(app.config["STORAGE_DIR"]).resolve()
-        file_path = Path(row.path)
-        if not file_path.is_absolute():
-            file_path = storage_root / file_path
-        file_path = file_path.resolve()
-        try:
-            file_path.relative_to(storage_root)
-        except ValueError:
-            return jsonify({"error": "document path invalid"}), 500
-        if not file_path.exists():
-            return jsonify({"error": "file missing on disk"}), 410
+        with phase("resolve", "Path resolution"):
+            storage_root = Path(app.config["STORAGE_DIR"]).resolve()
+            file_path = Path(row.path)
+            if not file_path.is_absolute():
+                file_path = storage_root / file_path
+            file_path = file_path.resolve()
+            try:
+                file_path.relative_to(storage_root)
+            except ValueError:
+                return jsonify({"error": "document path invalid"}), 500
+            if not file_path.exists():
+                return jsonify({"error": "file missing on disk"}), 410
 
         try:
-            applicable = WMUtils.is_watermarking_applicable(
-                method=method, pdf=str(file_path), position=position
-            )
-            if applicable is False:
-                return jsonify({"error": "watermarking method not applicable"}), 400
+            with phase("applicable", "is_watermarking_applicable"):
+                if not _applicable(row, file_path, method, position):
+                    return jsonify({"error": "watermarking method not applicable"}), 400
+            with phase("load", "Source load"):
+                source = _document_source(row, file_path)
         except Exception as e:
             return jsonify({"error": f"watermark applicability check failed: {e}"}), 400
 
-        try:
-            wm_bytes: bytes = WMUtils.apply_watermark(
-                pdf=str(file_path), secret=secret, key=key, method=method, position=position
+        if _wants_async(payload):
+            job = _watermark_jobs(app).submit(
+                g.user["id"], doc_id,
+                lambda: _embed_and_record(doc_id, row.name, file_path, method,
+                                          intended_for, secret, key, position, source,
+                                          row.sha256_hex),
             )
-            if not isinstance(wm_bytes, (bytes, bytearray)) or len(wm_bytes) == 0:
-                return jsonify({"error": "watermarking produced no output"}), 500
-        except Exception as e:
-            return jsonify({"error": f"watermarking failed: {e}"}), 500
+            return jsonify({
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "documentid": doc_id,
+                "status_url": f"/api/watermark-jobs/{job['job_id']}",
+            }), 202
+
+        body, status = _embed_and_record(doc_id, row.name, file_path, method,
+                                         intended_for, secret, key, position, source,
+                                         row.sha256_hex)
+        return _json_response(body, status)
+
+    @app.post("/api/create-watermark-batch")
+    @app.post("/api/create-watermark-batch/<int:document_id>")
+    @require_auth
+    def create_watermark_batch(document_id: int | None = None):
+        payload = request.get_json(silent=True) or {}
+        if not document_id:
+            document_id = request.args.get("id") or request.args.get("documentid") or payload.get("id")
+        try:
+            doc_id = int(document_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "document id required and must be integer"}), 400
+
+        method = payload.get("method")
+        position = payload.get("position") or None
+        key = payload.get("key")
+        recipients = payload.get("recipients")
+        if not method or not isinstance(key, str) or not isinstance(recipients, list) or not recipients:
+            return jsonify({"error": "method, key, and a non-empty recipients list are required"}), 400
+        if len(recipients) > app.config["WM_BATCH_MAX"]:
+            return jsonify({"error": f"at most {app.config['WM_BATCH_MAX']} recipients per batch"}), 400
+        for i, r in enumerate(recipients):
+            if not isinstance(r, dict) or not r.get("intended_for") or not isinstance(r.get("secret"), str):
+                return jsonify({"error": f"recipients[{i}] needs intended_for and secret"}), 400
 
-        base_name = Path(row.name or file_path.name).stem
-        intended_slug = secure_filename(intended_for)
-        dest_dir = file_path.parent / "watermarks"
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        candidate = f"{base_name}__{intended_slug}.pdf"
-        dest_path = dest_dir / candidate
         try:
-            with dest_path.open("wb") as f:
-                f.write(wm_bytes)
+            method_official = WMUtils.get_method(method).name
+        except KeyError as e:
+            return jsonify({"error": str(e)}), 400
+
+        row, file_path, err = _owned_document_file(doc_id)
+        if err:
+            return err
+
+        # 源文件只读一次（命中缓存时不读），适用性也只检查一次
+        try:
+            src_bytes = _document_source(row, file_path)
+            if not _applicable(row, file_path, method, position):
+                return jsonify({"error": "watermarking method not applicable"}), 400
         except Exception as e:
-            return jsonify({"error": f"failed to write watermarked file: {e}"}), 500
+            return jsonify({"error": f"watermark applicability check failed: {e}"}), 400
+
+        def _embed(r):
+            return _apply_cached(row.sha256_hex, src_bytes, method, r["secret"], key, position)
 
         import uuid
-        link_token = uuid.uuid4().hex
-        method_official = WMUtils.get_method(method).name
+        base_name = Path(row.name or file_path.name).stem
+        dest_dir = file_path.parent / "watermarks"
+        dest_dir.mkdir(parents=True, exist_ok=True)
 
-        params = {
-            "documentid": doc_id,
-            "link": link_token,
-            "intended_for": intended_for,
-            "secret": secret,
-            "method": method_official,
-            "position": position or "",
-            "path": str(dest_path),
-        }
+        params, created, errors, used_names, busy = [], [], [], set(), []
 
+        def _store(i, r, fut):
+            """把一个完成的结果写盘，只保留元数据（按 recipients 下标记录）。"""
+            try:
+                wm_bytes = fut.result()
+                if not isinstance(wm_bytes, (bytes, bytearray)) or len(wm_bytes) == 0:
+                    raise ValueError("watermarking produced no output")
+            except WMUtils.ExecutorBusyError as e:
+                busy.append(e)
+                errors.append({"index": i, "intended_for": r["intended_for"], "error": f"watermark executor busy: {e}"})
+                return
+            except Exception as e:
+                errors.append({"index": i, "intended_for": r["intended_for"], "error": f"watermarking failed: {e}"})
+                return
+
+            link_token = uuid.uuid4().hex
+            candidate = f"{base_name}__{secure_filename(r['intended_for'])}.pdf"
+            if candidate in used_names:
+                candidate = f"{Path(candidate).stem}__{link_token[:8]}.pdf"
+            used_names.add(candidate)
+            dest_path = dest_dir / candidate
+            try:
+                dest_path.write_bytes(wm_bytes)
+            except Exception as e:
+                errors.append({"index": i, "intended_for": r["intended_for"], "error": f"failed to write watermarked file: {e}"})
+                return
+
+            params.append((i, {
+                "documentid": doc_id,
+                "link": link_token,
+                "intended_for": r["intended_for"],
+                "secret": r["secret"],
+                "method": method_official,
+                "position": position or "",
+                "path": str(dest_path),
+            }))
+            created.append((i, {
+                "link": link_token,
+                "intended_for": r["intended_for"],
+                "filename": candidate,
+                "size": len(wm_bytes),
+            }))
+
+        # 每个结果一完成就写盘；在途任务最多 2×workers 个，内存中同时存在的
+        # 水印输出不随 recipients 数量增长
+        workers = max(1, min(app.config["WM_BATCH_WORKERS"], len(recipients)))
+        todo = iter(enumerate(recipients))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wm-batch") as pool:
+            pending = {pool.submit(_embed, r): (i, r) for i, r in itertools.islice(todo, 2 * workers)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i, r = pending.pop(fut)
+                    _store(i, r, fut)
+                    for j, nxt in itertools.islice(todo, 1):
+                        pending[pool.submit(_embed, nxt)] = (j, nxt)
+
+        # 响应与插入顺序保持与 recipients 一致
+        params = [p_ for _, p_ in sorted(params, key=lambda t: t[0])]
+        created = [c for _, c in sorted(created, key=lambda t: t[0])]
+        errors.sort(key=lambda e: e["index"])
+
+        if not params:
+            if busy:
+                return _json_response({"error": "no version could be created", "errors": errors,
+                                       "retry_after": app.config["WM_POOL_RETRY_AFTER"]}, 503)
+            return jsonify({"error": "no version could be created", "errors": errors}), 500
+
+        # 一个事务、一次 executemany（PyMySQL 会改写成单条多行 INSERT）
         try:
             with get_engine(app).begin() as conn:
-                # <--- 【修改 3：使用 res.lastrowid 兼容 SQLite】
-                res = conn.execute(
+                conn.execute(
                     text("""
                         INSERT INTO Versions
                             (documentid, link, intended_for, secret, method, position, path)
@@ -625,66 +1242,39 @@ def create_app():
                     """),
                     params,
                 )
-                vid = int(res.lastrowid) # 兼容性写法
-
-        except IntegrityError as e:
-            msg = str(getattr(e, "orig", e))
-            if "Duplicate entry" in msg and "uq_Versions_link" in msg:
-                with get_engine(app).connect() as conn:
-                    row = conn.execute(
-                        text("""
-                            SELECT id
-                            FROM Versions
-                            WHERE documentid = :documentid AND link = :link
-                        """),
-                        {"documentid": doc_id, "link": link_token},
-                    ).first()
-
-                if row is not None:
-                    vid = int(row.id)
-                    return jsonify(
-                        {
-                            "id": vid,
-                            "documentid": doc_id,
-                            "link": link_token,
-                            "intended_for": intended_for,
-                            "method": method_official,
-                            "position": position,
-                            "filename": candidate,
-                            "size": len(wm_bytes),
-                        }
-                    ), 201
-
-            try:
-                dest_path.unlink(missing_ok=True)
-            except Exception:
-                pass
-            return jsonify(
-                {"error": f"database error during version insert: {e}"}
-            ), 503
-
+                ids = {
+                    r.link: int(r.id)
+                    for r in conn.execute(
+                        text("SELECT id, link FROM Versions WHERE link IN :links")
+                        .bindparams(bindparam("links", expanding=True)),
+                        {"links": [p["link"] for p in params]},
+                    )
+                }
         except Exception as e:
-            try:
-                dest_path.unlink(missing_ok=True)
-            except Exception:
-                pass
-            return jsonify(
-                {"error": f"database error during version insert: {e}"}
-            ), 503
+            for p_ in params:
+                Path(p_["path"]).unlink(missing_ok=True)
+            return jsonify({"error": f"database error during version insert: {e}"}), 503
 
+        versions = [{"id": ids.get(v["link"]), "documentid": doc_id, **v} for v in created]
         return jsonify({
-
-            "id": vid,
             "documentid": doc_id,
-            "link": link_token,
-            "intended_for": intended_for,
             "method": method_official,
             "position": position,
-            "filename": candidate,
-            "size": len(wm_bytes),
-
+            "count": len(versions),
+            "versions": versions,
+            "errors": errors,
         }), 201
 
+    @app.get("/api/watermark-jobs/<job_id>")
+    @require_auth
+    def get_watermark_job(job_id: str):
+        job = _watermark_jobs(app).get(job_id)
+        if job is None or int(job.get("ownerid", -1)) != int(g.user["id"]):
+            return jsonify({"error": "job not found"}), 404
+        for internal in ("ownerid", "host", "pid"):
+            job.pop(internal, None)
+        return jsonify(job), 200
+
     @app.get("/api/get-watermarking-methods")
     def get_watermarking_methods():
         methods = []
@@ -719,7 +1309,7 @@ def create_app():
             with get_engine(app).connect() as conn:
                 row = conn.execute(
                     text("""
-                        SELECT id, name, path
+                        SELECT id, name, path, HEX(sha256) AS sha256_hex
                         FROM Documents
                         WHERE id = :id AND ownerid = :ownerid
                         LIMIT 1
@@ -746,11 +1336,21 @@ def create_app():
             return jsonify({"error": "file missing on disk"}), 410
 
         try:
-            secret = WMUtils.read_watermark(
-                method=method,
-                pdf=str(file_path),
-                key=key
-            )
+            t0 = time.perf_counter()
+            if method.strip().lower() == WMUtils.AUTO_METHOD:
+                # 不知道方法时依次尝试所有方法，返回检测到的方法名：只读尾部的
+                # 方法直接读文件，需要整份解析的方法才从缓存取源字节
+                method, secret = WMUtils.detect_watermark(
+                    pdf=str(file_path), key=key,
+                    load=lambda: _document_source(row, file_path, full=True),
+                )
+            else:
+                source = _document_source(row, file_path, method=method)
+                secret = WMUtils.read_watermark(method=method, pdf=source, key=key)
+            AppMetrics.observe_watermark("read", method, time.perf_counter() - t0,
+                                         _source_size(str(file_path)))
+        except WMUtils.ExecutorBusyError as e:
+            return _busy_response(e)
         except Exception as e:
             return jsonify({"error": f"Error when attempting to read watermark: {e}"}), 400
 
@@ -761,6 +1361,69 @@ def create_app():
             "position": position
         }), 200
 
+    @app.post("/api/identify-leak")
+    @require_auth
+    def identify_leak():
+        """上传泄露的 PDF：无需 key，用所有方法提取 secret，再按 ix_Versions_secret 找到对应版本。"""
+        if "file" not in request.files:
+            return jsonify({"error": "file is required (multipart/form-data)"}), 400
+        data = request.files["file"].read()
+        if not data.startswith(b"%PDF-"):
+            return jsonify({"error": "file is not a valid PDF"}), 400
+
+        # 提取出的 secret 未经 MAC 校验，只用来缩小候选范围
+        try:
+            found = WMUtils.peek_secrets(data)
+        except Exception as e:
+            return jsonify({"error": f"failed to extract watermark: {e}"}), 400
+        if not found:
+            return jsonify({"error": "no embedded secret found"}), 404
+
+        try:
+            with get_engine(app).connect() as conn:
+                rows = conn.execute(
+                    text("""
+                        SELECT v.id, v.documentid, v.intended_for, v.method, v.link, v.secret,
+                               d.name AS document_name
+                        FROM Versions v
+                        JOIN Documents d ON d.id = v.documentid
+                        WHERE v.secret IN :secrets AND d.ownerid = :uid
+                        ORDER BY v.id
+                    """).bindparams(bindparam("secrets", expanding=True)),
+                    {"secrets": [sec for _, sec in found], "uid": int(g.user["id"])},
+                ).all()
+        except Exception as e:
+            return jsonify({"error": f"database error: {e}"}), 503
+
+        # 提供 key 时用各版本的方法校验 MAC
+        key = request.form.get("key")
+        verified_by: dict = {}
+        matches = []
+        for r in rows:
+            verified = None
+            if key:
+                if r.method not in verified_by:
+                    try:
+                        verified_by[r.method] = WMUtils.read_watermark(method=r.method, pdf=data, key=key)
+                    except Exception:
+                        verified_by[r.method] = None
+                verified = verified_by[r.method] == r.secret
+            matches.append({
+                "id": int(r.id),
+                "documentid": int(r.documentid),
+                "document_name": r.document_name,
+                "intended_for": r.intended_for,
+                "method": r.method,
+                "link": r.link,
+                "verified": verified,
+            })
+
+        return jsonify({
+            "secrets": [{"method": m, "secret": sec} for m, sec in found],
+            "matches": matches,
+            "count": len(matches),
+        }), 200
+
     @app.post("/api/load-plugin")
     @require_auth
     def load_plugin():
@@ -0,0 +1,111 @@
+"""
+server_timing.py
+
+Per-request phase timing, reported as a ``Server-Timing`` response
+header and as one structured (JSON) log line per request.
+
+Route code wraps the steps it wants broken down::
+
+    with phase("db", "Documents lookup"):
+        row = conn.execute(...)
+
+and the ``after_request`` hook registered by :func:`init_app` emits::
+
+    Server-Timing: db;desc="Documents lookup";dur=1.8, ..., total;dur=42.0
+
+Browser devtools and most APMs render this header directly. The log
+line goes to the ``tatou.timing`` logger with the request method, route,
+status and the same phase durations in milliseconds. Only requests that
+recorded at least one phase are reported.
+
+Outside a request context (e.g. asynchronous watermark jobs running on
+the worker pool) :func:`phase` just runs the block untimed.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from flask import Flask, g, has_request_context, request
+
+_log = logging.getLogger("tatou.timing")
+
+# (name, description, milliseconds)
+Phase = Tuple[str, Optional[str], float]
+
+
+@contextmanager
+def phase(name: str, desc: Optional[str] = None) -> Iterator[None]:
+    """Time the enclosed block as phase ``name`` of the current request.
+
+    ``name`` must be an HTTP token (letters, digits, ``-``/``_``). The
+    phase is recorded even if the block raises. A repeated name
+    accumulates into one entry.
+    """
+    if not has_request_context():
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        phases: List[Phase] = g.setdefault("_timing_phases", [])
+        for i, (n, d, prev) in enumerate(phases):
+            if n == name:
+                phases[i] = (n, d, prev + ms)
+                break
+        else:
+            phases.append((name, desc, ms))
+
+
+def header_value(phases: List[Phase], total_ms: Optional[float] = None) -> str:
+    parts = []
+    for name, desc, ms in phases:
+        d = f';desc="{desc}"' if desc else ""
+        parts.append(f"{name}{d};dur={ms:.1f}")
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def init_app(app: Flask) -> None:
+    """Register the hooks that start the request clock and report phases."""
+    if _log.level == logging.NOTSET:
+        _log.setLevel(logging.INFO)
+    if not _log.handlers and not logging.getLogger().handlers:
+        # Nothing configured (e.g. plain gunicorn): print the JSON lines to stderr.
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _log.addHandler(handler)
+
+    @app.before_request
+    def _timing_start():
+        g._timing_t0 = time.perf_counter()
+
+    @app.after_request
+    def _timing_report(response):
+        phases: List[Phase] = g.pop("_timing_phases", None) or []
+        t0 = g.pop("_timing_t0", None)
+        if not phases:
+            return response
+        total = (time.perf_counter() - t0) * 1000 if t0 is not None else None
+        value = header_value(phases, total)
+        existing = response.headers.get("Server-Timing")
+        response.headers["Server-Timing"] = f"{existing}, {value}" if existing else value
+        _log.info(json.dumps({
+            "event": "server_timing",
+            "method": request.method,
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "path": request.path,
+            "status": response.status_code,
+            "phases_ms": {name: round(ms, 3) for name, _, ms in phases},
+            "total_ms": round(total, 3) if total is not None else None,
+        }, separators=(",", ":")))
+        return response
+
+
+__all__ = ["phase", "header_value", "init_app"]
@@ -0,0 +1,274 @@
+"""
+upload_sessions.py
+
+Resumable, chunked uploads for large PDFs.
+
+A session is created up front, filled with append-only byte ranges and
+finalized once complete. State lives next to the partial data so that
+any gunicorn worker can serve any request of a session::
+
+    STORAGE_DIR/uploads/<upload_id>.json   # owner, names, offset, size
+    STORAGE_DIR/uploads/<upload_id>.part   # bytes received so far
+
+The SHA-256 is computed incrementally while chunks are written. The
+running hash object is kept in-process; a worker that has not seen the
+previous chunks (or was restarted) rebuilds it once from the ``.part``
+file. Memory per request is bounded by ``CHUNK_SIZE``.
+
+Every chunk write and the finalize step hold an exclusive ``flock`` on
+the ``.part`` file, so they never interleave. A chunk is committed only
+if its body length matches its ``Content-Range``; otherwise it is rolled
+back and the client resends it from the session's ``offset``.
+
+A session idle for more than ``ttl`` seconds (since creation or its last
+chunk) is treated as gone. Creating a session sweeps expired ones,
+removing their files and in-process hashers; a session whose lock is
+held by an in-flight request is skipped until the next sweep.
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# upload_id -> (offset the hash covers, running sha256)
+_HASHERS: Dict[str, Tuple[int, Any]] = {}
+_HASHERS_LOCK = threading.Lock()
+
+
+class UploadOffsetError(ValueError):
+    """Raised when a chunk does not start at the session's current offset."""
+
+    def __init__(self, expected: int, got: int):
+        super().__init__(f"chunk starts at {got}, expected offset {expected}")
+        self.expected = expected
+        self.got = got
+
+
+class UploadSessionNotFound(LookupError):
+    """Raised when a session was finalized or aborted while waiting for its lock."""
+
+
+class UploadSessionStore:
+    """Filesystem-backed store of in-progress uploads."""
+
+    def __init__(self, root: str | os.PathLike[str], ttl: float = DEFAULT_TTL):
+        self.root = Path(root)
+        self.ttl = float(ttl)
+
+    # ---- paths ----
+    def _state_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def part_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    def _write_state(self, state: Dict[str, Any]) -> None:
+        path = self._state_path(state["upload_id"])
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(state, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+
+    # ---- lifecycle ----
+    def create(
+        self,
+        owner_id: int,
+        filename: str,
+        name: str,
+        size: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        self.part_path(upload_id).touch()
+        now = int(time.time())
+        state = {
+            "upload_id": upload_id,
+            "ownerid": int(owner_id),
+            "filename": filename,
+            "name": name,
+            "size": size,
+            "offset": 0,
+            "created": now,
+            "updated": now,
+        }
+        self._write_state(state)
+        with _HASHERS_LOCK:
+            _HASHERS[upload_id] = (0, hashlib.sha256())
+        return state
+
+    def load(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        if not _ID_RE.match(upload_id or ""):
+            return None
+        try:
+            state = json.loads(self._state_path(upload_id).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        return None if self._expired(state) else state
+
+    def discard(self, upload_id: str) -> None:
+        with _HASHERS_LOCK:
+            _HASHERS.pop(upload_id, None)
+        self._state_path(upload_id).unlink(missing_ok=True)
+        self.part_path(upload_id).unlink(missing_ok=True)
+
+    def _expired(self, state: Dict[str, Any], now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        last = state.get("updated", state.get("created", 0))
+        return now - float(last) > self.ttl
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Remove sessions idle for more than ``ttl``; return how many."""
+        now = time.time() if now is None else now
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            entries = []
+        for e in entries:
+            upload_id = e.name[: -len(".json")]
+            if not e.name.endswith(".json") or not _ID_RE.match(upload_id):
+                continue
+            try:
+                state = json.loads(Path(e.path).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if not self._expired(state, now):
+                continue
+            try:
+                fh = self.part_path(upload_id).open("rb")
+            except FileNotFoundError:
+                fh = None
+            try:
+                if fh is not None:
+                    try:
+                        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # a request is using it right now
+                self.discard(upload_id)
+                removed += 1
+            finally:
+                if fh is not None:
+                    fh.close()
+        # Hashers of sessions another worker finished, aborted or expired.
+        with _HASHERS_LOCK:
+            stale = [u for u in _HASHERS if not self._state_path(u).exists()]
+            for u in stale:
+                del _HASHERS[u]
+        return removed
+
+    # ---- hashing ----
+    def _hasher_for(self, upload_id: str, offset: int):
+        with _HASHERS_LOCK:
+            cached = _HASHERS.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        # Another worker wrote the previous chunks: rehash what is on disk.
+        h = hashlib.sha256()
+        remaining = offset
+        with self.part_path(upload_id).open("rb") as fh:
+            while remaining > 0:
+                chunk = fh.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                h.update(chunk)
+                remaining -= len(chunk)
+        return h
+
+    @contextmanager
+    def _locked_part(self, upload_id: str, mode: str) -> Iterator[Tuple[BinaryIO, Dict[str, Any]]]:
+        """Open the ``.part`` file, take its flock and re-read the state under it."""
+        try:
+            fh = self.part_path(upload_id).open(mode)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id) from None
+        with fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                state = self.load(upload_id)
+                if state is None:
+                    # Finalized or aborted while we waited for the lock.
+                    raise UploadSessionNotFound(upload_id)
+                yield fh, state
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @contextmanager
+    def locked(self, upload_id: str) -> Iterator[Dict[str, Any]]:
+        """Hold the lock chunk writes take and yield the current state.
+
+        Finalize and abort run under it so they cannot race a PUT.
+        """
+        with self._locked_part(upload_id, "rb") as (_, state):
+            yield state
+
+    def append(
+        self, state: Dict[str, Any], stream: BinaryIO, start: int, end: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Append ``stream`` at byte ``start`` and return the updated state.
+
+        With ``end`` (inclusive, from ``Content-Range``) the body must be
+        exactly ``end - start + 1`` bytes. A short or long body, or one
+        that overruns the declared size, is rolled back and raises
+        ``ValueError``; the session stays at its previous ``offset``.
+        """
+        upload_id = state["upload_id"]
+        with self._locked_part(upload_id, "r+b") as (fh, state):
+            offset = int(state["offset"])
+            if start != offset:
+                raise UploadOffsetError(offset, start)
+            h = self._hasher_for(upload_id, offset)
+            before = h.copy()
+            fh.seek(offset)
+            fh.truncate()
+            limit = state.get("size")
+            # Read at most one byte past the declared range to detect a long body.
+            budget = None if end is None else end - start + 2
+            received = 0
+            try:
+                while budget is None or received < budget:
+                    want = CHUNK_SIZE if budget is None else min(CHUNK_SIZE, budget - received)
+                    chunk = stream.read(want)
+                    if not chunk:
+                        break
+                    if limit is not None and offset + received + len(chunk) > int(limit):
+                        raise ValueError("chunk exceeds declared upload size")
+                    fh.write(chunk)
+                    h.update(chunk)
+                    received += len(chunk)
+                if end is not None and start + received - 1 != end:
+                    raise ValueError(
+                        f"body has {received} bytes but Content-Range declares {end - start + 1}"
+                    )
+            except BaseException:
+                fh.truncate(offset)
+                fh.flush()
+                with _HASHERS_LOCK:
+                    _HASHERS[upload_id] = (offset, before)
+                raise
+            fh.flush()
+            state["offset"] = offset + received
+            state["updated"] = int(time.time())
+            self._write_state(state)
+            with _HASHERS_LOCK:
+                _HASHERS[upload_id] = (state["offset"], h)
+        return state
+
+    def digest(self, state: Dict[str, Any]) -> str:
+        return self._hasher_for(state["upload_id"], int(state["offset"])).hexdigest()
+
+
+__all__ = ["CHUNK_SIZE", "DEFAULT_TTL", "UploadOffsetError", "UploadSessionNotFound", "UploadSessionStore"]
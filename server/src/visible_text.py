@@ -2,7 +2,12 @@
 from __future__ import annotations
 from typing import Optional, Union
 
-import fitz  # PyMuPDF (>=1.24)
+try:
+    # 新版 PyMuPDF 在 ``import fitz`` 时会向 stdout 打印弃用提示，破坏管道输出
+    import pymupdf as fitz  # PyMuPDF (>=1.24.3)
+except ImportError:
+    import fitz  # PyMuPDF (>=1.24)
+mupdf = fitz.mupdf  # 底层 MuPDF 绑定（增量写出）
 
 from .watermarking_method import WatermarkingMethod, load_pdf_bytes
 from .add_after_eof import AddAfterEOF
@@ -11,61 +16,236 @@ BytesLike = Union[bytes, bytearray, memoryview]
 PdfInput = Union[str, BytesLike]
 
 
+def _parse_page_selector(position: Optional[str]) -> list[tuple[str, int, int]]:
+    """解析页面选择器，返回 (kind, a, b) 列表。
+
+    支持（逗号可组合，页码从 1 开始）：
+    ``all``（默认）、``first``、``last``、``N``、``a-b``（``b`` 可为 ``last``）、
+    ``every:N``（第 1、1+N、1+2N… 页）。
+    无法解析的值（如旧式的 ``br``、``eof``、``center``）与 ``all`` 相同，
+    保持与旧客户端兼容。
+    """
+    spec = (position or "").strip().lower()
+    if not spec or spec == "all":
+        return [("all", 0, 0)]
+    terms: list[tuple[str, int, int]] = []
+    for raw in spec.split(","):
+        term = raw.strip()
+        try:
+            if term in ("first", "last"):
+                terms.append((term, 0, 0))
+            elif term.startswith("every:"):
+                step = int(term[len("every:"):])
+                if step < 1:
+                    raise ValueError
+                terms.append(("every", step, 0))
+            elif "-" in term:
+                lo, hi = term.split("-", 1)
+                a = int(lo)
+                b = -1 if hi.strip() == "last" else int(hi)
+                if a < 1 or (b != -1 and b < a):
+                    raise ValueError
+                terms.append(("range", a, b))
+            else:
+                n = int(term)
+                if n < 1:
+                    raise ValueError
+                terms.append(("range", n, n))
+        except ValueError:
+            return [("all", 0, 0)]
+    return terms
+
+
+def _select_pages(position: Optional[str], page_count: int) -> list[int]:
+    """把 position 解析为升序、去重的 0 基页码；越界部分截断。"""
+    pages: set[int] = set()
+    for kind, a, b in _parse_page_selector(position):
+        if kind == "all":
+            pages.update(range(page_count))
+        elif kind == "first":
+            pages.add(0)
+        elif kind == "last":
+            pages.add(page_count - 1)
+        elif kind == "every":
+            pages.update(range(0, page_count, a))
+        else:
+            hi = page_count if b == -1 else min(b, page_count)
+            pages.update(range(a - 1, hi))
+    selected = sorted(p for p in pages if 0 <= p < page_count)
+    if not selected:
+        raise ValueError(f"page selector {position!r} selects no pages")
+    return selected
+
+
+def _incremental_bytes(doc: "fitz.Document") -> bytes:
+    """原始字节 + 增量更新段（只含修改过的对象），写到内存缓冲区。
+
+    ``Document.save(incremental=True)`` 只能写回打开时的文件，这里直接
+    调用 MuPDF 的 pdf_write_document。保留原 /ID，保证输出确定。
+    """
+    pdf = mupdf.pdf_document_from_fz_document(doc.this)
+    opts = mupdf.PdfWriteOptions()
+    opts.do_incremental = 1
+    opts.do_encrypt = fitz.PDF_ENCRYPT_KEEP
+    opts.dont_regenerate_id = 1
+    buf = mupdf.FzBuffer(0)
+    out = mupdf.FzOutput(buf)
+    try:
+        mupdf.pdf_write_document(pdf, out, opts)
+    finally:
+        out.fz_close_output()
+    return buf.fz_buffer_extract()
+
+
 class VisibleTextWatermark(WatermarkingMethod):
     """
     最简实现（新版 PyMuPDF）：
     - 可见：每页居中叠加 `secret` 文字；
     - 机读：仅使用 EOF trailer 作为单一路径（AddAfterEOF）。
+    - 输出：默认增量写出，原始字节原样保留为前缀，只追加修改过的页面、
+      内容流和字体资源；无法增量写出时（如修复过的文件）整体重写。
+    - 同尺寸页面共享一个 Form XObject，每页只增加一个引用。
+    - position 为页面选择器（如 ``first``、``1-5``、``every:10``、
+      ``last``，可逗号组合），默认每页都加。
     """
     name = "visible-text-redundant"
     _CONTEXT: bytes = b"wm:vtext:minimal:v1:"
+    # add_watermark 自己调用 load_pdf_bytes；读取走 AddAfterEOF 的尾部读取
+    accepts_buffer = True
+    # False 时总是整体重写（doc.tobytes）
+    incremental = True
 
     @staticmethod
     def get_usage() -> str:
-        return "Adds centered visible text on each page, and stores an HMACed payload in EOF trailer."
+        return (
+            "Adds centered visible text on each selected page, and stores an HMACed payload in EOF trailer. "
+            "Position selects pages (1-based, comma-separated): 'all' (default), 'first', 'last', "
+            "'N', 'a-b' (b may be 'last'), 'every:N'."
+        )
 
 
-    def _add_visible_overlay(self, pdf_bytes: bytes, text: str) -> bytes:
+    def _add_visible_overlay(self, pdf_bytes: bytes, text: str, position: Optional[str] = None) -> bytes:
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        ALIGN_CENTER = 1  # 0=left, 1=center, 2=right, 3=justify
-        for page in doc:
-            rect = page.rect
-            # 适度留白，避免贴边
-            margin = 36
-            box = fitz.Rect(rect.x0 + margin, rect.y0 + margin, rect.x1 - margin, rect.y1 - margin)
-            page.insert_textbox(
-                box,
-                text,
-                fontsize=48,
-                align=ALIGN_CENTER,
-                rotate=0,
-                color=(0.6, 0.6, 0.6),
-                overlay=True,
-            )
+        # 同一几何（MediaBox + CropBox + 旋转，即相同的 page.rect 和页面
+        # 变换）的页面共享一个 Form XObject 和一条内容流：文字只排版一次，
+        # 其余页面只加一个引用
+        stamps: dict[tuple, tuple[int, str, int]] = {}
         try:
-            return doc.tobytes()
+            for pno in _select_pages(position, doc.page_count):
+                page = doc.load_page(pno)
+                geom = (tuple(page.mediabox), tuple(page.cropbox), page.rotation)
+                hit = stamps.get(geom)
+                if hit is None or not self._reuse_stamp(doc, page, *hit):
+                    stamps[geom] = self._place_stamp(doc, page, text)
+            return self._serialize(doc)
         finally:
             doc.close()
 
+    @staticmethod
+    def _stamp_page(rect: "fitz.Rect", text: str) -> "fitz.Document":
+        """在与目标页同尺寸的临时单页文档上排版水印文字。"""
+        ALIGN_CENTER = 1  # 0=left, 1=center, 2=right, 3=justify
+        stamp = fitz.open()
+        page = stamp.new_page(width=rect.width, height=rect.height)
+        # 适度留白，避免贴边
+        margin = 36
+        box = fitz.Rect(margin, margin, rect.width - margin, rect.height - margin)
+        page.insert_textbox(
+            box,
+            text,
+            fontsize=48,
+            align=ALIGN_CENTER,
+            rotate=0,
+            color=(0.6, 0.6, 0.6),
+            overlay=True,
+        )
+        return stamp
+
+    def _place_stamp(self, doc: "fitz.Document", page: "fitz.Page", text: str) -> tuple[int, str, int]:
+        """首次遇到某种页面几何：生成 Form XObject，返回 (xref, 资源名, 内容流 xref)。"""
+        stamp = self._stamp_page(page.rect, text)
+        try:
+            before = {x[0] for x in page.get_xobjects()}
+            page.show_pdf_page(page.rect, stamp, 0, overlay=True)
+        finally:
+            stamp.close()
+        # show_pdf_page 在页面资源中新增的包装 XObject（含到该页的坐标变换）
+        xobj = next(x[0] for x in page.get_xobjects() if x[0] not in before and x[2] == 0)
+        name = f"TatouWm{xobj}"
+        contents = doc.get_new_xref()
+        doc.update_object(contents, "<<>>")
+        doc.update_stream(contents, f"q /{name} Do Q".encode("ascii"), compress=False)
+        return xobj, name, contents
+
+    @staticmethod
+    def _reuse_stamp(doc: "fitz.Document", page: "fitz.Page", xobj: int, name: str, contents: int) -> bool:
+        """把已有的 XObject 挂到同几何页面上；资源是继承来的则返回 False。"""
+        owner, path = page.xref, "Resources"
+        kind, val = doc.xref_get_key(owner, path)
+        if kind == "null":
+            return False
+        if kind == "xref":
+            owner, path = int(val.split()[0]), ""
+        path = f"{path}/XObject" if path else "XObject"
+        kind, val = doc.xref_get_key(owner, path)
+        if kind == "xref":
+            owner, path = int(val.split()[0]), ""
+        # 保护原内容的图形状态，避免未配对的 q/cm 影响水印位置
+        if not page.is_wrapped:
+            page.wrap_contents()
+        doc.xref_set_key(owner, f"{path}/{name}" if path else name, f"{xobj} 0 R")
+        refs = [f"{x} 0 R" for x in page.get_contents()] + [f"{contents} 0 R"]
+        doc.xref_set_key(page.xref, "Contents", "[" + " ".join(refs) + "]")
+        return True
+
+    def _serialize(self, doc: "fitz.Document") -> bytes:
+        # 修复过的文件（xref 损坏）MuPDF 不允许增量写出
+        if self.incremental and not doc.is_repaired:
+            try:
+                return _incremental_bytes(doc)
+            except Exception:
+                pass
+        return doc.tobytes()
+
     # ------- main API -------
     def add_watermark(
         self,
         pdf: bytes | str,
         secret: str,
         key: str,
-        position: Optional[str] = None,  # 保留签名兼容
+        position: Optional[str] = None,  # 页面选择器，默认全部页面
     ) -> bytes:
         data = load_pdf_bytes(pdf)
-        # 1) 可见水印（最新版 PyMuPDF）
-        visible_pdf = self._add_visible_overlay(data, secret)
+        # 1) 可见水印（最新版 PyMuPDF），只加在选中的页面上
+        visible_pdf = self._add_visible_overlay(data, secret, position)
         # 2) 机读通道：仅 EOF trailer（最简 & 稳定）
         # payload = self._build_payload(secret, key)
         final_pdf = AddAfterEOF().add_watermark(pdf=visible_pdf, secret=secret, key=key, position="eof")
         return final_pdf
 
     def is_watermark_applicable(self, pdf: bytes | str, position: Optional[str] = None) -> bool:
+        # 旧式位置（"br"、"eof" 等）按全部页面处理，总是适用
+        if _parse_page_selector(position) == [("all", 0, 0)] or pdf is None:
+            return True
+        # 能解析但可能一页都选不到（如 3 页文档上的 "10"）：读出页数确认，
+        # 避免到嵌入时才失败
+        try:
+            doc = fitz.open(stream=load_pdf_bytes(pdf), filetype="pdf")
+        except Exception:
+            # 打不开的输入交给嵌入时报告真实错误
+            return True
+        try:
+            _select_pages(position, doc.page_count)
+        except ValueError:
+            return False
+        finally:
+            doc.close()
         return True
 
     def read_secret(self, pdf: bytes | str, key: str) -> str:
         # 仅从 EOF trailer 读取（与 AddAfterEOF 的实现一致）
         return AddAfterEOF().read_secret(pdf=pdf, key=key)
+
+    def peek_secret(self, pdf: bytes | str) -> str:
+        # 不校验 MAC（泄露溯源用）
+        return AddAfterEOF().peek_secret(pdf)
@@ -0,0 +1,186 @@
+"""
+watermark_jobs.py
+
+Asynchronous watermark jobs for ``/api/create-watermark``.
+
+Heavy embeddings (e.g. ``visible-text-redundant`` on a long document) are
+handed to a small local worker pool so the request worker can answer
+immediately with a job id. Job state is written as JSON under
+``STORAGE_DIR/jobs/<job_id>.json`` so that a status poll served by a
+different gunicorn worker still sees it::
+
+    {"job_id": "...", "status": "queued|running|done|failed",
+     "http_status": 201, "result": {...}}
+
+A job callable returns ``(body, http_status)``; ``body`` is what the
+synchronous endpoint would have returned.
+
+Jobs live only in the process that accepted them. Each job records its
+owner (host and pid) and a ``deadline``. A status read reports a queued
+or running job as ``failed`` once its owner process is gone (e.g. the
+gunicorn worker was recycled or crashed) or its deadline has passed.
+Finished job files older than ``ttl`` seconds are removed, at most once
+per ``CLEANUP_INTERVAL`` on submit.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+JobFn = Callable[[], Tuple[Dict[str, Any], int]]
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+CLEANUP_INTERVAL = 60.0
+_PENDING = ("queued", "running")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by someone else
+    return True
+
+
+class WatermarkJobQueue:
+    """Local worker pool with filesystem-backed job status."""
+
+    def __init__(
+        self,
+        root: str | os.PathLike[str],
+        max_workers: int = 2,
+        timeout: float = 900.0,
+        ttl: float = 86400.0,
+    ):
+        self.root = Path(root)
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = float(timeout)  # seconds from submit until a job is reported failed
+        self.ttl = float(ttl)  # seconds a finished job stays readable
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last_cleanup = 0.0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="wm-job"
+            )
+        return self._executor
+
+    def _path(self, job_id: str) -> Path:
+        return self.root / f"{job_id}.json"
+
+    def _write(self, state: Dict[str, Any]) -> None:
+        path = self._path(state["job_id"])
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(state, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def submit(self, owner_id: int, document_id: int, fn: JobFn) -> Dict[str, Any]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        if now - self._last_cleanup >= CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            self.cleanup(now)
+        state: Dict[str, Any] = {
+            "job_id": uuid.uuid4().hex,
+            "ownerid": int(owner_id),
+            "documentid": int(document_id),
+            "status": "queued",
+            "created": now,
+            "deadline": now + self.timeout,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+        }
+        self._write(state)
+        self._pool().submit(self._run, dict(state), fn)
+        return state
+
+    def _run(self, state: Dict[str, Any], fn: JobFn) -> None:
+        state.update(status="running", started=time.time())
+        self._write(state)
+        try:
+            body, http_status = fn()
+        except Exception as e:
+            body, http_status = {"error": f"watermarking failed: {e}"}, 500
+        ok = 200 <= int(http_status) < 300
+        state.update(
+            status="done" if ok else "failed",
+            http_status=int(http_status),
+            finished=time.time(),
+        )
+        if ok:
+            state["result"] = body
+        else:
+            state["error"] = body.get("error", body)
+        self._write(state)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not _ID_RE.match(job_id or ""):
+            return None
+        try:
+            state = json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        return self._check_alive(state)
+
+    def _check_alive(self, state: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+        """Report a pending job whose owner died or whose deadline passed as failed."""
+        if state.get("status") not in _PENDING:
+            return state
+        now = time.time() if now is None else now
+        if "deadline" in state and now > float(state["deadline"]):
+            error, http_status = "watermark job timed out", 504
+        elif (
+            state.get("host") == socket.gethostname()
+            and "pid" in state
+            and not _pid_alive(int(state["pid"]))
+        ):
+            error, http_status = "watermark job lost: its worker process exited", 500
+        else:
+            return state
+        state.update(status="failed", http_status=http_status, error=error,
+                     finished=state.get("finished", now))
+        return state
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        """Delete job files finished (or abandoned) more than ``ttl`` seconds ago."""
+        now = time.time() if now is None else now
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for e in entries:
+            if not e.name.endswith(".json"):
+                continue
+            try:
+                state = json.loads(Path(e.path).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            state = self._check_alive(state, now)
+            finished = state.get("finished")
+            if state.get("status") not in _PENDING and finished is not None and now - float(finished) > self.ttl:
+                try:
+                    os.unlink(e.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+__all__ = ["WatermarkJobQueue"]
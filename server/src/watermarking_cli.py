@@ -5,15 +5,25 @@ watermarking_cli.py — CLI for PDF watermark toolkit
 
 from __future__ import annotations
 import argparse
+import csv
+import fnmatch
 import json
+import math
+import os
+import platform
+import random
 import sys
 import getpass
-from typing import Iterable, Optional
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from .watermarking_method import (
     InvalidKeyError,
     SecretNotFoundError,
     WatermarkingError,
+    load_pdf_bytes,
 )
 
 # --- import from utils ---
@@ -21,6 +31,8 @@ from server.src.watermarking_utils import (
     METHODS,
     apply_watermark,
     read_watermark,
+    detect_watermark,
+    peek_secrets,
     explore_pdf,
     is_watermarking_applicable,
 )
@@ -43,6 +55,29 @@ def _read_text_from_stdin() -> str:
     return data
 
 
+def _read_pdf_input(path: str) -> bytes:
+    """读取 PDF 输入；``-`` 表示从标准输入读取二进制数据。"""
+    if path == "-":
+        return load_pdf_bytes(sys.stdin.buffer.read())
+    return load_pdf_bytes(path)
+
+
+def _write_binary_output(path: str, data: bytes) -> None:
+    """写出二进制结果；``-`` 表示写到标准输出。"""
+    if path == "-":
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(path, "wb") as fh:
+            fh.write(data)
+
+
+def _check_stdin_conflict(args: argparse.Namespace) -> None:
+    """PDF 与 secret/key 不能同时从 stdin 读取。"""
+    if args.input == "-" and (getattr(args, "secret_stdin", False) or args.key_stdin):
+        raise ValueError("stdin is already used for the PDF input")
+
+
 def _resolve_secret(args: argparse.Namespace) -> str:
     if args.secret is not None:
         return args.secret
@@ -87,45 +122,55 @@ def cmd_explore(args: argparse.Namespace) -> int:
 
 
 def cmd_embed(args: argparse.Namespace) -> int:
+    _check_stdin_conflict(args)
     key = _resolve_key(args)
     secret = _resolve_secret(args)
+    # 输出写到 stdout 时，提示信息改走 stderr，避免污染 PDF 流
+    status = sys.stderr if args.output == "-" else sys.stdout
+
+    # 输入只加载一次，适用性检查与嵌入共用同一份字节
+    try:
+        data = _read_pdf_input(args.input)
+    except (OSError, ValueError) as e:
+        # 输入缺失或不是 PDF：与原先一样视为“不适用”，返回 5
+        print(f"error: {e}", file=sys.stderr)
+        return 5
 
-    # test expects pdf_path=..., method=...
     if not is_watermarking_applicable(
-        pdf=args.input,
+        pdf=data,
         method=args.method,
         position=args.position,
     ):
-        print(f"Method {args.method} is not applicable.")
+        print(f"Method {args.method} is not applicable.", file=status)
         return 5
 
     pdf_bytes = apply_watermark(
-        pdf=args.input,
+        pdf=data,
         secret=secret,
         key=key,
         method=args.method,
         position=args.position,
     )
 
-    with open(args.output, "wb") as fh:
-        fh.write(pdf_bytes)
+    _write_binary_output(args.output, pdf_bytes)
 
-    print(f"Wrote watermarked PDF -> {args.output}")
+    print(f"Wrote watermarked PDF -> {args.output}", file=status)
     return 0
 
 
 def cmd_extract(args: argparse.Namespace) -> int:
+    _check_stdin_conflict(args)
     key = _resolve_key(args)
 
     # ⚠ extract() test does NOT provide --position
     # so DO NOT pass position into read_watermark()
     secret = read_watermark(
         method=args.method,
-        pdf=args.input,
+        pdf=_read_pdf_input("-") if args.input == "-" else args.input,
         key=key,
     )
 
-    if args.out:
+    if args.out and args.out != "-":
         with open(args.out, "w", encoding="utf-8") as fh:
             fh.write(secret)
         print(f"Wrote secret -> {args.out}")
@@ -135,6 +180,358 @@ def cmd_extract(args: argparse.Namespace) -> int:
     return 0
 
 
+def _iter_pdfs(root: str, pattern: str) -> Iterator[str]:
+    """按确定顺序遍历目录树，产出匹配 pattern 的文件路径。"""
+    if os.path.isfile(root):
+        yield root
+        return
+    pat = pattern.lower()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if fnmatch.fnmatch(name.lower(), pat):
+                yield os.path.join(dirpath, name)
+
+
+def _scan_one(path: str, key: Optional[str]) -> Dict[str, Any]:
+    """在工作进程中扫描一个文件；所有异常都转成结果记录。"""
+    t0 = time.perf_counter()
+    rec: Dict[str, Any] = {"path": path}
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        rec["secrets"] = [{"method": m, "secret": s} for m, s in peek_secrets(data)]
+        if key is not None:
+            try:
+                m, s = detect_watermark(data, key)
+                rec["verified"] = {"method": m, "secret": s}
+            except SecretNotFoundError:
+                rec["verified"] = None
+    except Exception as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+    rec["ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    return rec
+
+
+def _scan_results(paths: Iterable[str], key: Optional[str], jobs: int) -> Iterator[Dict[str, Any]]:
+    """并行扫描，结果按完成顺序产出；在途任务数有上限，目录再大内存也有界。"""
+    if jobs <= 1:
+        for path in paths:
+            yield _scan_one(path, key)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending: set = set()
+        for path in paths:
+            pending.add(pool.submit(_scan_one, path, key))
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+
+def cmd_scan(args: argparse.Namespace) -> int:
+    key = args.key
+    if key is None and args.key_file is not None:
+        key = _read_text_from_file(args.key_file).strip()
+
+    # 断点续扫：checkpoint 文件记录已完成的路径，每行一个
+    done: set = set()
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        with open(args.checkpoint, "r", encoding="utf-8") as fh:
+            done = {line.rstrip("\n") for line in fh if line.strip()}
+    ckpt = open(args.checkpoint, "a", encoding="utf-8") if args.checkpoint else None
+    out = open(args.out, "a" if done else "w", encoding="utf-8") if args.out else sys.stdout
+
+    paths = (p for p in _iter_pdfs(args.root, args.pattern) if p not in done)
+    scanned = found = errors = 0
+    try:
+        for rec in _scan_results(paths, key, args.jobs):
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            # 先写结果再记 checkpoint：中断后最多重复一条，不会丢
+            if ckpt is not None:
+                ckpt.write(rec["path"] + "\n")
+                ckpt.flush()
+            scanned += 1
+            found += bool(rec.get("secrets"))
+            errors += "error" in rec
+    finally:
+        if ckpt is not None:
+            ckpt.close()
+        if out is not sys.stdout:
+            out.close()
+
+    print(
+        f"scanned {scanned} files ({found} with secrets, {errors} errors, {len(done)} skipped)",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _read_manifest(path: str) -> List[Dict[str, Any]]:
+    """读取 CSV（需表头）或 JSONL 清单；每行附带 1 基行号 ``line``。"""
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        text = fh.read()
+    ext = os.path.splitext(path)[1].lower()
+    is_jsonl = ext in (".jsonl", ".ndjson") or (ext != ".csv" and text.lstrip().startswith("{"))
+    rows: List[Dict[str, Any]] = []
+    if is_jsonl:
+        for n, line in enumerate(text.splitlines(), start=1):
+            if line.strip():
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError(f"{path}:{n}: expected a JSON object")
+                rows.append({**row, "line": n})
+    else:
+        # 表头占第 1 行，数据从第 2 行开始
+        for n, row in enumerate(csv.DictReader(text.splitlines()), start=2):
+            rows.append({**{k.strip(): v for k, v in row.items() if k}, "line": n})
+    return rows
+
+
+def _embed_group(src: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """在工作进程中处理同一输入的若干行：源文件只加载一次。"""
+    results = []
+    try:
+        data = load_pdf_bytes(src)
+        load_error = None
+    except Exception as e:
+        data, load_error = None, f"{type(e).__name__}: {e}"
+    for row in rows:
+        t0 = time.perf_counter()
+        rec: Dict[str, Any] = {
+            "line": row["line"], "input": src, "output": row.get("output"), "method": row["method"],
+        }
+        try:
+            if load_error is not None:
+                raise RuntimeError(load_error)
+            if not row.get("output") or not isinstance(row.get("secret"), str) or not row.get("key"):
+                raise ValueError("row needs output, secret and key")
+            position = row.get("position") or None
+            if not is_watermarking_applicable(method=row["method"], pdf=data, position=position):
+                raise ValueError(f"method {row['method']} is not applicable")
+            out = apply_watermark(
+                method=row["method"], pdf=data, secret=row["secret"], key=row["key"], position=position,
+            )
+            with open(row["output"], "wb") as fh:
+                fh.write(out)
+            rec.update(ok=True, size=len(out))
+        except Exception as e:
+            rec.update(ok=False, error=f"{type(e).__name__}: {e}")
+        rec["ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        results.append(rec)
+    return results
+
+
+def cmd_embed_batch(args: argparse.Namespace) -> int:
+    key = args.key
+    if key is None and args.key_file is not None:
+        key = _read_text_from_file(args.key_file).strip()
+
+    rows = _read_manifest(args.manifest)
+    # 同一输入的行归为一组；组太大时切块，保证 -j 个进程都有活干
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        row["method"] = row.get("method") or args.method
+        row["key"] = row.get("key") or key
+        groups.setdefault(str(row.get("input") or ""), []).append(row)
+    jobs = max(1, args.jobs)
+    tasks = []
+    for src, group in groups.items():
+        size = max(1, math.ceil(len(group) / jobs))
+        tasks.extend((src, group[i:i + size]) for i in range(0, len(group), size))
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    t0 = time.perf_counter()
+    ok = failed = 0
+
+    def emit(recs: List[Dict[str, Any]]) -> None:
+        nonlocal ok, failed
+        for rec in recs:
+            report.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            ok += rec["ok"]
+            failed += not rec["ok"]
+        report.flush()
+
+    try:
+        if jobs == 1:
+            for src, group in tasks:
+                emit(_embed_group(src, group))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(_embed_group, src, group) for src, group in tasks]
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        emit(fut.result())
+    finally:
+        if report is not sys.stdout:
+            report.close()
+
+    print(
+        f"embedded {ok}/{ok + failed} rows in {time.perf_counter() - t0:.2f}s ({failed} failed)",
+        file=sys.stderr,
+    )
+    return 0 if failed == 0 else 1
+
+
+def _percentile(sorted_ms: List[float], q: float) -> float:
+    """最近秩百分位（输入已排序）。"""
+    idx = max(0, math.ceil(q / 100 * len(sorted_ms)) - 1)
+    return sorted_ms[idx]
+
+
+def _timed(fn, iterations: int, warmup: int) -> tuple[Dict[str, Any], Any]:
+    """运行 fn 若干次，返回 (统计, 最后一次结果)。"""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    total = sum(samples) / 1000
+    stats = {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / total, 3) if total > 0 else None,
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p95_ms": round(_percentile(samples, 95), 3),
+        "p99_ms": round(_percentile(samples, 99), 3),
+    }
+    return stats, result
+
+
+def _traced_peak_kb(fn) -> int:
+    """单次调用 fn 期间 Python 堆分配的峰值增量（KiB，tracemalloc）。
+
+    每次调用前 reset_peak，因此各操作互不影响；只统计经由 Python 分配器的
+    内存（含输入输出的 bytes），不含 MuPDF 等 C 库自行 malloc 的内存。
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        return max(0, tracemalloc.get_traced_memory()[1] - base) // 1024
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """整个进程的峰值 RSS（KiB，只增不减）；不支持的平台返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 为 KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _synthetic_pdf(pages: int, kb: int) -> bytes:
+    """生成确定性的合成 PDF：每页一段文字，并用不可压缩填充补足到约 kb KiB。"""
+    try:
+        import pymupdf as fitz
+    except ImportError:
+        import fitz
+
+    doc = fitz.open()
+    for i in range(max(1, pages)):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"tatou bench page {i + 1}", fontsize=12)
+    base = len(doc.tobytes())
+    pad = kb * 1024 - base
+    if pad > 0:
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<<>>")
+        doc.update_stream(xref, random.Random(pages).randbytes(pad), compress=False)
+        doc.xref_set_key(doc.pdf_catalog(), "TatouBenchPad", f"{xref} 0 R")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _bench_inputs(args: argparse.Namespace) -> Iterator[tuple[str, bytes]]:
+    if args.inputs:
+        for root in args.inputs:
+            for path in _iter_pdfs(root, "*.pdf"):
+                yield path, load_pdf_bytes(path)
+    else:
+        for pages in (int(p) for p in args.pages.split(",") if p.strip()):
+            yield f"synthetic:{pages}p:{args.kb}kb", _synthetic_pdf(pages, args.kb)
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    methods = sorted(METHODS) if not args.method else args.method
+    for name in methods:
+        if name not in METHODS:
+            raise ValueError(f"unknown method: {name}")
+    n, warmup = max(1, args.iterations), max(0, args.warmup)
+    secret, key = "tatou-bench-secret", "tatou-bench-key"
+
+    results = []
+    for label, data in _bench_inputs(args):
+        entry: Dict[str, Any] = {"input": label, "bytes": len(data)}
+        entry["explore"], _ = _timed(lambda: explore_pdf(data), n, warmup)
+        entry["explore"]["peak_alloc_kb"] = _traced_peak_kb(lambda: explore_pdf(data))
+        entry["methods"] = {}
+        for name in methods:
+            # 直接调用方法对象，避免进程池的 IPC 开销混入测量
+            m = METHODS[name]
+            rec: Dict[str, Any] = {}
+            try:
+                if not m.is_watermark_applicable(data, None):
+                    rec["skipped"] = "not applicable"
+                else:
+                    rec["add_watermark"], out = _timed(
+                        lambda: m.add_watermark(data, secret, key, None), n, warmup,
+                    )
+                    rec["read_secret"], got = _timed(lambda: m.read_secret(out, key), n, warmup)
+                    if got != secret:
+                        raise WatermarkingError(f"round trip returned {got!r}")
+                    # 内存单独测一次（tracemalloc 会拖慢计时循环）
+                    rec["add_watermark"]["peak_alloc_kb"] = _traced_peak_kb(
+                        lambda: m.add_watermark(data, secret, key, None))
+                    rec["read_secret"]["peak_alloc_kb"] = _traced_peak_kb(lambda: m.read_secret(out, key))
+                    rec["output_bytes"] = len(out)
+                    rec["inflation"] = round(len(out) / len(data), 4)
+            except Exception as e:
+                rec["error"] = f"{type(e).__name__}: {e}"
+            entry["methods"][name] = rec
+        results.append(entry)
+
+    report = {
+        "version": __version__,
+        "env": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {"iterations": n, "warmup": warmup, "methods": methods},
+        "results": results,
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
 # ======================================================================
 # Parser
 # ======================================================================
@@ -156,8 +553,8 @@ def build_parser() -> argparse.ArgumentParser:
 
     # embed
     p_emb = sub.add_parser("embed")
-    p_emb.add_argument("input")
-    p_emb.add_argument("output")
+    p_emb.add_argument("input", help="PDF path, or - for stdin")
+    p_emb.add_argument("output", help="output path, or - for stdout")
     p_emb.add_argument("--method", default="toy-eof")
     p_emb.add_argument("--position", default=None)
 
@@ -176,7 +573,7 @@ def build_parser() -> argparse.ArgumentParser:
 
     # extract
     p_ext = sub.add_parser("extract")
-    p_ext.add_argument("input")
+    p_ext.add_argument("input", help="PDF path, or - for stdin")
     p_ext.add_argument("--method", default="toy-eof")
 
     g_key2 = p_ext.add_argument_group("key")
@@ -188,6 +585,49 @@ def build_parser() -> argparse.ArgumentParser:
     p_ext.add_argument("--out")
     p_ext.set_defaults(func=cmd_extract)
 
+    # scan
+    p_scan = sub.add_parser("scan", help="extract secrets from every PDF under a directory (JSONL)")
+    p_scan.add_argument("root")
+    p_scan.add_argument("--pattern", default="*.pdf")
+    p_scan.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    p_scan.add_argument("--key", help="also verify the MAC with this key")
+    p_scan.add_argument("--key-file")
+    p_scan.add_argument("--out", help="JSONL output (default: stdout)")
+    p_scan.add_argument("--checkpoint", help="resume file of completed paths")
+    p_scan.set_defaults(func=cmd_scan)
+
+    # embed-batch
+    p_eb = sub.add_parser(
+        "embed-batch",
+        help="embed many rows from a CSV/JSONL manifest (exit 1 if any row fails)",
+    )
+    p_eb.add_argument("manifest", help="CSV with header, or JSONL: input, output, secret[, method, key, position]")
+    p_eb.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    p_eb.add_argument("--method", default="toy-eof", help="default for rows without a method")
+    p_eb.add_argument("--key", help="default for rows without a key")
+    p_eb.add_argument("--key-file")
+    p_eb.add_argument("--report", help="per-row JSONL report (default: stdout)")
+    p_eb.set_defaults(func=cmd_embed_batch)
+
+    # bench
+    p_bench = sub.add_parser(
+        "bench",
+        help="time add_watermark/read_secret/explore_pdf per method and report JSON",
+        description=(
+            "Per operation: ops/sec, p50/p95/p99 latency and peak_alloc_kb, the tracemalloc "
+            "peak of Python allocations during one call (C-level allocations inside PyMuPDF "
+            "are not counted). The top-level peak_rss_kb is the process-wide RSS high-water mark."
+        ),
+    )
+    p_bench.add_argument("inputs", nargs="*", help="PDF files or directories (default: synthetic PDFs)")
+    p_bench.add_argument("--pages", default="1,10,100", help="synthetic page counts, comma-separated")
+    p_bench.add_argument("--kb", type=int, default=0, help="pad synthetic PDFs to about this many KiB")
+    p_bench.add_argument("--method", action="append", help="limit to this method (repeatable)")
+    p_bench.add_argument("-n", "--iterations", type=int, default=20)
+    p_bench.add_argument("--warmup", type=int, default=1)
+    p_bench.add_argument("--out")
+    p_bench.set_defaults(func=cmd_bench)
+
     return p
 
 
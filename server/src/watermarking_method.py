@@ -37,25 +37,36 @@ Utilities
 This module also exposes :func:`load_pdf_bytes` and :func:`is_pdf_bytes`
 which are convenience helpers many implementations will find useful.
 
+:func:`open_pdf_buffer` is the zero-copy counterpart of
+:func:`load_pdf_bytes`: it yields a read-only :class:`memoryview` over
+the caller's buffer, or over an ``mmap`` of the file. Methods that can
+work on such a view set :attr:`WatermarkingMethod.accepts_buffer`, and
+the registry helpers then hand them the original source instead of a
+fully materialized copy.
+
 """
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import IO, ClassVar, TypeAlias, Union
+from typing import IO, ClassVar, Iterator, TypeAlias, Union
 import io
+import mmap
 import os
 
 # ----------------------------
 # Public type aliases & errors
 # ----------------------------
 
-PdfSource: TypeAlias = Union[bytes, str, os.PathLike[str], IO[bytes]]
+PdfSource: TypeAlias = Union[
+    bytes, bytearray, memoryview, mmap.mmap, str, os.PathLike[str], IO[bytes]
+]
 """Accepted input type for a PDF document.
 
 Implementations should *not* assume the input is a file path; always call
-:func:`load_pdf_bytes` to normalize a :class:`PdfSource` into
-``bytes`` before processing.
+:func:`load_pdf_bytes` (or :func:`open_pdf_buffer`) to normalize a
+:class:`PdfSource` before processing.
 """
 
 
@@ -96,7 +107,11 @@ def load_pdf_bytes(src: PdfSource) -> bytes:
     ValueError
         If the resolved bytes do not appear to be a PDF file.
     """
-    if isinstance(src, (bytes, bytearray)):
+    if isinstance(src, bytes):
+        data = src
+    elif isinstance(src, (bytearray, memoryview, mmap.mmap)):
+        # A ``bytes`` result needs one copy; buffer-aware methods should
+        # use :func:`open_pdf_buffer` instead.
         data = bytes(src)
     elif isinstance(src, (str, os.PathLike)):
         with open(os.fspath(src), "rb") as fh:
@@ -114,14 +129,91 @@ def load_pdf_bytes(src: PdfSource) -> bytes:
     return data
 
 
-def is_pdf_bytes(data: bytes) -> bool:
+def _mmap_readonly(fh: IO[bytes]) -> mmap.mmap | None:
+    """Map a whole regular file read-only; ``None`` if it cannot be mapped."""
+    try:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Not a real file, or empty (mmap refuses zero-length maps).
+        return None
+
+
+@contextmanager
+def open_pdf_buffer(src: PdfSource) -> Iterator[memoryview]:
+    """Yield a read-only :class:`memoryview` of a :class:`PdfSource` without copying.
+
+    - ``bytes``/``bytearray``/``memoryview``/``mmap``: a view of the
+      caller's buffer.
+    - path: an ``mmap`` of the file, so only the pages actually touched
+      are read from disk.
+    - ``io.BytesIO``: its internal buffer (``getbuffer()``).
+    - other binary file objects positioned at offset 0: an ``mmap`` of
+      their file descriptor; anything else is read into memory.
+
+    The view (and any mapping) is released when the ``with`` block
+    exits, so callers must not keep slices of it beyond that point.
+
+    Raises
+    ------
+    FileNotFoundError
+        If ``src`` is a path that does not exist.
+    ValueError
+        If the data does not appear to be a PDF file.
+    """
+    fh = None
+    mm = None
+    if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+        view = memoryview(src)
+    elif isinstance(src, (str, os.PathLike)):
+        fh = open(os.fspath(src), "rb")
+        mm = _mmap_readonly(fh)
+        view = memoryview(mm) if mm is not None else memoryview(fh.read())
+    elif hasattr(src, "getbuffer"):
+        view = src.getbuffer()  # type: ignore[union-attr]
+    elif hasattr(src, "read"):
+        at_start = False
+        try:
+            at_start = src.tell() == 0  # type: ignore[union-attr]
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        mm = _mmap_readonly(src) if at_start else None  # type: ignore[arg-type]
+        view = memoryview(mm) if mm is not None else memoryview(src.read())  # type: ignore[union-attr]
+    else:
+        raise TypeError(
+            "Unsupported PdfSource; expected bytes, path, or binary IO"
+        )
+
+    try:
+        ro = view.toreadonly()
+        try:
+            if not is_pdf_bytes(ro):
+                raise ValueError("Input does not look like a valid PDF (missing %PDF header)")
+            yield ro
+        finally:
+            ro.release()
+    finally:
+        view.release()
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # A caller still holds a slice; the map is freed with it.
+                pass
+        if fh is not None:
+            fh.close()
+
+
+def is_pdf_bytes(data: bytes | bytearray | memoryview) -> bool:
     """Lightweight check that the data looks like a PDF file.
 
     This is intentionally permissive: it verifies the standard header
     magic (``%PDF-``). Trailers (``%%EOF``) can be absent in incremental
     updates, so we don't strictly require them here.
     """
-    return data.startswith(b"%PDF-")
+    if isinstance(data, bytes):
+        return data.startswith(b"%PDF-")
+    with memoryview(data) as view:
+        return view[:5].tobytes() == b"%PDF-"
 
 
 # ---------------------------------
@@ -140,6 +232,18 @@ class WatermarkingMethod(ABC):
     #: Concrete implementations should override this with a short name
     #: (e.g., "toy-eof", "xmp-metadata", "object-stream").
     name: ClassVar[str] = "abstract"
+
+    #: Set to ``True`` when :meth:`add_watermark` and :meth:`read_secret`
+    #: accept any :class:`PdfSource` (including ``memoryview``/``mmap``)
+    #: and load only what they need, typically via
+    #: :func:`open_pdf_buffer`. The registry helpers then pass the
+    #: caller's source through instead of loading a full ``bytes`` copy.
+    accepts_buffer: ClassVar[bool] = False
+
+    #: Part of the result-cache key. Bump it whenever a change makes
+    #: :meth:`add_watermark` produce different bytes for the same inputs,
+    #: so cached outputs of the old implementation are not served again.
+    cache_version: ClassVar[int] = 1
     
     
     @staticmethod
@@ -266,6 +370,7 @@ __all__ = [
     "SecretNotFoundError",
     "InvalidKeyError",
     "load_pdf_bytes",
+    "open_pdf_buffer",
     "is_pdf_bytes",
     "WatermarkingMethod",
 ]
@@ -11,7 +11,15 @@ This module exposes:
 - :func:`apply_watermark`: run a concrete watermarking method on a PDF.
 - :func:`apply_watermark`: run a concrete watermarking method on a PDF.
 - :func:`read_watermark`: recover a secret using a concrete method.
-- :func:`register_method` / :func:`get_method`: registry helpers.
+- :func:`detect_watermark`: recover a secret without knowing the method
+  (also reachable as ``read_watermark("auto", ...)``).
+- :func:`peek_secrets`: extract embedded secrets without a key, for leak
+  attribution.
+- :func:`register_method` / :func:`get_method` / :func:`accepts_buffer`
+  / :func:`is_builtin_method` / :func:`implementation_id`: registry
+  helpers.
+- :func:`configure_executor` / :func:`shutdown_executor`: optional
+  process pool that runs CPU-bound methods off the calling process.
 
 Dependencies
 ------------
@@ -28,16 +36,25 @@ To enable the richer exploration, install PyMuPDF:
 """
 from __future__ import annotations
 
-from typing import Any, Dict, Final, Iterable, List, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as _FutureTimeout
+from concurrent.futures import wait as futures_wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Final, FrozenSet, Iterable, List, Mapping, Optional
 import base64
 import hashlib
 import io
 import json
+import multiprocessing
 import os
 import re
+import threading
 
 from .watermarking_method import (
     PdfSource,
+    SecretNotFoundError,
+    WatermarkingError,
     WatermarkingMethod,
     load_pdf_bytes,
 )
@@ -70,11 +87,23 @@ ALIASES: Dict[str, str] = {
     "metadata": "metadata-xmp",
 }
 
+AUTO_METHOD: Final[str] = "auto"
+"""Pseudo method name for :func:`read_watermark` that tries every method."""
+
 def register_method(method: WatermarkingMethod) -> None:
     """Register (or replace) a watermarking method instance by name."""
     METHODS[method.name] = method
 
 
+def accepts_buffer(method: Any) -> bool:
+    """Whether ``method`` takes any :class:`PdfSource` and loads only what it needs.
+
+    Reads :attr:`WatermarkingMethod.accepts_buffer`; objects without the
+    attribute (e.g. duck-typed plugins) count as ``False``.
+    """
+    return bool(getattr(method, "accepts_buffer", False))
+
+
 def get_method(method: str | WatermarkingMethod) -> WatermarkingMethod:
     """Resolve a method from a string name or pass-through an instance.
 
@@ -101,6 +130,242 @@ def get_method(method: str | WatermarkingMethod) -> WatermarkingMethod:
         ) from None
 
 
+# --------------------
+# Process-pool execution
+# --------------------
+
+class ExecutorBusyError(WatermarkingError):
+    """Raised when the process pool's pending-job queue is full."""
+
+
+class WatermarkTimeoutError(WatermarkingError):
+    """Raised when a pooled job exceeds its time budget."""
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name, "").strip().lower()
+    if raw == "auto":
+        return os.cpu_count() or 1
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        return default
+
+
+@dataclass
+class ExecutorConfig:
+    """Settings for the optional watermark process pool.
+
+    ``workers == 0`` disables the pool and runs every method inline.
+    ``max_tasks_per_child`` recycles worker processes to bound leaks in
+    native libraries; ``max_pending`` bounds queued + running jobs, and a
+    caller that cannot get a slot within ``queue_timeout`` seconds gets
+    :class:`ExecutorBusyError` instead of waiting; ``timeout`` is the
+    per-job budget in seconds. Only methods listed in
+    ``methods`` are offloaded: cheap ones (``trailer-hmac``) are faster
+    inline than the cost of shipping the PDF to another process.
+    """
+
+    workers: int = 0
+    max_tasks_per_child: int = 100
+    max_pending: int = 0
+    queue_timeout: float = 1.0
+    timeout: float = 120.0
+    start_method: str = "spawn"
+    methods: FrozenSet[str] = field(
+        default_factory=lambda: frozenset({"visible-text-redundant", "metadata-xmp"})
+    )
+
+    @classmethod
+    def from_env(cls) -> "ExecutorConfig":
+        workers = _env_int("WM_POOL_WORKERS", 0)
+        return cls(
+            workers=workers,
+            max_tasks_per_child=_env_int("WM_POOL_MAX_TASKS_PER_CHILD", 100),
+            max_pending=_env_int("WM_POOL_MAX_PENDING", workers * 4),
+            queue_timeout=float(os.environ.get("WM_POOL_QUEUE_TIMEOUT", "1")),
+            timeout=float(os.environ.get("WM_POOL_TIMEOUT", "120")),
+            start_method=os.environ.get("WM_POOL_START_METHOD", "spawn"),
+        )
+
+
+_EXEC_CONFIG: ExecutorConfig = ExecutorConfig.from_env()
+_EXECUTOR: Optional[ProcessPoolExecutor] = None
+_EXEC_LOCK = threading.Lock()
+_PENDING: Optional[threading.BoundedSemaphore] = None
+# Jobs submitted to each live or retired pool, so a retired pool is only
+# torn down once the other callers' jobs on it have finished.
+_INFLIGHT: Dict[ProcessPoolExecutor, set] = {}
+# Built-in instances; a plugin that replaces one of them runs inline,
+# because spawned workers only know the default registry.
+_POOLABLE: Dict[str, WatermarkingMethod] = dict(METHODS)
+
+
+def is_builtin_method(method: Any) -> bool:
+    """Whether ``method`` is the instance this module registered at import.
+
+    ``False`` for plugins, including one registered under a built-in name.
+    """
+    return _POOLABLE.get(getattr(method, "name", None)) is method
+
+
+def implementation_id(method: Any) -> str:
+    """Identify the code behind ``method``: class path plus ``cache_version``."""
+    cls = type(method)
+    return f"{cls.__module__}.{cls.__qualname__}:{getattr(method, 'cache_version', 0)}"
+
+
+def configure_executor(
+    workers: int = 0,
+    *,
+    max_tasks_per_child: int = 100,
+    max_pending: int | None = None,
+    queue_timeout: float = 1.0,
+    timeout: float = 120.0,
+    start_method: str = "spawn",
+    methods: Iterable[str] | None = None,
+) -> None:
+    """(Re)configure the process pool. ``workers=0`` turns it off.
+
+    The pool itself is created lazily on first use, so calling this
+    before gunicorn forks its workers is safe.
+    """
+    global _EXEC_CONFIG
+    cfg = ExecutorConfig(
+        workers=max(0, int(workers)),
+        max_tasks_per_child=max(1, int(max_tasks_per_child)),
+        max_pending=int(max_pending) if max_pending is not None else max(0, int(workers)) * 4,
+        queue_timeout=max(0.0, float(queue_timeout)),
+        timeout=float(timeout),
+        start_method=start_method,
+    )
+    if methods is not None:
+        cfg.methods = frozenset(methods)
+    shutdown_executor(wait=True)
+    with _EXEC_LOCK:
+        _EXEC_CONFIG = cfg
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the pool's worker processes (it is recreated on next use)."""
+    global _EXECUTOR, _PENDING
+    with _EXEC_LOCK:
+        ex, _EXECUTOR, _PENDING = _EXECUTOR, None, None
+        if ex is not None:
+            _INFLIGHT.pop(ex, None)
+    if ex is None:
+        return
+    procs = list((getattr(ex, "_processes", None) or {}).values())
+    ex.shutdown(wait=wait, cancel_futures=True)
+    if not wait:
+        _terminate(procs)
+
+
+def _terminate(procs: Iterable[Any]) -> None:
+    # A timed-out job may be stuck in native code: kill it outright.
+    for proc in procs:
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+
+
+def _retire_executor(ex: ProcessPoolExecutor, failed: Any) -> None:
+    """Replace ``ex`` for new jobs without failing other callers' jobs on it.
+
+    Jobs already submitted to ``ex`` by other requests keep running; once
+    they finish (or exceed the job timeout), its workers, including the
+    one stuck on ``failed``, are terminated in the background.
+    """
+    global _EXECUTOR
+    with _EXEC_LOCK:
+        if _EXECUTOR is ex:
+            _EXECUTOR = None
+        others = [f for f in _INFLIGHT.pop(ex, ()) if f is not failed]
+    timeout = _EXEC_CONFIG.timeout
+
+    def _reap() -> None:
+        futures_wait(others, timeout=timeout)
+        procs = list((getattr(ex, "_processes", None) or {}).values())
+        ex.shutdown(wait=False, cancel_futures=True)
+        _terminate(procs)
+
+    threading.Thread(target=_reap, name="wm-pool-reaper", daemon=True).start()
+
+
+def _get_executor() -> tuple[ProcessPoolExecutor, threading.BoundedSemaphore]:
+    global _EXECUTOR, _PENDING
+    with _EXEC_LOCK:
+        if _EXECUTOR is None:
+            cfg = _EXEC_CONFIG
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=cfg.workers,
+                mp_context=multiprocessing.get_context(cfg.start_method),
+                max_tasks_per_child=cfg.max_tasks_per_child,
+            )
+            _INFLIGHT[_EXECUTOR] = set()
+            if _PENDING is None:
+                # Shared across pool replacements, so it bounds jobs on
+                # retired pools too.
+                _PENDING = threading.BoundedSemaphore(max(cfg.max_pending, cfg.workers))
+        return _EXECUTOR, _PENDING  # type: ignore[return-value]
+
+
+def _should_offload(m: WatermarkingMethod) -> bool:
+    cfg = _EXEC_CONFIG
+    return (
+        cfg.workers > 0
+        and m.name in cfg.methods
+        and is_builtin_method(m)
+    )
+
+
+def _run_pooled(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run ``fn(*args)`` in the pool with queue bound and per-job timeout."""
+    cfg = _EXEC_CONFIG
+    ex, pending = _get_executor()
+    if not pending.acquire(timeout=cfg.queue_timeout):
+        raise ExecutorBusyError("watermark executor queue is full")
+    try:
+        fut = ex.submit(fn, *args)
+        with _EXEC_LOCK:
+            live = _INFLIGHT.get(ex)
+            if live is not None:
+                live.add(fut)
+        try:
+            return fut.result(timeout=cfg.timeout)
+        except _FutureTimeout:
+            fut.cancel()
+            _retire_executor(ex, fut)
+            raise WatermarkTimeoutError(
+                f"watermark job exceeded {cfg.timeout:g}s"
+            ) from None
+        except BrokenProcessPool as e:
+            _retire_executor(ex, fut)
+            raise WatermarkingError(f"watermark worker crashed: {e}") from e
+        finally:
+            with _EXEC_LOCK:
+                live = _INFLIGHT.get(ex)
+                if live is not None:
+                    live.discard(fut)
+    finally:
+        try:
+            pending.release()
+        except ValueError:
+            # The semaphore was replaced by a recycle; nothing to release.
+            pass
+
+
+def _pool_add_watermark(
+    method_name: str, pdf_bytes: bytes, secret: str, key: str, position: str | None
+) -> bytes:
+    return METHODS[method_name].add_watermark(pdf_bytes, secret, key, position)
+
+
+def _pool_read_secret(method_name: str, pdf_bytes: bytes, key: str) -> str:
+    return METHODS[method_name].read_secret(pdf_bytes, key)
+
+
 # --------------------
 # Public API helpers
 # --------------------
@@ -115,6 +380,13 @@ def apply_watermark(
     """Apply a watermark using the specified method and return new PDF bytes."""
     m = get_method(method)
 
+    if _should_offload(m):
+        return _run_pooled(_pool_add_watermark, m.name, load_pdf_bytes(pdf), secret, key, position)
+
+    # Buffer-aware methods map the source themselves (no full copy here).
+    if accepts_buffer(m):
+        return m.add_watermark(pdf, secret, key, position)
+
     # ✅ 修复: 将 pdf 转换为字节
     pdf_bytes = load_pdf_bytes(pdf)
 
@@ -138,15 +410,111 @@ def is_watermarking_applicable(
 
 
 def read_watermark(method: str | WatermarkingMethod, pdf: PdfSource, key: str) -> str:
-    """Recover a secret from ``pdf`` using the specified method."""
+    """Recover a secret from ``pdf`` using the specified method.
+
+    ``method="auto"`` tries every registered method, see
+    :func:`detect_watermark`.
+    """
+    if isinstance(method, str) and method.strip().lower() == AUTO_METHOD:
+        return detect_watermark(pdf, key)[1]
     m = get_method(method)
-    
+
+    # Buffer-aware methods only touch what they need (e.g. the trailer at
+    # EOF), so they take the source as-is instead of a fully loaded copy.
+    if accepts_buffer(m):
+        return m.read_secret(pdf, key)
+
     pdf_bytes = load_pdf_bytes(pdf)                     # 新增
 
+    if _should_offload(m):
+        return _run_pooled(_pool_read_secret, m.name, pdf_bytes, key)
+
     # return m.read_secret(pdf_bytes=pdf_bytes, key=key)
     return m.read_secret(pdf_bytes, key)            # 位置参数 ✅
 
 
+def _cheap_first() -> List[tuple[str, Any]]:
+    """Registered methods, buffer-aware (partial-read) ones first.
+
+    ``sorted`` is stable, so registration order is kept within each group.
+    """
+    return sorted(METHODS.items(), key=lambda kv: not accepts_buffer(kv[1]))
+
+
+def detect_watermark(
+    pdf: PdfSource, key: str, load: Callable[[], bytes] | None = None
+) -> tuple[str, str]:
+    """Recover a secret when the embedding method is unknown.
+
+    Buffer-aware methods, which only scan what they need (e.g. the
+    trailer at EOF), run first. When ``pdf`` is a path they read the
+    file directly; otherwise the source is loaded once and every method
+    reads from that shared buffer. Methods that parse the whole document
+    get the full bytes from ``load`` if given (e.g. an in-process cache),
+    else from a single :func:`load_pdf_bytes`. Every method verifies its
+    MAC with ``key`` before returning, so the first success is final.
+
+    Returns
+    -------
+    tuple[str, str]
+        ``(method_name, secret)``.
+
+    Raises
+    ------
+    SecretNotFoundError
+        If no method recovers a verified secret.
+    """
+    is_path = isinstance(pdf, (str, os.PathLike))
+    data: bytes | None = None if is_path else load_pdf_bytes(pdf)
+    failures: List[str] = []
+    for name, m in _cheap_first():
+        try:
+            if is_path and accepts_buffer(m):
+                return name, read_watermark(name, pdf, key)
+            if data is None:
+                data = load() if load is not None else load_pdf_bytes(pdf)
+            return name, read_watermark(name, data, key)
+        except ExecutorBusyError:
+            # The method was never tried; "not found" would be wrong.
+            raise
+        except Exception as e:
+            failures.append(f"{name}: {e}")
+    raise SecretNotFoundError(
+        "no method recovered a verified secret (" + "; ".join(failures) + ")"
+    )
+
+
+def peek_secrets(pdf: PdfSource) -> List[tuple[str, str]]:
+    """Extract embedded secrets with every method, *without* a key.
+
+    Methods expose this through an optional ``peek_secret(pdf)`` that
+    decodes the payload but skips the MAC check. The result is
+    unauthenticated: it only narrows down candidate versions, which the
+    caller then looks up (and may verify with the version's key).
+
+    Returns
+    -------
+    list[tuple[str, str]]
+        ``(method_name, secret)`` pairs, one per distinct secret, in the
+        order found.
+    """
+    data = load_pdf_bytes(pdf)
+    found: List[tuple[str, str]] = []
+    seen: set[str] = set()
+    for name, m in _cheap_first():
+        peek = getattr(m, "peek_secret", None)
+        if not callable(peek):
+            continue
+        try:
+            secret = peek(data)
+        except Exception:
+            continue
+        if isinstance(secret, str) and secret and secret not in seen:
+            seen.add(secret)
+            found.append((name, secret))
+    return found
+
+
 # --------------------
 # PDF exploration
 # --------------------
@@ -198,7 +566,12 @@ def explore_pdf(pdf: PdfSource) -> Dict[str, Any]:
     }
 
     try:
-        import fitz  # type: ignore
+        try:
+            # ``import fitz`` prints a deprecation notice to stdout on
+            # recent PyMuPDF, which would corrupt piped CLI output.
+            import pymupdf as fitz  # type: ignore
+        except ImportError:
+            import fitz  # type: ignore
 
         doc = fitz.open(stream=data, filetype="pdf")
         # Pages as first-class nodes
@@ -276,10 +649,21 @@ def explore_pdf(pdf: PdfSource) -> Dict[str, Any]:
 __all__ = [
     "METHODS",
     "register_method",
+    "accepts_buffer",
+    "is_builtin_method",
+    "implementation_id",
     "get_method",
     "apply_watermark",
     "read_watermark",
+    "detect_watermark",
+    "peek_secrets",
+    "AUTO_METHOD",
     "explore_pdf",
-    "is_watermarking_applicable"
+    "is_watermarking_applicable",
+    "ExecutorConfig",
+    "ExecutorBusyError",
+    "WatermarkTimeoutError",
+    "configure_executor",
+    "shutdown_executor",
 ]
 
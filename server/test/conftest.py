@@ -68,6 +68,7 @@ def app(tmp_path):
             secret TEXT NOT NULL, method TEXT NOT NULL, position TEXT, path TEXT NOT NULL,
             UNIQUE(link), FOREIGN KEY(documentid) REFERENCES Documents(id) ON DELETE CASCADE
         );
+        CREATE INDEX ix_Versions_secret ON Versions(secret);
         """
         with flask_app.app_context():
             with test_engine.begin() as conn:
@@ -0,0 +1,146 @@
+# server/test/test_benchmarks.py
+"""性能回归基准（pytest-benchmark）。
+
+所有用例都带 ``benchmark`` 标记，默认配置（``-m "not benchmark"``）下
+不参与普通测试；未安装 pytest-benchmark 时整个模块跳过。只在 CI 的
+benchmark 任务中运行，并与缓存的 main 分支基线比较：
+
+    pytest server/test/test_benchmarks.py -m benchmark --benchmark-only \
+        --benchmark-compare --benchmark-compare-fail=median:25%
+
+共享 runner 上的耗时波动较大，该任务目前不阻塞合并，只作参考。
+本地调试可加 ``--benchmark-disable``，每个用例只执行一次。
+"""
+import io
+import itertools
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.benchmark
+
+from server.src.watermarking_cli import _synthetic_pdf
+from server.src.watermarking_utils import METHODS, explore_pdf
+
+# 名称 -> (页数, 目标大小 KiB)
+SIZES = {
+    "small": (1, 0),
+    "medium": (20, 512),
+    "large": (200, 8192),
+}
+KEY = "bench-key"
+
+
+@pytest.fixture(scope="module", params=sorted(SIZES), ids=sorted(SIZES))
+def sized_pdf(request):
+    pages, kb = SIZES[request.param]
+    return _synthetic_pdf(pages, kb)
+
+
+@pytest.fixture
+def bench_app(app):
+    # 关闭结果缓存，保证每轮都真正嵌入
+    app.config["WM_RESULT_CACHE_MAX_BYTES"] = 0
+    return app
+
+
+def _upload(client, headers, data: bytes, name: str = "bench.pdf") -> int:
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(data), name)},
+        headers=headers,
+        content_type="multipart/form-data",
+    )
+    assert r.status_code == 201
+    return r.get_json()["id"]
+
+
+# ---------------------------------------------------------------------
+# 方法层
+# ---------------------------------------------------------------------
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_bench_add_watermark(benchmark, method, sized_pdf):
+    m = METHODS[method]
+    if not m.is_watermark_applicable(sized_pdf, None):
+        pytest.skip(f"{method} not applicable")
+    benchmark.group = f"add_watermark[{method}]"
+    out = benchmark(m.add_watermark, sized_pdf, "bench-secret", KEY, None)
+    assert len(out) >= len(sized_pdf)
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_bench_read_secret(benchmark, method, sized_pdf):
+    m = METHODS[method]
+    if not m.is_watermark_applicable(sized_pdf, None):
+        pytest.skip(f"{method} not applicable")
+    marked = m.add_watermark(sized_pdf, "bench-secret", KEY, None)
+    benchmark.group = f"read_secret[{method}]"
+    assert benchmark(m.read_secret, marked, KEY) == "bench-secret"
+
+
+def test_bench_explore_pdf(benchmark, sized_pdf):
+    benchmark.group = "explore_pdf"
+    tree = benchmark(explore_pdf, sized_pdf)
+    assert tree["children"]
+
+
+# ---------------------------------------------------------------------
+# API 层（conftest 中的 SQLite 夹具）
+# ---------------------------------------------------------------------
+
+def test_bench_upload_document(benchmark, client, auth_headers, sized_pdf):
+    benchmark.group = "api:upload-document"
+    benchmark(_upload, client, auth_headers, sized_pdf)
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_bench_create_watermark(benchmark, bench_app, client, auth_headers, method, sized_pdf):
+    if not METHODS[method].is_watermark_applicable(sized_pdf, None):
+        pytest.skip(f"{method} not applicable")
+    doc_id = _upload(client, auth_headers, sized_pdf)
+    counter = itertools.count()
+
+    def create():
+        n = next(counter)
+        r = client.post(
+            f"/api/create-watermark/{doc_id}",
+            headers=auth_headers,
+            json={"method": method, "intended_for": f"r{n}", "secret": f"s{n}", "key": KEY},
+        )
+        assert r.status_code == 201
+
+    benchmark.group = f"api:create-watermark[{method}]"
+    benchmark(create)
+
+
+@pytest.mark.parametrize("path", ["/api/list-documents", "/api/list-all-versions"])
+def test_bench_list_endpoints(benchmark, client, auth_headers, sample_pdf_path, path):
+    data = sample_pdf_path.read_bytes()
+    for i in range(50):
+        doc_id = _upload(client, auth_headers, data, f"doc{i}.pdf")
+        client.post(
+            f"/api/create-watermark/{doc_id}",
+            headers=auth_headers,
+            json={"method": "trailer-hmac", "intended_for": "x", "secret": f"s{i}", "key": KEY},
+        )
+
+    def get():
+        r = client.get(path, headers=auth_headers)
+        assert r.status_code == 200
+
+    benchmark.group = f"api:{path.rsplit('/', 1)[-1]}"
+    benchmark(get)
+
+
+def test_bench_get_document(benchmark, client, auth_headers, sized_pdf):
+    doc_id = _upload(client, auth_headers, sized_pdf)
+
+    def download():
+        r = client.get(f"/api/get-document/{doc_id}", headers=auth_headers)
+        assert r.status_code == 200
+        assert len(r.data) == len(sized_pdf)
+
+    benchmark.group = "api:get-document"
+    benchmark(download)
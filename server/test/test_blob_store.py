@@ -0,0 +1,70 @@
+import hashlib
+import os
+
+import pytest
+
+from server.src.blob_store import BlobStore
+
+
+def _stage(store, data):
+    staged = store.incoming_path()
+    staged.write_bytes(data)
+    return staged, hashlib.sha256(data).hexdigest()
+
+
+def test_adopt_deduplicates_identical_bytes(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    data = b"%PDF-1.4 same bytes"
+
+    staged1, sha = _stage(store, data)
+    a = store.adopt(staged1, sha, tmp_path / "files" / "a.pdf")
+    staged2, _ = _stage(store, data)
+    b = store.adopt(staged2, sha, tmp_path / "files" / "b.pdf")
+
+    assert not staged1.exists() and not staged2.exists()
+    blob = tmp_path / "blobs" / sha[:2] / f"{sha}.pdf"
+    assert blob.read_bytes() == data
+    assert os.path.samefile(a, blob) and os.path.samefile(b, blob)
+
+
+def test_adopt_survives_concurrent_release(tmp_path, monkeypatch):
+    """blob 在 adopt 链接前被并发的删除释放：重新用暂存文件安装，数据不丢"""
+    store = BlobStore(tmp_path / "blobs")
+    data = b"%PDF-1.4 raced"
+    staged1, sha = _stage(store, data)
+    first = store.adopt(staged1, sha, tmp_path / "files" / "a.pdf")
+
+    staged2, _ = _stage(store, data)
+    real_link = os.link
+    released = []
+
+    def racing_link(src, dst):
+        if not released and os.fspath(src) == os.fspath(store.path_for(sha)):
+            # 最后一个引用在这一刻被删除
+            first.unlink()
+            released.append(store.release(sha))
+        return real_link(src, dst)
+
+    monkeypatch.setattr("server.src.blob_store.os.link", racing_link)
+    dest = store.adopt(staged2, sha, tmp_path / "files" / "b.pdf")
+
+    assert released == [True]
+    assert dest.read_bytes() == data
+    assert not staged2.exists()
+    assert os.path.samefile(dest, store.path_for(sha))
+
+
+def test_adopted_path_survives_release(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    data = b"%PDF-1.4 linked"
+    staged, sha = _stage(store, data)
+    dest = store.adopt(staged, sha, tmp_path / "files" / "alice" / "doc.pdf")
+    assert store.release(sha) is True
+    assert store.release(sha) is False
+    assert dest.read_bytes() == data
+
+
+def test_path_for_rejects_non_digest(tmp_path):
+    store = BlobStore(tmp_path)
+    with pytest.raises(ValueError):
+        store.path_for("../../etc/passwd")
@@ -145,4 +145,35 @@ def _signup_and_login(client):
     # 5. 断言结果
     assert body["deleted"] is True
     assert body["file_deleted"] is False # 文件操作没被执行
-    assert body["file_missing"] is True # 命中 L822
\ No newline at end of file
+    assert body["file_missing"] is True # 命中 L822
+
+def test_duplicate_uploads_share_one_blob(client, app):
+    """相同字节只存一份 blob；最后一个引用删除后 blob 才被清理"""
+    headers = _signup_and_login(client)
+    content = _sample_pdf_bytes()
+
+    ids = []
+    for name in ("dup_a.pdf", "dup_b.pdf"):
+        resp = client.post(
+            "/api/upload-document",
+            data={"file": (io.BytesIO(content), name)},
+            headers=headers,
+            content_type="multipart/form-data",
+        )
+        assert resp.status_code == 201
+        ids.append(resp.get_json()["id"])
+
+    blob_root = Path(app.config["STORAGE_DIR"]) / "blobs"
+    blobs = [p for p in blob_root.rglob("*.pdf")]
+    assert len(blobs) == 1
+    assert blobs[0].read_bytes() == content
+
+    resp = client.delete(f"/api/delete-document/{ids[0]}", headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_json()["blob_released"] is False
+    assert blobs[0].exists()
+
+    resp = client.delete(f"/api/delete-document/{ids[1]}", headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_json()["blob_released"] is True
+    assert not blobs[0].exists()
@@ -0,0 +1,82 @@
+import hashlib
+
+from server.src.doc_cache import MAX_MEMO_PER_ENTRY, MEMO_ENTRY_BYTES, DocumentCache
+
+
+def _doc(tmp_path, name, data):
+    p = tmp_path / name
+    p.write_bytes(data)
+    return p, hashlib.sha256(data).hexdigest()
+
+
+def test_hit_skips_file_read(tmp_path):
+    cache = DocumentCache(max_bytes=1024)
+    path, sha = _doc(tmp_path, "a.pdf", b"%PDF-1.4 aaaa")
+
+    assert cache.get_bytes(sha, path) == b"%PDF-1.4 aaaa"
+    path.unlink()
+    # 第二次命中缓存，不再读文件
+    assert cache.get_bytes(sha.upper(), path) == b"%PDF-1.4 aaaa"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_is_bounded_by_bytes(tmp_path):
+    cache = DocumentCache(max_bytes=25)
+    docs = [_doc(tmp_path, f"{i}.pdf", b"%PDF-" + bytes([65 + i]) * 5) for i in range(3)]
+
+    cache.get_bytes(docs[0][1], docs[0][0])
+    cache.get_bytes(docs[1][1], docs[1][0])
+    cache.get_bytes(docs[0][1], docs[0][0])   # 0 变为最近使用
+    cache.get_bytes(docs[2][1], docs[2][0])   # 超出预算，淘汰 1
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 25 and stats["evictions"] == 1
+    docs[1][0].unlink()
+    cache.get_bytes(docs[0][1], docs[0][0])
+    assert cache.stats()["misses"] == 3
+
+
+def test_memo_computes_once(tmp_path):
+    cache = DocumentCache()
+    path, sha = _doc(tmp_path, "m.pdf", b"%PDF-1.4 memo")
+    calls = []
+
+    def compute(data):
+        calls.append(data)
+        return len(data)
+
+    assert cache.memo(sha, path, "len", compute) == 13
+    assert cache.memo(sha, path, "len", compute) == 13
+    assert len(calls) == 1
+
+    cache.discard(sha)
+    assert cache.memo(sha, path, "len", compute) == 13
+    assert len(calls) == 2
+
+
+def test_memo_entries_are_charged_and_capped(tmp_path):
+    """memo 值计入字节预算，且每个文档的条数有上限（键可能来自客户端输入）"""
+    cache = DocumentCache()
+    path, sha = _doc(tmp_path, "c.pdf", b"%PDF-1.4 capped")
+    base = cache.stats()["bytes"]
+
+    for i in range(MAX_MEMO_PER_ENTRY + 10):
+        assert cache.memo(sha, path, f"k{i}", lambda data, i=i: i) == i
+    charged = cache.stats()["bytes"] - base
+    assert MAX_MEMO_PER_ENTRY * MEMO_ENTRY_BYTES <= charged < (MAX_MEMO_PER_ENTRY + 1) * (MEMO_ENTRY_BYTES + 8)
+
+    # 超出上限的值照常计算，但不存储
+    calls = []
+    cache.memo(sha, path, "extra", lambda data: calls.append(1))
+    cache.memo(sha, path, "extra", lambda data: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_on_lookup_reports_hits_and_misses(tmp_path):
+    seen = []
+    cache = DocumentCache(on_lookup=seen.append)
+    path, sha = _doc(tmp_path, "l.pdf", b"%PDF-1.4 lookup")
+
+    cache.get_bytes(sha, path)
+    cache.get_bytes(sha, path)
+    assert seen == [False, True]
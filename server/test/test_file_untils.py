@@ -50,4 +50,21 @@ def test_sha256_file_large_file():
         expected_hash = hashlib.sha256(test_content).hexdigest()
         assert calculated_hash == expected_hash
     finally:
-        os.unlink(temp_path)
\ No newline at end of file
+        os.unlink(temp_path)
+
+def test_save_stream_hashed_single_pass(tmp_path):
+    """测试上传流边写边算 SHA256，并原子落盘"""
+    from server.src.server import _save_stream_hashed
+    import hashlib
+    import io
+
+    content = b"%PDF-1.4\n" + b"y" * (3 * 1024 * 1024 + 17)
+    dest = tmp_path / "user" / "doc.pdf"
+
+    sha_hex, size = _save_stream_hashed(io.BytesIO(content), dest)
+
+    assert sha_hex == hashlib.sha256(content).hexdigest()
+    assert size == len(content)
+    assert dest.read_bytes() == content
+    # 不应残留临时文件
+    assert [p.name for p in dest.parent.iterdir()] == ["doc.pdf"]
@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+pytest.importorskip("prometheus_client")
+
+from server.src import metrics as AppMetrics
+
+
+def _sample(body: str, name: str, **labels) -> float:
+    """从 Prometheus 文本格式中取某个样本的值（未出现则为 0）。"""
+    for line in body.splitlines():
+        if line.startswith(f"{name}{{") or line.startswith(f"{name} "):
+            head, _, value = line.rpartition(" ")
+            if all(f'{k}="{v}"' in head for k, v in labels.items()):
+                return float(value)
+    return 0.0
+
+
+@pytest.fixture
+def metrics_app():
+    app = Flask(__name__)
+    AppMetrics.init_app(app)
+    engine = create_engine("sqlite:///:memory:")
+
+    @app.get("/items/<int:item_id>")
+    def item(item_id):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"id": item_id}
+
+    @app.get("/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    return app
+
+
+def test_metrics_exports_route_db_watermark_and_cache_series(metrics_app):
+    client = metrics_app.test_client()
+    before = client.get("/metrics").get_data(as_text=True)
+
+    client.get("/items/1")
+    client.get("/items/2")
+    AppMetrics.observe_watermark("embed", "toy-eof", 0.01, bytes_in=100, bytes_out=150)
+    AppMetrics.observe_watermark("read", "no-such-method", 0.01)
+    AppMetrics.observe_cache("document", True)
+    AppMetrics.observe_cache("document", False)
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    body = r.get_data(as_text=True)
+
+    def delta(name, **labels):
+        return _sample(body, name, **labels) - _sample(before, name, **labels)
+
+    # 按路由规则（而不是具体路径）聚合
+    assert delta("tatou_http_request_duration_seconds_count",
+                 method="GET", route="/items/<int:item_id>", status="200") == 2
+    assert delta("tatou_db_query_duration_seconds_count", operation="SELECT") >= 2
+    # 别名归一到正式方法名，未知方法归为 other
+    assert delta("tatou_watermark_duration_seconds_count", operation="embed", method="trailer-hmac") == 1
+    assert delta("tatou_watermark_bytes_total", operation="embed", method="trailer-hmac", direction="out") == 150
+    assert delta("tatou_watermark_duration_seconds_count", operation="read", method="other") == 1
+    assert delta("tatou_cache_lookups_total", cache="document", result="hit") == 1
+    assert delta("tatou_cache_lookups_total", cache="document", result="miss") == 1
+
+
+def test_metrics_counts_unhandled_errors_and_balances_in_progress(metrics_app):
+    metrics_app.config["PROPAGATE_EXCEPTIONS"] = False
+    client = metrics_app.test_client()
+    before = client.get("/metrics").get_data(as_text=True)
+
+    assert client.get("/boom").status_code == 500
+    body = client.get("/metrics").get_data(as_text=True)
+
+    assert _sample(body, "tatou_http_request_duration_seconds_count",
+                   method="GET", route="/boom", status="500") - _sample(
+        before, "tatou_http_request_duration_seconds_count",
+        method="GET", route="/boom", status="500") == 1
+    # 只有正在处理的 /metrics 请求本身
+    assert _sample(body, "tatou_http_requests_in_progress") == 1
+
+
+def test_metrics_token_required_when_configured(metrics_app):
+    metrics_app.config["METRICS_TOKEN"] = "s3cret"
+    client = metrics_app.test_client()
+    assert client.get("/metrics").status_code == 401
+    r = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert r.status_code == 200
@@ -0,0 +1,49 @@
+import os
+
+from server.src.result_cache import WatermarkResultCache
+
+SHA = "ab" * 32
+
+
+def test_key_covers_all_inputs_and_hides_key(tmp_path):
+    cache = WatermarkResultCache(tmp_path, max_bytes=1 << 20, secret=b"server-secret")
+    k = cache.key_for(SHA, "trailer-hmac", "s", "wm-key", None)
+
+    assert k == cache.key_for(SHA.upper(), "trailer-hmac", "s", "wm-key", "")
+    assert k != cache.key_for(SHA, "trailer-hmac", "s", "other-key", None)
+    assert k != cache.key_for(SHA, "trailer-hmac", "s2", "wm-key", None)
+    assert k != cache.key_for(SHA, "metadata-xmp", "s", "wm-key", None)
+    assert k != cache.key_for(SHA, "trailer-hmac", "s", "wm-key", "eof")
+    # 方法实现（类路径或 cache_version）变了，旧输出不再命中
+    impl = cache.key_for(SHA, "trailer-hmac", "s", "wm-key", None, implementation="m.AddAfterEOF:1")
+    assert impl != k
+    assert impl != cache.key_for(SHA, "trailer-hmac", "s", "wm-key", None, implementation="m.AddAfterEOF:2")
+    # 换一个服务器密钥，缓存键也不同
+    other = WatermarkResultCache(tmp_path, max_bytes=1 << 20, secret=b"x")
+    assert k != other.key_for(SHA, "trailer-hmac", "s", "wm-key", None)
+
+
+def test_put_get_roundtrip(tmp_path):
+    cache = WatermarkResultCache(tmp_path, max_bytes=1 << 20, secret=b"k")
+    key = cache.key_for(SHA, "trailer-hmac", "s", "k", None)
+
+    assert cache.get(key) is None
+    cache.put(key, b"%PDF-1.4 out")
+    assert cache.get(key) == b"%PDF-1.4 out"
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = WatermarkResultCache(tmp_path, max_bytes=250, secret=b"k")
+    keys = [cache.key_for(SHA, "m", f"s{i}", "k", None) for i in range(3)]
+
+    cache.put(keys[0], b"a" * 100)
+    cache.put(keys[1], b"b" * 100)
+    # keys[0] 比 keys[1] 更旧，但刚被读取过
+    os.utime(cache._path(keys[0]), (1, 1))
+    os.utime(cache._path(keys[1]), (2, 2))
+    cache.get(keys[0])
+    cache.put(keys[2], b"c" * 100)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
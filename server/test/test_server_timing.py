@@ -0,0 +1,56 @@
+import json
+import logging
+
+import pytest
+from flask import Flask
+
+from server.src.server_timing import header_value, init_app, phase
+
+
+@pytest.fixture
+def timed_app():
+    app = Flask(__name__)
+    init_app(app)
+
+    @app.get("/work")
+    def work():
+        with phase("db", "Documents lookup"):
+            pass
+        with phase("embed"):
+            pass
+        with phase("embed"):  # 同名阶段累加
+            pass
+        return {"ok": True}
+
+    @app.get("/plain")
+    def plain():
+        return {"ok": True}
+
+    return app
+
+
+def test_phases_emit_server_timing_header_and_log(timed_app, caplog):
+    with caplog.at_level(logging.INFO, logger="tatou.timing"):
+        r = timed_app.test_client().get("/work")
+
+    names = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert names == ["db", "embed", "total"]
+    assert 'db;desc="Documents lookup";dur=' in r.headers["Server-Timing"]
+
+    (record,) = [json.loads(rec.getMessage()) for rec in caplog.records if rec.name == "tatou.timing"]
+    assert record["event"] == "server_timing"
+    assert record["route"] == "/work" and record["status"] == 200
+    assert set(record["phases_ms"]) == {"db", "embed"}
+    assert record["total_ms"] >= sum(record["phases_ms"].values())
+
+
+def test_requests_without_phases_are_not_reported(timed_app):
+    r = timed_app.test_client().get("/plain")
+    assert "Server-Timing" not in r.headers
+
+
+def test_phase_outside_request_is_noop():
+    with phase("embed"):
+        value = 1
+    assert value == 1
+    assert header_value([("a", None, 1.25)], 2.0) == "a;dur=1.2, total;dur=2.0"
@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import threading
+import time
+
+from server.src.upload_sessions import UploadSessionNotFound, UploadSessionStore
+
+
+def _put(client, headers, upload_id, data, start, total):
+    end = start + len(data) - 1
+    return client.put(
+        f"/api/upload-sessions/{upload_id}",
+        data=data,
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{total}"},
+        content_type="application/octet-stream",
+    )
+
+
+def test_chunked_upload_roundtrip(client, auth_headers, sample_pdf_path):
+    content = sample_pdf_path.read_bytes()
+    half = len(content) // 2
+
+    r = client.post(
+        "/api/upload-sessions",
+        json={"filename": "big.pdf", "name": "Big report", "size": len(content)},
+        headers=auth_headers,
+    )
+    assert r.status_code == 201
+    upload_id = r.get_json()["upload_id"]
+
+    assert _put(client, auth_headers, upload_id, content[:half], 0, len(content)).status_code == 200
+
+    # 重复发送已经收到的分块 -> 409，并告知当前 offset
+    r = _put(client, auth_headers, upload_id, content[:half], 0, len(content))
+    assert r.status_code == 409
+    assert r.get_json()["offset"] == half
+
+    # 未传完时不能 finalize
+    r = client.post(f"/api/upload-sessions/{upload_id}/finalize", headers=auth_headers)
+    assert r.status_code == 409
+
+    r = client.get(f"/api/upload-sessions/{upload_id}", headers=auth_headers)
+    assert r.get_json()["offset"] == half
+    assert _put(client, auth_headers, upload_id, content[half:], half, len(content)).status_code == 200
+
+    r = client.post(
+        f"/api/upload-sessions/{upload_id}/finalize",
+        json={"sha256": hashlib.sha256(content).hexdigest()},
+        headers=auth_headers,
+    )
+    assert r.status_code == 201
+    body = r.get_json()
+    assert body["name"] == "Big report"
+    assert body["size"] == len(content)
+    assert body["sha256"].lower() == hashlib.sha256(content).hexdigest()
+
+    # 会话在 finalize 后被清理
+    r = client.get(f"/api/upload-sessions/{upload_id}", headers=auth_headers)
+    assert r.status_code == 404
+
+
+def test_upload_session_rejects_non_pdf_name(client, auth_headers):
+    r = client.post("/api/upload-sessions", json={"filename": "x.exe"}, headers=auth_headers)
+    assert r.status_code == 400
+
+
+def test_upload_rejects_body_not_matching_content_range(client, auth_headers, sample_pdf_path):
+    content = sample_pdf_path.read_bytes()
+    half = len(content) // 2
+    r = client.post(
+        "/api/upload-sessions",
+        json={"filename": "short.pdf", "size": len(content)},
+        headers=auth_headers,
+    )
+    upload_id = r.get_json()["upload_id"]
+
+    # 请求体比 Content-Range 声明的短 -> 400，整块不落盘，offset 不变
+    r = client.put(
+        f"/api/upload-sessions/{upload_id}",
+        data=content[: half - 10],
+        headers={**auth_headers, "Content-Range": f"bytes 0-{half - 1}/{len(content)}"},
+        content_type="application/octet-stream",
+    )
+    assert r.status_code == 400
+    assert r.get_json()["offset"] == 0
+
+    # 比声明的长也一样
+    r = client.put(
+        f"/api/upload-sessions/{upload_id}",
+        data=content[: half + 10],
+        headers={**auth_headers, "Content-Range": f"bytes 0-{half - 1}/{len(content)}"},
+        content_type="application/octet-stream",
+    )
+    assert r.status_code == 400
+    assert r.get_json()["offset"] == 0
+
+    assert _put(client, auth_headers, upload_id, content[:half], 0, len(content)).status_code == 200
+    assert _put(client, auth_headers, upload_id, content[half:], half, len(content)).status_code == 200
+    r = client.post(
+        f"/api/upload-sessions/{upload_id}/finalize",
+        json={"sha256": hashlib.sha256(content).hexdigest()},
+        headers=auth_headers,
+    )
+    assert r.status_code == 201
+    assert r.get_json()["size"] == len(content)
+
+
+def test_upload_chunk_waits_for_finalize_lock(tmp_path):
+    store = UploadSessionStore(tmp_path)
+    state = store.create(1, "a.pdf", "a.pdf", 8)
+    errors = []
+
+    def put():
+        try:
+            store.append(state, io.BytesIO(b"%PDF-1.4"), 0, 7)
+        except Exception as e:
+            errors.append(e)
+
+    with store.locked(state["upload_id"]):
+        t = threading.Thread(target=put)
+        t.start()
+        t.join(0.3)
+        # finalize/abort 持锁期间，分块写入必须等待
+        assert t.is_alive()
+        store.discard(state["upload_id"])
+    t.join(5)
+    assert not t.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], UploadSessionNotFound)
+
+
+def test_idle_upload_sessions_expire(tmp_path):
+    """超过 TTL 没有新分块的会话在创建新会话时被清理（文件和进程内 hasher）"""
+    from server.src import upload_sessions
+
+    store = UploadSessionStore(tmp_path, ttl=60)
+    old = store.create(1, "old.pdf", "old.pdf", 8)
+    store.append(old, io.BytesIO(b"%PDF"), 0, 3)
+    fresh = store.create(1, "fresh.pdf", "fresh.pdf", 8)
+
+    state_path = tmp_path / f"{old['upload_id']}.json"
+    state = json.loads(state_path.read_text(encoding="utf-8"))
+    state["updated"] = state["created"] = int(time.time()) - 120
+    state_path.write_text(json.dumps(state), encoding="utf-8")
+    assert store.load(old["upload_id"]) is None
+
+    store.create(1, "new.pdf", "new.pdf", 8)
+    assert not state_path.exists()
+    assert not store.part_path(old["upload_id"]).exists()
+    assert old["upload_id"] not in upload_sessions._HASHERS
+    assert store.load(fresh["upload_id"]) is not None
@@ -1,6 +1,7 @@
 # server/test/test_watermark_api.py
 
 import io
+from pathlib import Path
 import uuid
 import os
 import sys
@@ -273,4 +274,421 @@ def test_create_watermark_document_not_found(client, auth_headers):
         }
     )
     # 应该返回404或410
-    assert resp.status_code in [404, 410]
\ No newline at end of file
+    assert resp.status_code in [404, 410]
+
+def test_create_watermark_async_job(client, auth_headers, sample_pdf_path):
+    """异步模式：先返回 job id，任务完成后 Versions 行才写入"""
+    import time
+
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "async.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={
+            "method": "trailer-hmac",
+            "intended_for": "async-user",
+            "secret": "async-secret",
+            "key": "async-key",
+            "async": True,
+        },
+    )
+    assert r.status_code == 202
+    status_url = r.get_json()["status_url"]
+
+    job = None
+    for _ in range(100):
+        job = client.get(status_url, headers=auth_headers).get_json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert job["result"]["intended_for"] == "async-user"
+
+    r = client.get(f"/api/list-versions/{doc_id}", headers=auth_headers)
+    links = [v["link"] for v in r.get_json()["versions"]]
+    assert job["result"]["link"] in links
+
+
+def test_create_watermark_batch(client, auth_headers, sample_pdf_path):
+    """批量接口：一次请求为多个接收者生成版本"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "batch.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    recipients = [{"intended_for": f"user{i}", "secret": f"secret-{i}"} for i in range(5)]
+    r = client.post(
+        f"/api/create-watermark-batch/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "key": "batch-key", "recipients": recipients},
+    )
+    assert r.status_code == 201
+    body = r.get_json()
+    assert body["count"] == 5
+    assert body["errors"] == []
+    assert all(isinstance(v["id"], int) for v in body["versions"])
+
+    r = client.get(f"/api/list-versions/{doc_id}", headers=auth_headers)
+    secrets = sorted(v["secret"] for v in r.get_json()["versions"])
+    assert secrets == sorted(x["secret"] for x in recipients)
+
+
+def test_create_watermark_batch_bounds_outputs_in_memory(client, auth_headers, sample_pdf_path, mocker):
+    """批量接口边完成边写盘：在途结果不超过 2×workers，返回顺序与 recipients 一致"""
+    import threading
+    from server.src import watermarking_utils as WMUtils
+
+    client.application.config.update(WM_BATCH_WORKERS=2, WM_RESULT_CACHE_MAX_BYTES=0)
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "bounded.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    lock = threading.Lock()
+    state = {"started": 0, "written": 0, "peak": 0}
+    real_apply = WMUtils.apply_watermark
+    real_write = Path.write_bytes
+
+    def apply(*args, **kwargs):
+        # 已开始但尚未写盘的输出数
+        with lock:
+            state["started"] += 1
+            state["peak"] = max(state["peak"], state["started"] - state["written"])
+        return real_apply(*args, **kwargs)
+
+    def write_bytes(self, data):
+        with lock:
+            state["written"] += 1
+        return real_write(self, data)
+
+    mocker.patch.object(WMUtils, "apply_watermark", side_effect=apply)
+    mocker.patch.object(Path, "write_bytes", write_bytes)
+
+    recipients = [{"intended_for": f"r{i}", "secret": f"s{i}"} for i in range(12)]
+    r = client.post(
+        f"/api/create-watermark-batch/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "key": "k", "recipients": recipients},
+    )
+    assert r.status_code == 201
+    body = r.get_json()
+    assert [v["intended_for"] for v in body["versions"]] == [x["intended_for"] for x in recipients]
+    assert state["peak"] <= 4
+
+
+def test_watermark_executor_busy_returns_503(client, auth_headers, sample_pdf_path, mocker):
+    """进程池队列已满：返回 503 + Retry-After，而不是 400/500"""
+    from server.src import watermarking_utils as WMUtils
+
+    client.application.config["WM_RESULT_CACHE_MAX_BYTES"] = 0
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "busy.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    busy = WMUtils.ExecutorBusyError("watermark executor queue is full")
+    mocker.patch.object(WMUtils, "apply_watermark", side_effect=busy)
+    mocker.patch.object(WMUtils, "read_watermark", side_effect=busy)
+
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "intended_for": "x", "secret": "s", "key": "k"},
+    )
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+    r = client.post(
+        f"/api/create-watermark-batch/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "key": "k", "recipients": [{"intended_for": "x", "secret": "s"}]},
+    )
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+
+    r = client.post(f"/api/read-watermark/{doc_id}", headers=auth_headers,
+                    json={"method": "trailer-hmac", "key": "k"})
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+
+
+def test_create_watermark_rejects_selector_past_last_page(client, auth_headers, sample_pdf_path):
+    """visible-text 选择器选不到任何页时返回 400（而不是嵌入时 500）"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "pages.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "visible-text-redundant", "intended_for": "x", "secret": "s",
+              "key": "k", "position": "999"},
+    )
+    assert r.status_code == 400
+
+    # 旧式位置（Scripts/visible-text.sh 默认的 br）仍按全部页面处理
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "visible-text-redundant", "intended_for": "x", "secret": "s",
+              "key": "k", "position": "br"},
+    )
+    assert r.status_code == 201
+
+
+def test_create_watermark_batch_requires_recipients(client, auth_headers):
+    r = client.post(
+        "/api/create-watermark-batch/1",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "key": "k", "recipients": []},
+    )
+    assert r.status_code == 400
+
+
+def test_repeated_operations_hit_document_cache(client, auth_headers, sample_pdf_path):
+    """同一文档的重复操作命中按 sha256 的进程内缓存"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "hot.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    for i in range(2):
+        r = client.post(
+            f"/api/create-watermark/{doc_id}",
+            headers=auth_headers,
+            json={"method": "trailer-hmac", "intended_for": f"hot{i}", "secret": f"s{i}", "key": "k"},
+        )
+        assert r.status_code == 201
+
+    stats = client.application.config["_DOC_CACHE"].stats()
+    assert stats["entries"] >= 1
+    assert stats["hits"] >= 1
+
+
+def test_read_watermark_tail_reader_bypasses_document_cache(client, auth_headers, sample_pdf_path):
+    """只读尾部的方法（trailer-hmac）直接读文件，不把整份文档放进缓存"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "tail.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    cache = client.application.config.get("_DOC_CACHE")
+    before = cache.stats()["entries"] if cache is not None else 0
+
+    r = client.post(
+        f"/api/read-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "key": "k"},
+    )
+    assert r.status_code == 400  # 没有水印
+    cache = client.application.config.get("_DOC_CACHE")
+    assert (cache.stats()["entries"] if cache is not None else 0) == before
+
+
+def test_retried_create_watermark_reuses_cached_output(client, auth_headers, sample_pdf_path, mocker):
+    """相同参数的重试直接返回缓存的输出，不再重新嵌入"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "retry.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    import server.src.server as server_module
+    spy = mocker.spy(server_module.WMUtils, "apply_watermark")
+    body = {"method": "trailer-hmac", "intended_for": "retry-user", "secret": "retry-secret", "key": "retry-key"}
+
+    sizes = []
+    for _ in range(2):
+        r = client.post(f"/api/create-watermark/{doc_id}", headers=auth_headers, json=body)
+        assert r.status_code == 201
+        sizes.append(r.get_json()["size"])
+
+    assert spy.call_count == 1
+    assert sizes[0] == sizes[1]
+
+    # 换一个 key 就是不同的输出
+    r = client.post(f"/api/create-watermark/{doc_id}", headers=auth_headers, json={**body, "key": "other"})
+    assert r.status_code == 201
+    assert spy.call_count == 2
+
+
+def test_plugin_method_bypasses_result_cache(client, auth_headers, sample_pdf_path, mocker):
+    """覆盖内置名字的插件方法不会拿到内置实现缓存的输出"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "plugin.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    body = {"method": "trailer-hmac", "intended_for": "p", "secret": "plugin-secret", "key": "plugin-key"}
+    r = client.post(f"/api/create-watermark/{doc_id}", headers=auth_headers, json=body)
+    assert r.status_code == 201
+
+    import server.src.watermarking_utils as wm_utils
+    from server.src.add_after_eof import AddAfterEOF
+
+    class ReplacedEOF(AddAfterEOF):
+        pass
+
+    builtin = wm_utils.METHODS["trailer-hmac"]
+    spy = mocker.spy(wm_utils, "apply_watermark")
+    wm_utils.METHODS["trailer-hmac"] = ReplacedEOF()
+    try:
+        for _ in range(2):
+            r = client.post(f"/api/create-watermark/{doc_id}", headers=auth_headers, json=body)
+            assert r.status_code == 201
+    finally:
+        wm_utils.METHODS["trailer-hmac"] = builtin
+    assert spy.call_count == 2
+
+
+def test_read_watermark_auto_detects_method(client, auth_headers, sample_pdf_path):
+    """method=auto 自动识别嵌入方法"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "auto.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "intended_for": "auto-user", "secret": "auto-secret", "key": "auto-key"},
+    )
+    assert r.status_code == 201
+    link = r.get_json()["link"]
+
+    pdf = client.get(f"/api/get-version/{link}").data
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(pdf), "leaked.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    leaked_id = r.get_json()["id"]
+
+    r = client.post(f"/api/read-watermark/{leaked_id}", headers=auth_headers,
+                    json={"method": "auto", "key": "auto-key"})
+    assert r.status_code == 200
+    assert r.get_json()["secret"] == "auto-secret"
+    assert r.get_json()["method"] == "trailer-hmac"
+
+    r = client.post(f"/api/read-watermark/{leaked_id}", headers=auth_headers,
+                    json={"method": "auto", "key": "wrong"})
+    assert r.status_code == 400
+
+
+def test_identify_leak_resolves_version(client, auth_headers, sample_pdf_path):
+    """上传泄露的 PDF，直接定位到对应版本和接收者"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "leak.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+    links = {}
+    for who in ("alice", "bob"):
+        r = client.post(
+            f"/api/create-watermark/{doc_id}",
+            headers=auth_headers,
+            json={"method": "trailer-hmac", "intended_for": who, "secret": f"leak-{who}", "key": "leak-key"},
+        )
+        assert r.status_code == 201
+        links[who] = r.get_json()["link"]
+
+    leaked = client.get(f"/api/get-version/{links['bob']}").data
+    r = client.post(
+        "/api/identify-leak",
+        data={"file": (io.BytesIO(leaked), "found.pdf"), "key": "leak-key"},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["count"] == 1
+    match = body["matches"][0]
+    assert match["intended_for"] == "bob"
+    assert match["documentid"] == doc_id
+    assert match["link"] == links["bob"]
+    assert match["verified"] is True
+
+    # 没有水印的文件
+    r = client.post(
+        "/api/identify-leak",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "clean.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    assert r.status_code == 404
+
+
+def test_ensure_indexes_adds_missing_secret_index():
+    """已有的 MySQL/MariaDB 库启动时补建 ix_Versions_secret，已存在则跳过"""
+    from server.src.server import _ensure_indexes
+
+    def run(existing):
+        eng = MagicMock()
+        eng.dialect.name = "mysql"
+        conn = eng.begin.return_value.__enter__.return_value
+        conn.execute.return_value.first.return_value = existing
+        _ensure_indexes(eng)
+        return [str(c.args[0]) for c in conn.execute.call_args_list]
+
+    sql = run(None)
+    assert "information_schema.STATISTICS" in sql[0]
+    assert sql[1] == "CREATE INDEX `ix_Versions_secret` ON `Versions` (`secret`)"
+    assert len(run((1,))) == 1
+
+    # 其他方言（如测试用的 SQLite）不做检查
+    eng = MagicMock()
+    eng.dialect.name = "sqlite"
+    _ensure_indexes(eng)
+    eng.begin.assert_not_called()
+
+
+def test_create_watermark_reports_server_timing(client, auth_headers, sample_pdf_path):
+    """create-watermark 在 Server-Timing 头中给出各阶段耗时"""
+    r = client.post(
+        "/api/upload-document",
+        data={"file": (io.BytesIO(sample_pdf_path.read_bytes()), "timing.pdf")},
+        headers=auth_headers,
+        content_type="multipart/form-data",
+    )
+    doc_id = r.get_json()["id"]
+
+    r = client.post(
+        f"/api/create-watermark/{doc_id}",
+        headers=auth_headers,
+        json={"method": "trailer-hmac", "intended_for": "timing", "secret": "s", "key": "k"},
+    )
+    assert r.status_code == 201
+    names = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert names == ["db", "resolve", "applicable", "load", "embed", "write", "insert", "total"]
@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+import time
+
+from server.src.watermark_jobs import WatermarkJobQueue
+
+
+def _wait(jobs, job_id):
+    for _ in range(200):
+        state = jobs.get(job_id)
+        if state["status"] not in ("queued", "running"):
+            return state
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def _rewrite(jobs, job_id, **changes):
+    path = jobs.root / f"{job_id}.json"
+    state = json.loads(path.read_text(encoding="utf-8"))
+    state.update(changes)
+    path.write_text(json.dumps(state), encoding="utf-8")
+
+
+def test_job_runs_and_reports_result(tmp_path):
+    jobs = WatermarkJobQueue(tmp_path)
+    job = jobs.submit(1, 2, lambda: ({"ok": True}, 201))
+    state = _wait(jobs, job["job_id"])
+    jobs.shutdown()
+    assert state["status"] == "done"
+    assert state["result"] == {"ok": True}
+
+
+def test_job_of_dead_worker_is_reported_failed(tmp_path):
+    """接收任务的 worker 进程退出后，排队中的任务报告为 failed 而不是一直 queued"""
+    jobs = WatermarkJobQueue(tmp_path)
+    job = jobs.submit(1, 2, lambda: ({}, 201))
+    _wait(jobs, job["job_id"])
+    jobs.shutdown()
+
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    _rewrite(jobs, job["job_id"], status="queued", pid=dead.pid)
+    state = jobs.get(job["job_id"])
+    assert state["status"] == "failed"
+    assert state["http_status"] == 500
+
+    # 超过 deadline 的任务同样报告失败
+    _rewrite(jobs, job["job_id"], status="running", deadline=time.time() - 1)
+    state = jobs.get(job["job_id"])
+    assert state["status"] == "failed"
+    assert state["http_status"] == 504
+
+
+def test_cleanup_removes_expired_job_files(tmp_path):
+    jobs = WatermarkJobQueue(tmp_path, ttl=60)
+    old = jobs.submit(1, 2, lambda: ({}, 201))
+    fresh = jobs.submit(1, 3, lambda: ({}, 201))
+    _wait(jobs, old["job_id"])
+    _wait(jobs, fresh["job_id"])
+    jobs.shutdown()
+    _rewrite(jobs, old["job_id"], finished=time.time() - 120)
+
+    assert jobs.cleanup() == 1
+    assert jobs.get(old["job_id"]) is None
+    assert jobs.get(fresh["job_id"])["status"] == "done"
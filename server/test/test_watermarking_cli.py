@@ -149,3 +149,116 @@ def test_cli_rejects_missing_secret(tmp_path):
     run_cli_test()
 
 
+
+
+def test_cli_scan_streams_jsonl_and_resumes(tmp_path):
+    """scan：遍历目录输出 JSONL，可通过 checkpoint 续扫"""
+    from server.src.watermarking_utils import apply_watermark
+
+    corpus = tmp_path / "corpus"
+    (corpus / "sub").mkdir(parents=True)
+    (corpus / "a.pdf").write_bytes(apply_watermark("trailer-hmac", b"%PDF-1.4 a", "secret-a", "K"))
+    (corpus / "sub" / "b.pdf").write_bytes(b"%PDF-1.4 clean")
+    (corpus / "notes.txt").write_text("ignored")
+
+    out = tmp_path / "scan.jsonl"
+    ckpt = tmp_path / "scan.ckpt"
+    args = ["scan", str(corpus), "-j", "1", "--key", "K", "--out", str(out), "--checkpoint", str(ckpt)]
+    code, _, err = run_cli(args)
+    assert code == 0
+    assert "scanned 2 files" in err
+
+    recs = {r["path"]: r for r in map(json.loads, out.read_text().splitlines())}
+    a = recs[str(corpus / "a.pdf")]
+    assert a["secrets"] == [{"method": "trailer-hmac", "secret": "secret-a"}]
+    assert a["verified"] == {"method": "trailer-hmac", "secret": "secret-a"}
+    assert recs[str(corpus / "sub" / "b.pdf")]["secrets"] == []
+
+    # 新增文件后续扫：只处理新文件，结果追加
+    (corpus / "c.pdf").write_bytes(b"%PDF-1.4 new")
+    code, _, err = run_cli(args)
+    assert code == 0
+    assert "scanned 1 files" in err and "2 skipped" in err
+    assert len(out.read_text().splitlines()) == 3
+
+
+def test_cli_embed_batch_reports_rows_and_continues(tmp_path):
+    """embed-batch：逐行报告耗时，失败行不影响其余行"""
+    src = tmp_path / "src.pdf"
+    src.write_bytes(b"%PDF-1.4 batch")
+    manifest = tmp_path / "m.csv"
+    manifest.write_text(
+        "input,output,secret,method\n"
+        f"{src},{tmp_path / 'a.pdf'},alice,trailer-hmac\n"
+        f"{src},{tmp_path / 'b.pdf'},bob,\n"
+        f"{tmp_path / 'missing.pdf'},{tmp_path / 'c.pdf'},carol,trailer-hmac\n"
+    )
+    report = tmp_path / "report.jsonl"
+    code, _, err = run_cli([
+        "embed-batch", str(manifest), "-j", "1", "--key", "K",
+        "--method", "trailer-hmac", "--report", str(report),
+    ])
+    assert code == 1
+    assert "embedded 2/3 rows" in err
+
+    recs = {r["line"]: r for r in map(json.loads, report.read_text().splitlines())}
+    assert recs[2]["ok"] and recs[3]["ok"] and not recs[4]["ok"]
+    assert "FileNotFoundError" in recs[4]["error"]
+    assert all(r["ms"] >= 0 for r in recs.values())
+
+    code, out, _ = run_cli(["extract", str(tmp_path / "b.pdf"), "--method", "trailer-hmac", "--key", "K"])
+    assert code == 0 and out.strip() == "bob"
+
+
+def test_cli_embed_extract_via_stdin_stdout(tmp_path):
+    """embed/extract 支持 - 作为 stdin/stdout，可直接接入管道"""
+    from pathlib import Path
+
+    repo_root = Path(__file__).resolve().parents[2]
+    base = [sys.executable, "-m", "server.src.watermarking_cli"]
+
+    emb = subprocess.run(
+        base + ["embed", "-", "-", "--method", "trailer-hmac", "--secret", "PIPE", "--key", "K"],
+        input=b"%PDF-1.4 piped", capture_output=True, cwd=repo_root, timeout=30,
+    )
+    assert emb.returncode == 0
+    assert emb.stdout.startswith(b"%PDF-1.4 piped")
+    assert b"Wrote watermarked PDF" in emb.stderr
+
+    ext = subprocess.run(
+        base + ["extract", "-", "--method", "trailer-hmac", "--key", "K"],
+        input=emb.stdout, capture_output=True, cwd=repo_root, timeout=30,
+    )
+    assert ext.returncode == 0
+    assert ext.stdout.decode().strip() == "PIPE"
+
+
+def test_cli_stdin_input_conflicts_with_key_stdin():
+    code, _, err = run_cli(["embed", "-", "out.pdf", "--secret", "s", "--key-stdin"])
+    assert code == 2
+    assert "stdin" in err
+
+
+def test_cli_bench_reports_json(tmp_path):
+    """bench：对合成 PDF 输出每个方法的吞吐、延迟分位数与膨胀率"""
+    out = tmp_path / "bench.json"
+    code, _, _ = run_cli(["bench", "--pages", "2", "-n", "3", "--warmup", "0", "--out", str(out)])
+    assert code == 0
+
+    report = json.loads(out.read_text())
+    assert report["params"]["methods"] == sorted(cli.METHODS)
+    (entry,) = report["results"]
+    assert entry["input"].startswith("synthetic:2p")
+    assert entry["explore"]["iterations"] == 3
+    for name in cli.METHODS:
+        rec = entry["methods"][name]
+        assert "error" not in rec
+        stats = rec["add_watermark"]
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert stats["ops_per_sec"] > 0
+        assert rec["inflation"] >= 1.0
+        # 每个操作单独测量的分配峰值；进程级 RSS 只在顶层出现一次
+        assert stats["peak_alloc_kb"] >= 0
+        assert rec["read_secret"]["peak_alloc_kb"] >= 0
+        assert "peak_rss_kb" not in rec
+    assert "peak_rss_kb" in report
@@ -1,6 +1,8 @@
 # server/test/test_watermarking_utils.py
 
+import contextlib
 import json
+import re
 from pathlib import Path
 import pytest
 import server.src.watermarking_utils as wm
@@ -111,4 +113,395 @@ def test_metadata_watermark_roundtrip(sample_pdf):
     
     # 4. 验证读取没有水印的文件 (覆盖 SecretNotFoundError)
     with pytest.raises((RuntimeError, ValueError)):  # 捕获两种可能的异常
-        wm_instance.read_secret(pdf_bytes, key)
\ No newline at end of file
+        wm_instance.read_secret(pdf_bytes, key)
+
+def test_process_pool_roundtrip(sample_pdf):
+    """进程池模式：CPU 密集方法在子进程中执行，结果与进程内一致"""
+    pdf_bytes = sample_pdf.read_bytes()
+    wm.configure_executor(1, timeout=60)
+    try:
+        out = wm.apply_watermark("visible-text-redundant", pdf_bytes, "pool-secret", "pool-key")
+        assert out.startswith(b"%PDF-")
+        assert wm.read_watermark("visible-text-redundant", out, "pool-key") == "pool-secret"
+    finally:
+        wm.configure_executor(0)
+
+
+def test_process_pool_timeout_spares_other_jobs():
+    """单个任务超时只让该调用失败：其他请求在同一池中的任务照常完成"""
+    import threading
+    import time
+
+    wm.configure_executor(2, timeout=3)
+    try:
+        results = {}
+
+        def slow_ok():
+            time.sleep(1.5)
+            try:
+                results["other"] = wm._run_pooled(time.sleep, 2.5)
+            except Exception as e:
+                results["other"] = e
+
+        t = threading.Thread(target=slow_ok)
+        t.start()
+        with pytest.raises(wm.WatermarkTimeoutError):
+            wm._run_pooled(time.sleep, 30)
+        t.join()
+        assert results["other"] is None
+        # 之后的任务在新的进程池中运行
+        assert wm._run_pooled(abs, -3) == 3
+    finally:
+        wm.configure_executor(0)
+
+
+def test_process_pool_rejects_when_queue_is_full():
+    """队列满时立即抛 ExecutorBusyError，而不是阻塞到任务超时"""
+    import threading
+    import time
+
+    wm.configure_executor(1, max_pending=1, queue_timeout=0, timeout=30)
+    try:
+        t = threading.Thread(target=wm._run_pooled, args=(time.sleep, 2))
+        t.start()
+        time.sleep(0.2)
+        t0 = time.perf_counter()
+        with pytest.raises(wm.ExecutorBusyError):
+            wm._run_pooled(abs, -1)
+        assert time.perf_counter() - t0 < 0.5
+        t.join()
+    finally:
+        wm.configure_executor(0)
+
+
+class _CountingView:
+    """包装 memoryview，统计被切片（即实际读取）的字节数。"""
+
+    def __init__(self, view):
+        self.view = view
+        self.touched = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, item):
+        part = self.view[item]
+        self.touched += len(part)
+        return part
+
+
+@contextlib.contextmanager
+def _counting_buffer(calls):
+    """替换 add_after_eof 中的 open_pdf_buffer，记录每次读取的字节数。"""
+    from server.src import add_after_eof
+    real = add_after_eof.open_pdf_buffer
+
+    @contextlib.contextmanager
+    def counting(src):
+        with real(src) as view:
+            counted = _CountingView(view)
+            calls.append(counted)
+            yield counted
+
+    with mock.patch.object(add_after_eof, "open_pdf_buffer", counting):
+        yield
+
+
+def test_trailer_read_only_touches_the_tail(sample_pdf, tmp_path):
+    """trailer-hmac 读取只看文件尾部：路径、文件对象、bytes 都可以"""
+    from server.src.add_after_eof import AddAfterEOF, TAIL_WINDOW
+
+    padded = sample_pdf.read_bytes() + b"%" + b"x" * (4 * 1024 * 1024) + b"\n"
+    out = wm.apply_watermark("trailer-hmac", padded, "tail-secret", "tail-key")
+    big = tmp_path / "big.pdf"
+    big.write_bytes(out)
+
+    calls = []
+    with _counting_buffer(calls):
+        assert wm.read_watermark("trailer-hmac", big, "tail-key") == "tail-secret"
+        with big.open("rb") as fh:
+            assert AddAfterEOF().read_secret(fh, "tail-key") == "tail-secret"
+            # 文件对象没有被整体读入（mmap 访问，不移动文件位置）
+            assert fh.tell() == 0
+    # 4 MiB 的文件，每次只读一个尾部窗口
+    assert [c.touched for c in calls] == [TAIL_WINDOW, TAIL_WINDOW]
+    assert AddAfterEOF().read_secret(memoryview(out), "tail-key") == "tail-secret"
+
+    # trailer 大于初始窗口时会扩大窗口继续查找
+    long_secret = "s" * (TAIL_WINDOW * 2)
+    out = wm.apply_watermark("trailer-hmac", padded, long_secret, "tail-key")
+    assert wm.read_watermark("trailer-hmac", out, "tail-key") == long_secret
+
+
+def test_trailer_read_without_trailer_is_bounded(sample_pdf, tmp_path):
+    """没有水印的大文件只读一个尾部窗口，不会把窗口扩大到整个文件"""
+    from server.src.add_after_eof import AddAfterEOF, TAIL_WINDOW, TAIL_WINDOW_MAX
+
+    big = tmp_path / "clean.pdf"
+    big.write_bytes(sample_pdf.read_bytes() + b"%" + b"x" * (8 * 1024 * 1024) + b"\n")
+
+    calls = []
+    with _counting_buffer(calls):
+        with pytest.raises(ValueError):
+            AddAfterEOF().read_secret(big, "k")
+    assert calls[0].touched == TAIL_WINDOW
+
+    # 只有结束标记（trailer 被截断）时扩大窗口，但不超过上限
+    big.write_bytes(big.read_bytes() + b"A" * (4 * 1024 * 1024) + b"\n%%CUSTOM-WM-END\n")
+    calls = []
+    with _counting_buffer(calls):
+        with pytest.raises(ValueError):
+            AddAfterEOF().read_secret(big, "k")
+    assert TAIL_WINDOW < calls[0].touched <= 2 * TAIL_WINDOW_MAX
+
+
+def test_open_pdf_buffer_is_zero_copy(sample_pdf):
+    """open_pdf_buffer 对 bytearray/mmap/路径都不复制数据"""
+    import mmap
+    from server.src.watermarking_method import open_pdf_buffer
+
+    data = bytearray(sample_pdf.read_bytes())
+    with open_pdf_buffer(data) as view:
+        assert view.readonly and view.obj is data
+        assert view[:5].tobytes() == b"%PDF-"
+
+    with sample_pdf.open("rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        with open_pdf_buffer(mm) as view:
+            assert view.obj is mm
+        mm.close()
+
+    with open_pdf_buffer(sample_pdf) as view:
+        assert isinstance(view.obj, mmap.mmap)
+        assert len(view) == sample_pdf.stat().st_size
+
+    with pytest.raises(ValueError):
+        with open_pdf_buffer(b"not a pdf"):
+            pass
+
+    # 接受缓冲区的方法可以直接处理 memoryview/mmap，结果与 bytes 一致
+    assert wm.accepts_buffer(wm.METHODS["trailer-hmac"])
+    assert not wm.accepts_buffer(wm.METHODS["metadata-xmp"])
+
+    out_view = wm.apply_watermark("trailer-hmac", memoryview(data), "s", "k")
+    assert out_view == wm.apply_watermark("trailer-hmac", bytes(data), "s", "k")
+    assert wm.read_watermark("trailer-hmac", memoryview(out_view), "k") == "s"
+
+
+def test_metadata_watermark_incremental_update():
+    """metadata-xmp 只在原始字节后追加增量更新"""
+    pikepdf = pytest.importorskip("pikepdf")
+    import io
+    from server.src.metadata_watermark import MetadataWatermark
+
+    src = pikepdf.new()
+    src.add_blank_page()
+    buf = io.BytesIO()
+    src.save(buf)
+    original = buf.getvalue()
+
+    m = MetadataWatermark()
+    out = m.add_watermark(original, "inc-secret", "inc-key")
+    # 原始字节原样保留，只追加 Metadata 流、目录和新的 xref 段
+    assert out.startswith(original)
+    assert out.count(b"%%EOF") == original.count(b"%%EOF") + 1
+    assert len(out) - len(original) < 4096
+    assert m.read_secret(out, "inc-key") == "inc-secret"
+
+    # 再次嵌入时只替换 Metadata 对象
+    again = m.add_watermark(out, "second", "inc-key")
+    assert again.startswith(out)
+    assert m.read_secret(again, "inc-key") == "second"
+    with pikepdf.open(io.BytesIO(again)) as pdf:
+        assert len(pdf.pages) == 1
+
+    # 关闭增量模式时完整重写
+    m.incremental = False
+    assert not m.add_watermark(original, "inc-secret", "inc-key").startswith(original)
+
+
+def test_visible_text_incremental_output():
+    """visible-text-redundant 增量写出：原始字节是输出前缀"""
+    fitz = pytest.importorskip("fitz")
+    from server.src.visible_text import VisibleTextWatermark
+
+    src = fitz.open()
+    for _ in range(3):
+        src.new_page()
+    original = src.tobytes()
+    src.close()
+
+    m = VisibleTextWatermark()
+    out = m.add_watermark(original, "vis-secret", "vis-key")
+    assert out.startswith(original)
+    # 相同输入输出确定
+    assert out == m.add_watermark(original, "vis-secret", "vis-key")
+    assert m.read_secret(out, "vis-key") == "vis-secret"
+    doc = fitz.open(stream=out, filetype="pdf")
+    assert "vis-secret" in doc[2].get_text()
+    doc.close()
+
+
+def test_visible_text_shares_one_xobject_per_page_size():
+    """同尺寸页面共用同一个水印 XObject"""
+    fitz = pytest.importorskip("fitz")
+    from server.src.visible_text import VisibleTextWatermark
+
+    src = fitz.open()
+    for i in range(6):
+        src.new_page(width=612 if i < 4 else 595, height=792 if i < 4 else 842)
+    original = src.tobytes()
+    src.close()
+
+    out = VisibleTextWatermark().add_watermark(original, "shared-secret", "k")
+    doc = fitz.open(stream=out, filetype="pdf")
+    stamp_xrefs = []
+    for page in doc:
+        assert "shared-secret" in page.get_text()
+        stamp_xrefs.append({x[0] for x in page.get_xobjects() if x[2] == 0})
+    # 前四页（Letter）一组，后两页（A4）一组
+    assert stamp_xrefs[0] == stamp_xrefs[1] == stamp_xrefs[2] == stamp_xrefs[3]
+    assert stamp_xrefs[4] == stamp_xrefs[5]
+    assert stamp_xrefs[0] != stamp_xrefs[4]
+    doc.close()
+
+
+def test_visible_text_mixed_cropbox_and_rotation_with_shared_resources():
+    """MediaBox 相同但 CropBox/Rotate 不同的页面不能共用水印（共享 /Resources）"""
+    fitz = pytest.importorskip("fitz")
+    from server.src.visible_text import VisibleTextWatermark
+
+    src = fitz.open()
+    for _ in range(5):
+        src.new_page(width=612, height=792)
+    res = src.get_new_xref()
+    src.update_object(res, "<<>>")
+    for page in src:
+        src.xref_set_key(page.xref, "Resources", f"{res} 0 R")
+    src[2].set_rotation(90)
+    src[3].set_cropbox(fitz.Rect(100, 100, 400, 500))
+    src[4].set_cropbox(fitz.Rect(100, 100, 400, 500))
+    original = src.tobytes()
+    src.close()
+
+    out = VisibleTextWatermark().add_watermark(original, "crop-wm", "k")
+    doc = fitz.open(stream=out, filetype="pdf")
+    stamps = []
+    for page in doc:
+        # 文字落在该页可见区域内
+        hits = page.search_for("crop-wm")
+        assert hits and all(page.rect.contains(r) for r in hits)
+        # 资源是共享的，按内容流实际引用的名字找到本页用的 XObject
+        names = {x[1]: x[0] for x in page.get_xobjects()}
+        used = re.findall(rb"/(\w+) Do", page.read_contents())
+        stamps.append(names[used[-1].decode()])
+    assert stamps[0] == stamps[1]
+    assert stamps[3] == stamps[4]
+    assert len(set(stamps)) == 3
+    doc.close()
+
+
+@pytest.mark.parametrize("position,expected", [
+    (None, list(range(1, 11))),
+    ("first", [1]),
+    ("last", [10]),
+    ("2-4,last", [2, 3, 4, 10]),
+    ("every:4", [1, 5, 9]),
+    ("8-last", [8, 9, 10]),
+    ("9-20", [9, 10]),
+])
+def test_visible_text_page_selector(position, expected):
+    """visible-text-redundant 的 position 选择要加水印的页面"""
+    fitz = pytest.importorskip("fitz")
+
+    src = fitz.open()
+    for _ in range(10):
+        src.new_page()
+    original = src.tobytes()
+    src.close()
+
+    out = wm.apply_watermark("visible-text-redundant", original, "sel-secret", "k", position=position)
+    doc = fitz.open(stream=out, filetype="pdf")
+    stamped = [p.number + 1 for p in doc if "sel-secret" in p.get_text()]
+    doc.close()
+    assert stamped == expected
+    assert wm.read_watermark("visible-text-redundant", out, "k") == "sel-secret"
+
+
+def test_visible_text_legacy_position_means_all_pages():
+    """无法解析为选择器的 position（旧式的 br、eof 等）与 all 相同"""
+    fitz = pytest.importorskip("fitz")
+    from server.src.visible_text import _select_pages
+
+    src = fitz.open()
+    for _ in range(3):
+        src.new_page()
+    original = src.tobytes()
+    src.close()
+
+    for legacy in ("br", "eof", "center", "0", "5-2", "every:0", "1-x"):
+        assert wm.is_watermarking_applicable("visible-text-redundant", original, legacy) is True
+        assert _select_pages(legacy, 3) == [0, 1, 2]
+
+    out = wm.apply_watermark("visible-text-redundant", original, "br-secret", "k", position="br")
+    doc = fitz.open(stream=out, filetype="pdf")
+    assert all("br-secret" in p.get_text() for p in doc)
+    doc.close()
+
+
+def test_visible_text_selector_must_select_a_page():
+    """语法正确但超出页数的选择器在适用性检查时就被拒绝，而不是嵌入时报错"""
+    fitz = pytest.importorskip("fitz")
+
+    src = fitz.open()
+    for _ in range(3):
+        src.new_page()
+    original = src.tobytes()
+    src.close()
+
+    for position in ("10", "5-8"):
+        assert wm.is_watermarking_applicable("visible-text-redundant", original, position) is False
+    for position in ("3", "2-10", "last", "every:5"):
+        assert wm.is_watermarking_applicable("visible-text-redundant", original, position) is True
+
+
+def test_detect_watermark_tries_every_method(sample_pdf):
+    """method=auto：一次加载，依次尝试所有方法，返回匹配的方法名"""
+    import io
+    from server.src.watermarking_method import SecretNotFoundError
+
+    out = wm.apply_watermark("trailer-hmac", sample_pdf, "auto-secret", "auto-key")
+    assert wm.detect_watermark(out, "auto-key") == ("trailer-hmac", "auto-secret")
+    assert wm.read_watermark("auto", out, "auto-key") == "auto-secret"
+
+    meta = wm.apply_watermark("metadata-xmp", sample_pdf, "xmp-secret", "auto-key")
+    # 文件对象只能读一次：最后才尝试的 metadata-xmp 仍能读到，说明只加载了一次
+    assert wm.detect_watermark(io.BytesIO(meta), "auto-key") == ("metadata-xmp", "xmp-secret")
+
+    with pytest.raises(SecretNotFoundError):
+        wm.detect_watermark(out, "wrong-key")
+
+    # 路径输入：只读尾部的方法直接读文件，需要整份解析时才调用 load
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return path.read_bytes()
+
+    marked = sample_pdf.parent / "auto.pdf"
+    marked.write_bytes(out)
+    assert wm.detect_watermark(marked, "auto-key", load=lambda: load(marked)) == ("trailer-hmac", "auto-secret")
+    assert loads == []
+    marked.write_bytes(meta)
+    assert wm.detect_watermark(marked, "auto-key", load=lambda: load(marked)) == ("metadata-xmp", "xmp-secret")
+    assert loads == [marked]
+
+
+def test_peek_secrets_without_key(sample_pdf):
+    """不需要 key 即可取出（未校验的）secret"""
+    out = wm.apply_watermark("trailer-hmac", sample_pdf, "peek-secret", "peek-key")
+    assert wm.peek_secrets(out) == [("trailer-hmac", "peek-secret")]
+
+    meta = wm.apply_watermark("metadata-xmp", sample_pdf, "xmp-peek", "peek-key")
+    assert wm.peek_secrets(meta) == [("metadata-xmp", "xmp-peek")]
+    assert wm.peek_secrets(sample_pdf) == []